@@ -1,291 +1,509 @@
-# api.py
-# FastAPI wrapper для запуска обработки и отдачи результатов (Swagger UI готов).
-
-from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket
-from fastapi.responses import FileResponse
-from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-import uuid
-import os
-import shutil
-from concurrent.futures import ThreadPoolExecutor
-import time
-import asyncio
-import json
-import ast
-
-# импортируем вашу логику
-from main import process_video
-from config import OUTPUT_DIR, MODEL_PATH
-from utils import ensure_dir
-
-app = FastAPI(title="LeanVision Video Shift Analysis", version="0.1.0",
-              description="API для запуска анализа видео смен и получения клипов/событий (Swagger UI автоматически).")
-
-# CORS: укажите адреса фронтенда (добавляйте свои origin)
-origins = [
-    "http://localhost:3000",
-    "http://127.0.0.1:3000",
-]
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["GET","POST","PUT","DELETE","OPTIONS"],
-    allow_headers=["*"],
-)
-
-# директории
-UPLOAD_DIR = "uploads"
-ensure_dir(UPLOAD_DIR)
-ensure_dir(OUTPUT_DIR)
-
-# in-memory storage задач
-tasks: Dict[str, Dict[str, Any]] = {}
-executor = ThreadPoolExecutor(max_workers=2)
-
-# Pydantic модели
-class StartProcessRequest(BaseModel):
-    video_filename: Optional[str] = None   # имя файла в uploads
-    video_id: Optional[str] = None         # альтернатива
-    video_path: Optional[str] = None       # полный путь (danger: используйте осторожно)
-    conf: Optional[float] = None
-    every: Optional[int] = None
-    merge_sec: Optional[int] = None
-    finalize_delay: Optional[float] = None
-    save_immediately: Optional[bool] = False
-    workers: Optional[int] = None
-    webhook: Optional[str] = None
-
-class ProcessStatus(BaseModel):
-    task_id: str
-    status: str
-    started_at: Optional[float] = None
-    finished_at: Optional[float] = None
-    out_dir: Optional[str] = None
-    message: Optional[str] = None
-
-class EventResponse(BaseModel):
-    id: int
-    class_names: List[str]
-    confs: List[float]
-    time_s: float
-    frame_idx: int
-    clip_path: Optional[str]
-    saved: bool
-
-# helper runner
-def _run_processing(task_id: str, video_path: str, out_dir: str, params: dict):
-    tasks[task_id]["status"] = "running"
-    tasks[task_id]["started_at"] = time.time()
-    try:
-        # Вызов основной функции обработки (блокирующий). Она уже безопасно обрабатывает None.
-        process_video(
-            model_path=params.get("model_path", MODEL_PATH),
-            video_path=video_path,
-            out_dir=out_dir,
-            conf_thresh=params.get("conf", None),
-            detect_every_n=params.get("every", None),
-            merge_sec=params.get("merge_sec", None),
-            finalize_delay=params.get("finalize_delay", None),
-            save_immediately=params.get("save_immediately", False),
-            workers=params.get("workers", None),
-            webhook=params.get("webhook", None)
-        )
-        tasks[task_id]["status"] = "done"
-        tasks[task_id]["finished_at"] = time.time()
-        tasks[task_id]["message"] = "processed"
-    except Exception as e:
-        tasks[task_id]["status"] = "error"
-        tasks[task_id]["finished_at"] = time.time()
-        tasks[task_id]["message"] = str(e)
-
-@app.post("/videos/upload", response_model=Dict[str, str], tags=["videos"])
-async def upload_video(file: UploadFile = File(...)):
-    file_id = str(uuid.uuid4())
-    filename = f"{file_id}_{file.filename}"
-    dest = os.path.join(UPLOAD_DIR, filename)
-    try:
-        with open(dest, "wb") as f:
-            content = await file.read()
-            f.write(content)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"cannot save file: {e}")
-    return {"video_id": filename, "path": dest}
-
-@app.post("/process/start", response_model=ProcessStatus, tags=["process"])
-def start_process(req: StartProcessRequest):
-    # Определяем путь к видео (принимаем video_filename, video_id или video_path)
-    video_path = None
-    if req.video_path:
-        video_path = req.video_path
-    elif req.video_filename:
-        video_path = os.path.join(UPLOAD_DIR, req.video_filename)
-    elif req.video_id:
-        video_path = os.path.join(UPLOAD_DIR, req.video_id)
-
-    if not video_path or not os.path.exists(video_path):
-        raise HTTPException(status_code=400, detail="specify existing video_filename/video_id or provide valid video_path")
-
-    task_id = str(uuid.uuid4())
-    out_dir = os.path.join(OUTPUT_DIR, f"task_{task_id}")
-    ensure_dir(out_dir)
-
-    tasks[task_id] = {
-        "task_id": task_id,
-        "status": "queued",
-        "video": video_path,
-        "out_dir": out_dir,
-        "params": req.model_dump(),
-        "started_at": None,
-        "finished_at": None,
-        "message": None
-    }
-
-    # запускаем в пуле (не блокируем FastAPI)
-    executor.submit(_run_processing, task_id, video_path, out_dir, tasks[task_id]["params"])
-
-    return ProcessStatus(task_id=task_id, status="queued", out_dir=out_dir)
-
-@app.get("/process/{task_id}", response_model=ProcessStatus, tags=["process"])
-def get_process_status(task_id: str):
-    task = tasks.get(task_id)
-    if not task:
-        raise HTTPException(status_code=404, detail="task not found")
-    return ProcessStatus(
-        task_id=task_id,
-        status=task["status"],
-        started_at=task["started_at"],
-        finished_at=task["finished_at"],
-        out_dir=task["out_dir"],
-        message=task["message"]
-    )
-
-@app.get("/process/{task_id}/clips", tags=["process"])
-def list_clips_for_task(task_id: str):
-    task = tasks.get(task_id)
-    if not task:
-        raise HTTPException(status_code=404, detail="task not found")
-    out_dir = task["out_dir"]
-    clips = []
-    if os.path.exists(out_dir):
-        for root, _, files in os.walk(out_dir):
-            for name in files:
-                if name.endswith('.mp4'):
-                    clip_path = os.path.join(root, name)
-                    rel = os.path.relpath(clip_path, OUTPUT_DIR).replace(os.path.sep, '/')
-                    clips.append({
-                        "name": name,
-                        "clip_url": f"/static/{rel}",
-                        "thumbnail_url": None
-                    })
-    return clips
-
-@app.get("/events", response_model=List[EventResponse], tags=["events"])
-def list_events(limit: int = 50):
-    rows = []
-    for sub in os.listdir(OUTPUT_DIR):
-        candidate = os.path.join(OUTPUT_DIR, sub, "violations_events.csv")
-        if os.path.exists(candidate):
-            import pandas as pd
-            try:
-                df = pd.read_csv(candidate)
-                for _, r in df.iterrows():
-                    # Парсим поля class_names/confs которые могли быть сохранены как питоновские/JSON-строки
-                    try:
-                        class_names = json.loads(r.get("class_names")) if isinstance(r.get("class_names"), str) else r.get("class_names")
-                    except Exception:
-                        try:
-                            class_names = ast.literal_eval(r.get("class_names"))
-                        except Exception:
-                            class_names = [r.get("class_names")]
-                    try:
-                        confs = json.loads(r.get("confs")) if isinstance(r.get("confs"), str) else r.get("confs")
-                    except Exception:
-                        try:
-                            confs = ast.literal_eval(r.get("confs"))
-                        except Exception:
-                            confs = []
-                    rows.append({
-                        "id": int(r.get("id", 0)),
-                        "class_names": class_names if isinstance(class_names, list) else [class_names],
-                        "confs": confs if isinstance(confs, list) else [],
-                        "time_s": float(r.get("time_s", 0.0)),
-                        "frame_idx": int(r.get("frame_idx", 0)),
-                        "clip_path": r.get("clip_path", None),
-                        "saved": bool(r.get("saved", False))
-                    })
-            except Exception:
-                continue
-    rows = rows[:limit]
-    return [EventResponse(**r) for r in rows]
-
-@app.get("/events/{event_id}", response_model=EventResponse, tags=["events"])
-def get_event(event_id: int):
-    for sub in os.listdir(OUTPUT_DIR):
-        candidate = os.path.join(OUTPUT_DIR, sub, "violations_events.csv")
-        if os.path.exists(candidate):
-            import pandas as pd
-            df = pd.read_csv(candidate)
-            for _, r in df.iterrows():
-                if int(r.get("id", 0)) == event_id:
-                    try:
-                        class_names = json.loads(r.get("class_names")) if isinstance(r.get("class_names"), str) else r.get("class_names")
-                    except Exception:
-                        try:
-                            class_names = ast.literal_eval(r.get("class_names"))
-                        except Exception:
-                            class_names = [r.get("class_names")]
-                    try:
-                        confs = json.loads(r.get("confs")) if isinstance(r.get("confs"), str) else r.get("confs")
-                    except Exception:
-                        try:
-                            confs = ast.literal_eval(r.get("confs"))
-                        except Exception:
-                            confs = []
-                    obj = {
-                        "id": int(r.get("id", 0)),
-                        "class_names": class_names if isinstance(class_names, list) else [class_names],
-                        "confs": confs if isinstance(confs, list) else [],
-                        "time_s": float(r.get("time_s", 0.0)),
-                        "frame_idx": int(r.get("frame_idx", 0)),
-                        "clip_path": r.get("clip_path", None),
-                        "saved": bool(r.get("saved", False))
-                    }
-                    return EventResponse(**obj)
-    raise HTTPException(status_code=404, detail="event not found")
-
-@app.get("/events/{event_id}/clip", tags=["events"])
-def download_clip(event_id: int):
-    for sub in os.listdir(OUTPUT_DIR):
-        candidate = os.path.join(OUTPUT_DIR, sub, "violations_events.csv")
-        if os.path.exists(candidate):
-            import pandas as pd
-            df = pd.read_csv(candidate)
-            for _, r in df.iterrows():
-                if int(r.get("id", 0)) == event_id:
-                    clip = r.get("clip_path", None)
-                    if clip and os.path.exists(clip):
-                        return FileResponse(clip, media_type="video/mp4", filename=os.path.basename(clip))
-                    raise HTTPException(status_code=404, detail="clip not found on disk")
-    raise HTTPException(status_code=404, detail="event not found")
-
-@app.websocket("/ws/tasks/{task_id}")
-async def ws_task_status(websocket: WebSocket, task_id: str):
-    await websocket.accept()
-    try:
-        while True:
-            task = tasks.get(task_id)
-            await websocket.send_json(task or {"status":"not_found"})
-            await asyncio.sleep(1.0)
-    except Exception:
-        await websocket.close()
-
-@app.get("/health", tags=["system"])
-def health():
-    return {"status": "ok", "tasks": len(tasks)}
-
-# Static files for clips (serve via Nginx in prod)
-from fastapi.staticfiles import StaticFiles
-app.mount("/static", StaticFiles(directory=OUTPUT_DIR), name="static")
+# api.py
+# FastAPI wrapper для запуска обработки и отдачи результатов (Swagger UI готов).
+
+from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import FileResponse, Response
+from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
+from typing import List, Optional
+import uuid
+import os
+import json
+import hashlib
+import shutil
+import contextlib
+
+import anyio
+
+# импортируем вашу логику
+from config import (OUTPUT_DIR, MODEL_PATH, EVENT_INDEX_PATH, SCHEDULER_WORKERS, SCHEDULER_MAX_QUEUE, TASK_STORE_PATH,
+                    RESULT_CACHE_PATH, RESULT_CACHE_MAX_BYTES, RAW_CACHE_DIR, METRICS_DIR, MOTION_GATE,
+                    STREAM_CAMERAS, STREAM_ALLOWED_SCHEMES, STREAM_ALLOWED_HOSTS, INFER_BACKEND)
+import metrics
+from utils import ensure_dir
+from event_index import EventIndex
+from task_store import TaskStore, QueueFullError
+from upload_store import UploadStore, UploadOffsetError, UploadIncompleteError, UploadSizeError
+from result_cache import ResultCache
+from raw_cache import raw_cache_path
+from flight_recorder import TRACE_FILE
+from stream import resolve_client_source
+from model_iface import resolve_backend
+from scheduler import Scheduler, run_job, warm_worker, probe_duration
+from task_hub import TaskHub
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # планировщик (поток диспетчера и процессы воркеров) живёт вместе с сервером, а не с импортом модуля
+    scheduler.start()
+    try:
+        yield
+    finally:
+        scheduler.shutdown(wait=False)
+
+app = FastAPI(title="LeanVision Video Shift Analysis", version="0.1.0", lifespan=lifespan,
+              description="API для запуска анализа видео смен и получения клипов/событий (Swagger UI автоматически).")
+
+# CORS: укажите адреса фронтенда (добавляйте свои origin)
+origins = [
+    "http://localhost:3000",
+    "http://127.0.0.1:3000",
+]
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=origins,
+    allow_credentials=True,
+    allow_methods=["GET","POST","PUT","DELETE","OPTIONS"],
+    allow_headers=["*"],
+)
+
+# директории
+UPLOAD_DIR = "uploads"
+ensure_dir(UPLOAD_DIR)
+upload_store = UploadStore(UPLOAD_DIR)
+ensure_dir(OUTPUT_DIR)
+
+# хранилище задач в SQLite: общее для всех процессов uvicorn и переживает перезапуск
+task_store = TaskStore(TASK_STORE_PATH)
+# индекс событий всех результатов (заполняется по завершении задачи, старые — `python event_index.py backfill`)
+event_index = EventIndex(EVENT_INDEX_PATH)
+# кэш готовых результатов по (видео, модель, параметры); вытесненные результаты убираются и из индекса
+result_cache = ResultCache(RESULT_CACHE_PATH, max_bytes=RESULT_CACHE_MAX_BYTES, on_evict=event_index.remove_task)
+
+# Pydantic модели
+class StartProcessRequest(BaseModel):
+    video_filename: Optional[str] = None   # имя файла в uploads
+    video_id: Optional[str] = None         # альтернатива
+    video_path: Optional[str] = None       # полный путь (danger: используйте осторожно)
+    conf: Optional[float] = None
+    every: Optional[int] = None
+    merge_sec: Optional[int] = None
+    finalize_delay: Optional[float] = None
+    save_immediately: Optional[bool] = False
+    workers: Optional[int] = None
+    webhook: Optional[str] = None
+    batch_size: Optional[int] = None       # кадров в одном батче инференса
+    pipelined: Optional[bool] = False      # декодирование/инференс/события в отдельных потоках
+    compress_buffer: Optional[bool] = None # буфер кадров для клипов в JPEG (экономия памяти)
+    clips_from_source: Optional[bool] = None  # клипы из исходного файла (seek), без буфера кадров
+    report_formats: Optional[List[str]] = None  # ["parquet", "csv"]
+    priority: Optional[int] = 0            # больше — раньше в очереди
+    use_cache: Optional[bool] = True       # отдать готовый результат, если это видео уже обработано с теми же настройками
+    violation_classes: Optional[List[str]] = None  # классы-нарушения (по умолчанию VIOLATION_CLASSES из config)
+    replay: Optional[bool] = False         # пересобрать события из кэша сырых детекций этого видео, без модели
+    motion_gate: Optional[bool] = None     # не запускать модель на кадрах без движения
+    roi: Optional[dict] = None             # зоны интереса: {"regions": [{"name", "rect" | "polygon"}], "pad"}
+    trace: Optional[bool] = False          # таймлайн стадий в trace.json (/process/{task_id}/trace); без кэша результатов
+    trace_sample_every: Optional[int] = None  # трассировать каждое N-е окно кадров (длинные смены)
+    backend: Optional[str] = None          # бэкенд модели: auto, torch, onnx, openvino (по умолчанию INFER_BACKEND)
+
+class StartStreamRequest(BaseModel):
+    source: str                            # id камеры из STREAM_CAMERAS, rtsp/http URL разрешённого хоста или synthetic://WxH@FPS
+    conf: Optional[float] = None
+    every: Optional[int] = None
+    merge_sec: Optional[int] = None
+    finalize_delay: Optional[float] = None
+    save_immediately: Optional[bool] = False
+    workers: Optional[int] = None
+    webhook: Optional[str] = None
+    batch_size: Optional[int] = None
+    report_formats: Optional[List[str]] = None
+    violation_classes: Optional[List[str]] = None
+    duration_s: Optional[float] = None     # None — пока не остановят через /process/{task_id}/stop
+    motion_gate: Optional[bool] = None
+    roi: Optional[dict] = None
+    priority: Optional[int] = 0
+    backend: Optional[str] = None
+
+class UploadResponse(BaseModel):
+    video_id: str                      # имя файла в uploads (<sha256><ext>)
+    path: str
+    sha256: str
+    size: int
+    filename: Optional[str] = None     # исходное имя файла
+    deduplicated: bool = False         # такое содержимое уже было загружено
+
+class ResumableUploadRequest(BaseModel):
+    filename: Optional[str] = None
+    size: Optional[int] = None         # ожидаемый размер: complete проверит, что всё докачано
+
+class ResumableUploadStatus(BaseModel):
+    upload_id: str
+    offset: int                        # сколько байт уже принято — следующий чанк с этого смещения
+    filename: Optional[str] = None
+    size: Optional[int] = None
+
+class ProcessStatus(BaseModel):
+    task_id: str
+    status: str
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    out_dir: Optional[str] = None
+    message: Optional[str] = None
+    position: Optional[int] = None    # место в очереди (0 — следующая), пока задача ждёт
+    eta_s: Optional[float] = None     # оценка секунд до завершения
+
+class EventResponse(BaseModel):
+    id: int                          # глобальный id события (из индекса)
+    task: Optional[str] = None       # директория результата в OUTPUT_DIR
+    event_id: Optional[int] = None   # номер события внутри задачи
+    class_names: List[str]
+    confs: List[float]
+    time_s: float
+    frame_idx: int
+    clip_path: Optional[str]
+    saved: bool
+
+# helper runner
+def _process_kwargs(video_path: str, out_dir: str, params: dict) -> dict:
+    # Аргументы process_video; незаданные (None) не передаём — действуют значения по умолчанию из config
+    # (так же их нормализует ключ кэша результатов). Выполняется в воркере планировщика.
+    kwargs = dict(
+        model_path=params.get("model_path", MODEL_PATH),
+        video_path=video_path,
+        out_dir=out_dir,
+        conf_thresh=params.get("conf", None),
+        detect_every_n=params.get("every", None),
+        merge_sec=params.get("merge_sec", None),
+        finalize_delay=params.get("finalize_delay", None),
+        save_immediately=params.get("save_immediately", False),
+        workers=params.get("workers", None),
+        webhook=params.get("webhook", None),
+        batch_size=params.get("batch_size", None),
+        pipelined=params.get("pipelined", False),
+        compress_buffer=params.get("compress_buffer", None),
+        clips_from_source=params.get("clips_from_source", None),
+        report_formats=params.get("report_formats", None),
+        violation_classes=params.get("violation_classes", None),
+        raw_cache_path=params.get("raw_cache_path", None),
+        motion_gate=params.get("motion_gate", None),
+        roi=params.get("roi", None),
+        trace=params.get("trace", None),
+        trace_sample_every=params.get("trace_sample_every", None),
+        backend=params.get("backend", None)
+    )
+    return {k: v for k, v in kwargs.items() if v is not None}
+
+
+def _replay_kwargs(video_path: str, out_dir: str, params: dict) -> dict:
+    # Аргументы replay_video: модель, батчи и буфер кадров не нужны (клипы режутся из исходного файла)
+    kwargs = _process_kwargs(video_path, out_dir, params)
+    for name in ("model_path", "batch_size", "pipelined", "compress_buffer", "clips_from_source", "motion_gate",
+                 "roi", "trace", "trace_sample_every", "backend"):
+        kwargs.pop(name, None)
+    return {"mode": "replay", **kwargs}
+
+
+def _raw_cache_for(video_path: str, model_path: str, roi: Optional[dict] = None,
+                   backend: str = "torch") -> Optional[str]:
+    # Кэш сырых детекций привязан к содержимому видео и файла модели (и к зонам ROI и бэкенду, отличному
+    # от torch, — они меняют выход модели)
+    if not os.path.exists(model_path):
+        return None
+    model = result_cache.file_hash(model_path)
+    if backend != "torch":
+        model = hashlib.sha256(f"{model}:{backend}".encode()).hexdigest()
+    if roi:
+        model = hashlib.sha256((model + json.dumps(roi, sort_keys=True)).encode()).hexdigest()
+    return raw_cache_path(RAW_CACHE_DIR, result_cache.file_hash(video_path), model)
+
+def _on_task_done(task_id: str):
+    task = task_store.get(task_id)
+    event_index.index_task(os.path.basename(task["out_dir"]), task["out_dir"])
+    if task["cache_key"]:
+        result_cache.put(task["cache_key"], task_id, task["out_dir"])
+
+# прогресс и события задач для /ws/tasks: воркеры этого процесса присылают их через планировщик
+task_hub = TaskHub(task_store.get)
+
+def _on_task_update(task_id: str, msg: dict):
+    if msg.get("type") == "status":
+        msg = {"type": "task", "task": task_store.get(task_id)}
+    task_hub.publish(task_id, msg)
+
+# задачи выполняются в процессах с заранее загруженной моделью; очередь (с приоритетами) — в task_store
+scheduler = Scheduler(task_store, run_job, workers=SCHEDULER_WORKERS,
+                      initializer=warm_worker, initargs=(MODEL_PATH,), on_done=_on_task_done,
+                      on_update=_on_task_update)
+
+async def _upload_chunks(file: UploadFile):
+    while chunk := await file.read(upload_store.chunk_size):
+        yield chunk
+
+@app.post("/videos/upload", response_model=UploadResponse, tags=["videos"])
+async def upload_video(file: UploadFile = File(...)):
+    # файл пишется чанками, SHA-256 считается на лету; одинаковое содержимое хранится один раз
+    try:
+        result = await upload_store.save(_upload_chunks(file), file.filename)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"cannot save file: {e}")
+    # хэш уже посчитан — кэшу результатов не придётся перечитывать файл
+    result_cache.remember_hash(result["path"], result["sha256"])
+    return result
+
+@app.post("/videos/uploads", response_model=ResumableUploadStatus, tags=["videos"])
+def begin_upload(req: ResumableUploadRequest):
+    """Начать докачиваемую загрузку: дальше PATCH /videos/uploads/{id}?offset=N с телом-чанком."""
+    return upload_store.begin(req.filename, req.size)
+
+@app.get("/videos/uploads/{upload_id}", response_model=ResumableUploadStatus, tags=["videos"])
+def get_upload(upload_id: str):
+    try:
+        return upload_store.status(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="upload not found")
+
+@app.patch("/videos/uploads/{upload_id}", response_model=ResumableUploadStatus, tags=["videos"])
+async def append_upload(upload_id: str, offset: int, request: Request):
+    """Дописать тело запроса с байта offset. При несовпадении смещения — 409 с актуальным offset;
+    данные сверх заявленного size — 413 (принятое до size остаётся, offset в ответе)."""
+    try:
+        await upload_store.append(upload_id, offset, request.stream())
+        return upload_store.status(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="upload not found")
+    except UploadOffsetError as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "offset": e.expected})
+    except UploadSizeError as e:
+        raise HTTPException(status_code=413, detail={"message": str(e), "offset": e.offset, "size": e.size})
+
+@app.post("/videos/uploads/{upload_id}/complete", response_model=UploadResponse, tags=["videos"])
+async def complete_upload(upload_id: str):
+    try:
+        result = await upload_store.complete(upload_id)
+        result_cache.remember_hash(result["path"], result["sha256"])
+        return result
+    except KeyError:
+        raise HTTPException(status_code=404, detail="upload not found")
+    except UploadIncompleteError as e:
+        # offset — сколько уже принято (с него продолжать докачку), size — заявленный размер
+        raise HTTPException(status_code=409, detail={"message": str(e), "offset": e.offset, "size": e.size})
+    except UploadSizeError as e:
+        raise HTTPException(status_code=413, detail={"message": str(e), "offset": e.offset, "size": e.size})
+
+@app.post("/process/start", response_model=ProcessStatus, tags=["process"])
+def start_process(req: StartProcessRequest):
+    # Определяем путь к видео (принимаем video_filename, video_id или video_path)
+    video_path = None
+    if req.video_path:
+        video_path = req.video_path
+    elif req.video_filename:
+        video_path = os.path.join(UPLOAD_DIR, req.video_filename)
+    elif req.video_id:
+        video_path = os.path.join(UPLOAD_DIR, req.video_id)
+
+    if not video_path or not os.path.exists(video_path):
+        raise HTTPException(status_code=400, detail="specify existing video_filename/video_id or provide valid video_path")
+
+    task_id = str(uuid.uuid4())
+    params = req.model_dump()
+    model_path = params.get("model_path") or MODEL_PATH
+    try:
+        # бэкенд фиксируется при постановке: он входит в ключи кэшей и уходит воркеру уже разрешённым
+        params["backend"] = resolve_backend(model_path, req.backend or INFER_BACKEND)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # то же видео (по содержимому) той же моделью с теми же настройками уже обработано — отдаём готовое
+    cache_key = None
+    if req.use_cache is not False and not req.trace:
+        cache_key = result_cache.key(video_path, model_path, params)
+        hit = result_cache.get(cache_key)
+        if hit:
+            message = f"cached result of task {hit['task_id']}"
+            task_store.create_done(task_id, video_path, hit["out_dir"], params, message, cache_key=cache_key)
+            task = task_store.get(task_id)
+            return ProcessStatus(task_id=task_id, status="done", started_at=task["started_at"],
+                                 finished_at=task["finished_at"], out_dir=hit["out_dir"], message=message)
+
+    # сырые детекции: обычный прогон сохраняет их (если ещё нет), replay пересобирает из них события.
+    # Прогон с гейтом движения кэш не пишет — в нём нет выходов модели для пропущенных кадров
+    raw_path = _raw_cache_for(video_path, model_path, req.roi, params["backend"])
+    raw_exists = raw_path is not None and os.path.exists(raw_path)
+    if req.replay and not raw_exists:
+        raise HTTPException(status_code=400, detail="no raw detections cached for this video and model; run it once without replay")
+    gated = req.motion_gate if req.motion_gate is not None else MOTION_GATE
+
+    out_dir = os.path.join(OUTPUT_DIR, f"task_{task_id}")
+    ensure_dir(out_dir)
+    if req.replay:
+        job = _replay_kwargs(video_path, out_dir, dict(params, raw_cache_path=raw_path))
+    else:
+        record = raw_path if not raw_exists and not gated else None
+        job = _process_kwargs(video_path, out_dir, dict(params, raw_cache_path=record))
+
+    # ставим в очередь (не блокируем FastAPI); при переполненной очереди — 429
+    try:
+        position = task_store.create(task_id, video_path, out_dir, params, job,
+                                     priority=req.priority or 0, video_s=probe_duration(video_path),
+                                     max_queue=SCHEDULER_MAX_QUEUE, cache_key=cache_key)
+    except QueueFullError as e:
+        shutil.rmtree(out_dir, ignore_errors=True)
+        raise HTTPException(status_code=429, detail=str(e))
+    scheduler.wake()
+
+    return ProcessStatus(task_id=task_id, status="queued", out_dir=out_dir, position=position,
+                         eta_s=scheduler.eta(task_id))
+
+STOP_FILE = "STOP"
+
+@app.post("/streams/start", response_model=ProcessStatus, tags=["process"])
+def start_stream(req: StartStreamRequest):
+    # Живой поток занимает воркер планировщика до остановки; отчёты и индекс событий обновляются по ходу
+    try:
+        source = resolve_client_source(req.source, STREAM_CAMERAS, STREAM_ALLOWED_SCHEMES, STREAM_ALLOWED_HOSTS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    task_id = str(uuid.uuid4())
+    params = req.model_dump()
+    try:
+        params["backend"] = resolve_backend(MODEL_PATH, req.backend or INFER_BACKEND)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    out_dir = os.path.join(OUTPUT_DIR, f"task_{task_id}")
+    ensure_dir(out_dir)
+    job = _process_kwargs(source, out_dir, params)
+    for name in ("video_path", "pipelined", "compress_buffer", "clips_from_source"):
+        job.pop(name, None)
+    job.update(mode="stream", source=source, event_index_path=EVENT_INDEX_PATH,
+               stop_file=os.path.join(out_dir, STOP_FILE))
+    if req.duration_s is not None:
+        job["duration_s"] = req.duration_s
+    try:
+        position = task_store.create(task_id, req.source, out_dir, params, job, priority=req.priority or 0,
+                                     video_s=req.duration_s or 0.0, max_queue=SCHEDULER_MAX_QUEUE)
+    except QueueFullError as e:
+        shutil.rmtree(out_dir, ignore_errors=True)
+        raise HTTPException(status_code=429, detail=str(e))
+    scheduler.wake()
+    return ProcessStatus(task_id=task_id, status="queued", out_dir=out_dir, position=position)
+
+@app.post("/process/{task_id}/stop", response_model=ProcessStatus, tags=["process"])
+def stop_stream(task_id: str):
+    # Флаг-файл в out_dir: его видит воркер в любом процессе; поток завершится на ближайшем сбросе отчётов
+    task = task_store.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="task not found")
+    if task["status"] in ("queued", "running"):
+        open(os.path.join(task["out_dir"], STOP_FILE), "w").close()
+    return ProcessStatus(task_id=task_id, status=task["status"], started_at=task["started_at"],
+                         finished_at=task["finished_at"], out_dir=task["out_dir"], message="stop requested")
+
+@app.get("/process/{task_id}", response_model=ProcessStatus, tags=["process"])
+def get_process_status(task_id: str):
+    task = task_store.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="task not found")
+    return ProcessStatus(
+        task_id=task_id,
+        status=task["status"],
+        started_at=task["started_at"],
+        finished_at=task["finished_at"],
+        out_dir=task["out_dir"],
+        message=task["message"],
+        position=scheduler.position(task_id) if task["status"] == "queued" else None,
+        eta_s=scheduler.eta(task_id) if task["status"] in ("queued", "running") else None
+    )
+
+@app.get("/process/{task_id}/trace", tags=["process"])
+def download_trace(task_id: str):
+    # Chrome trace / Perfetto JSON задачи, запущенной с trace=true (пишется по завершении обработки)
+    task = task_store.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="task not found")
+    path = os.path.join(task["out_dir"], TRACE_FILE)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="no trace for this task (start it with trace=true)")
+    return FileResponse(path, media_type="application/json", filename=f"trace_{task_id}.json")
+
+@app.get("/process/{task_id}/clips", tags=["process"])
+def list_clips_for_task(task_id: str):
+    task = task_store.get(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="task not found")
+    out_dir = task["out_dir"]
+    clips = []
+    if os.path.exists(out_dir):
+        for root, _, files in os.walk(out_dir):
+            for name in files:
+                if name.endswith('.mp4'):
+                    clip_path = os.path.join(root, name)
+                    rel = os.path.relpath(clip_path, OUTPUT_DIR).replace(os.path.sep, '/')
+                    clips.append({
+                        "name": name,
+                        "clip_url": f"/static/{rel}",
+                        "thumbnail_url": None
+                    })
+    return clips
+
+def _event_response(r: dict) -> EventResponse:
+    return EventResponse(id=r["id"], task=r["task"], event_id=r["event_id"], class_names=r["class_names"],
+                         confs=r["confs"], time_s=r["time_s"], frame_idx=r["frame_idx"], clip_path=r["clip_path"],
+                         saved=r["saved"])
+
+@app.get("/events", response_model=List[EventResponse], tags=["events"])
+def list_events(limit: int = 50, after: Optional[int] = None, task: Optional[str] = None,
+                class_name: Optional[str] = None, time_from: Optional[float] = None, time_to: Optional[float] = None):
+    """События по возрастанию id. Следующая страница: after=<id последнего события>."""
+    rows = event_index.list(limit=limit, after=after, task=task, class_name=class_name,
+                            time_from=time_from, time_to=time_to)
+    return [_event_response(r) for r in rows]
+
+@app.get("/events/{event_id}", response_model=EventResponse, tags=["events"])
+def get_event(event_id: int):
+    r = event_index.get(event_id)
+    if r is None:
+        raise HTTPException(status_code=404, detail="event not found")
+    return _event_response(r)
+
+@app.get("/events/{event_id}/clip", tags=["events"])
+def download_clip(event_id: int):
+    r = event_index.get(event_id)
+    if r is None:
+        raise HTTPException(status_code=404, detail="event not found")
+    clip = r["clip_path"]
+    if clip and os.path.exists(clip):
+        return FileResponse(clip, media_type="video/mp4", filename=os.path.basename(clip))
+    raise HTTPException(status_code=404, detail="clip not found on disk")
+
+@app.websocket("/ws/tasks/{task_id}")
+async def ws_task_status(websocket: WebSocket, task_id: str):
+    # Строка задачи + "progress" (кадры, fps, ETA) + "events" (новые финализированные события);
+    # сообщение приходит при изменении, не чаще WS_MIN_INTERVAL_SEC
+    await websocket.accept()
+
+    async def push():
+        try:
+            async for msg in task_hub.subscribe(task_id):
+                await websocket.send_json(msg)
+        except Exception:
+            pass  # клиент ушёл посреди отправки
+        tg.cancel_scope.cancel()
+
+    # подписка и чтение из сокета (только чтобы заметить отключение) — в одной группе задач anyio:
+    # закончилось одно — отменяется другое
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(push)
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        tg.cancel_scope.cancel()
+
+@app.get("/health", tags=["system"])
+def health():
+    return {"status": "ok", "tasks": sum(task_store.counts().values()), "scheduler": scheduler.stats(),
+            "ws": task_hub.stats()}
+
+@app.get("/metrics", tags=["system"])
+def prometheus_metrics():
+    # метрики воркеров (снимки в METRICS_DIR) + состояние очереди задач на момент запроса
+    counts = task_store.counts()
+    for status in ("queued", "running", "done", "error", *counts):
+        metrics.TASKS.labels(status).set(counts.get(status, 0))
+    return Response(metrics.REGISTRY.render(METRICS_DIR), media_type=metrics.CONTENT_TYPE)
+
+# Static files for clips (serve via Nginx in prod)
+from fastapi.staticfiles import StaticFiles
+app.mount("/static", StaticFiles(directory=OUTPUT_DIR), name="static")
@@ -0,0 +1,97 @@
+# bench_detector.py
+# Бенчмарк ViolationDetector на синтетической длинной смене: полный перебор событий (как было)
+# против индекса активных событий и пакетной регистрации кадра.
+#
+#   python bench/bench_detector.py --hours 2
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from detector import Detection, ViolationDetector, ViolationEvent
+from utils import iou, union_bbox
+
+
+class FullScanDetector(ViolationDetector):
+    """Исходная логика register_detection: перебор self.events[::-1] на каждую детекцию."""
+
+    def register_detection(self, det, current_s):
+        with self.lock:
+            for ev in self.events[::-1]:
+                time_close = abs(ev.time_s - det.time_s) <= self.merge_window
+                same_frame = (ev.frame_idx == det.frame_idx)
+                spatial = iou(ev.bbox, det.bbox) > 0.1
+                if same_frame or (time_close and spatial):
+                    if det.class_name not in ev.class_names:
+                        ev.class_names.append(det.class_name)
+                    ev.confs.append(det.conf)
+                    ev.bbox = union_bbox(ev.bbox, det.bbox)
+                    ev.last_update_s = current_s
+                    return False, ev
+            ev = ViolationEvent(id=self.next_id, class_names=[det.class_name], confs=[det.conf], bbox=det.bbox,
+                                frame_idx=det.frame_idx, time_s=det.time_s, wall_time_first=det.wall_time,
+                                last_update_s=current_s)
+            self.next_id += 1
+            self.events.append(ev)
+            return True, ev
+
+
+def shift_workload(hours: float, fps: float, every: int, max_dets: int = 3, seed: int = 0):
+    """Кадры с инференсом за смену: 0..max_dets нарушений на кадр вокруг нескольких рабочих мест."""
+    rnd = random.Random(seed)
+    spots = [(rnd.randint(0, 1700), rnd.randint(0, 900)) for _ in range(12)]
+    n = int(hours * 3600 * fps / every)
+    frames = []
+    for k in range(n):
+        f = k * every
+        t = f / fps
+        dets = []
+        for _ in range(rnd.choice([0, 0, 0] + list(range(1, max_dets + 1)))):
+            x, y = rnd.choice(spots) if rnd.random() < 0.7 else (rnd.randint(0, 1800), rnd.randint(0, 1000))
+            x, y = x + rnd.randint(-30, 30), y + rnd.randint(-30, 30)
+            w, h = rnd.randint(40, 220), rnd.randint(40, 220)
+            dets.append(Detection("no_glove", 0.9, (x, y, x + w, y + h), f, t, ""))
+        frames.append(dets)
+    return frames
+
+
+def run(detector, frames, batched=False):
+    t0 = time.perf_counter()
+    for dets in frames:
+        if batched:
+            detector.register_frame(dets, dets[0].time_s if dets else 0.0)
+        else:
+            for d in dets:
+                detector.register_detection(d, d.time_s)
+    return time.perf_counter() - t0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', type=float, default=1.0)
+    parser.add_argument('--fps', type=float, default=25.0)
+    parser.add_argument('--every', type=int, default=5)
+    parser.add_argument('--merge_sec', type=int, default=10)
+    parser.add_argument('--max-dets', type=int, default=3, help='максимум нарушений в кадре')
+    parser.add_argument('--skip-full-scan', action='store_true', help='не гонять исходный перебор (он O(events))')
+    args = parser.parse_args()
+
+    frames = shift_workload(args.hours, args.fps, args.every, args.max_dets)
+    n_dets = sum(len(d) for d in frames)
+    print(f"workload: {args.hours}h, {len(frames)} inference frames, {n_dets} detections")
+
+    results = [('indexed', ViolationDetector(args.merge_sec), False),
+               ('indexed+frame batch', ViolationDetector(args.merge_sec), True)]
+    if not args.skip_full_scan:
+        results.insert(0, ('full scan', FullScanDetector(args.merge_sec), False))
+    events = None
+    for name, det, batched in results:
+        dt = run(det, frames, batched)
+        ids = [(e.id, e.bbox, len(e.confs)) for e in det.events]
+        same = '' if events is None else ('  (same events)' if ids == events else '  (EVENTS DIFFER)')
+        events = events or ids
+        print(f"{name:>20}: {dt:8.2f}s  {n_dets / dt:10.0f} det/s  events={len(det.events)}{same}")
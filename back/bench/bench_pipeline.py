@@ -0,0 +1,464 @@
+# bench_pipeline.py
+# Бенчмарк всего process_video на синтетических видео смены: разрешения, длины и плотность нарушений.
+# Видео генерируются локально (цветные метки нарушений на «кухне» с движущимися людьми), модель —
+# детерминированная заглушка (находит метки по цвету) и/или настоящая (--model). По каждой стадии
+# (декодирование, инференс, слияние событий, постановка клипа в очередь/JPEG, запись клипа, отчёты)
+# считаются вызовы, чистое время стадии (без вложенных стадий) и кадры/с, которые стадия выдержала бы одна;
+# плюс пиковый RSS и глубина очередей. Каждый прогон — в отдельном процессе (честный пик памяти).
+# Результат — JSON (с коммитом и версиями), --compare сравнивает с прошлым файлом.
+#
+#   python bench/bench_pipeline.py --resolutions 640x360,1280x720 --seconds 60 --densities 0.05,0.3
+#   python bench/bench_pipeline.py --model models/best.pt --models stub,real --compare bench/results/old.json
+
+import argparse
+import functools
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+BACK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACK_DIR)
+
+STAGES = ('decode', 'inference', 'event_merge', 'enqueue', 'clip_write', 'report')
+# цвета меток в BGR и диапазоны, в которых заглушка их находит (с запасом на сжатие mp4v)
+MARKERS = {
+    'no_glove': ((0, 0, 255), (0, 0, 150), (100, 100, 255)),
+    'no_head': ((255, 0, 0), (150, 0, 0), (255, 100, 100)),
+}
+STUB_CONF = 0.875
+
+
+# ---------------------------------------------------------------- синтетическое видео
+
+def violation_episodes(seconds: float, density: float, seed: int = 0) -> List[dict]:
+    """Эпизоды нарушений (класс, место, начало, длительность) так, чтобы примерно доля density
+    времени видео содержала хотя бы одно нарушение."""
+    rnd = random.Random(seed)
+    n = int(round(density * seconds / 4.0))  # средний эпизод — 4 с
+    episodes = []
+    for _ in range(n):
+        dur = rnd.uniform(2.0, 6.0)
+        episodes.append({'class': rnd.choice(sorted(MARKERS)), 'x': rnd.uniform(0.1, 0.8), 'y': rnd.uniform(0.15, 0.8),
+                         'start': rnd.uniform(0, max(0.0, seconds - dur)), 'dur': dur})
+    return sorted(episodes, key=lambda e: e['start'])
+
+
+def make_shift_video(path: str, width: int, height: int, fps: float, seconds: float, density: float,
+                     seed: int = 0) -> List[dict]:
+    """Пишет синтетическую смену в path (mp4v): статичная сцена со столами, бродящие «люди»
+    и цветные метки нарушений. Возвращает эпизоды нарушений (ожидаемые события)."""
+    rnd = np.random.default_rng(seed)
+    episodes = violation_episodes(seconds, density, seed)
+    # сцена: вертикальный градиент + тёмные столы
+    bg = np.tile(np.linspace(70, 150, height, dtype=np.uint8)[:, None, None], (1, width, 3))
+    for k in range(3):
+        x1 = int(width * (0.05 + 0.32 * k))
+        cv2.rectangle(bg, (x1, int(height * 0.55)), (x1 + int(width * 0.25), int(height * 0.75)), (60, 65, 70), -1)
+    people = [{'pos': rnd.uniform((0, 0), (width, height)), 'vel': rnd.normal(0, width / 200, 2)} for _ in range(4)]
+    size = max(8, height // 10)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"cannot write {path}")
+    try:
+        for idx in range(int(seconds * fps)):
+            t = idx / fps
+            frame = bg.copy()
+            for p in people:
+                p['pos'] = np.clip(p['pos'] + p['vel'], 0, (width - 1, height - 1))
+                p['vel'] = np.where((p['pos'] <= 0) | (p['pos'] >= (width - 1, height - 1)), -p['vel'], p['vel'])
+                cx, cy = map(int, p['pos'])
+                cv2.ellipse(frame, (cx, cy), (size // 2, size), 0, 0, 360, (170, 175, 180), -1)
+            for ep in episodes:
+                if ep['start'] <= t < ep['start'] + ep['dur']:
+                    x = int(ep['x'] * width + 3 * np.sin(t * 2))
+                    y = int(ep['y'] * height)
+                    cv2.rectangle(frame, (x, y), (x + size, y + size), MARKERS[ep['class']][0], -1)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return episodes
+
+
+def cached_video(video_dir: str, width: int, height: int, fps: float, seconds: float, density: float,
+                 seed: int) -> Tuple[str, List[dict]]:
+    """Видео генерируется один раз на набор параметров."""
+    os.makedirs(video_dir, exist_ok=True)
+    name = f"shift_{width}x{height}_{fps:g}fps_{seconds:g}s_d{density:g}_s{seed}"
+    path = os.path.join(video_dir, name + ".mp4")
+    meta_path = os.path.join(video_dir, name + ".json")
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            return path, json.load(f)
+    t0 = time.perf_counter()
+    episodes = make_shift_video(path, width, height, fps, seconds, density, seed)
+    with open(meta_path, 'w') as f:
+        json.dump(episodes, f)
+    print(f"[BENCH] generated {name}.mp4 in {time.perf_counter() - t0:.1f}s ({len(episodes)} violation episodes)")
+    return path, episodes
+
+
+# ---------------------------------------------------------------- модель-заглушка
+
+class StubYoloModel:
+    """Детерминированная замена YoloModel: находит цветные метки нарушений (inRange + контуры).
+    delay_ms — имитация стоимости инференса на кадр."""
+
+    def __init__(self, delay_ms: float = 0.0):
+        self.delay_ms = delay_ms
+
+    def predict_frame(self, frame: np.ndarray, conf: float = 0.5):
+        return self.predict_batch([frame], conf=conf)[0]
+
+    def predict_batch(self, frames, conf: float = 0.5):
+        if self.delay_ms:
+            time.sleep(self.delay_ms * len(frames) / 1000.0)
+        return [self._detect(f) if STUB_CONF >= conf else [] for f in frames]
+
+    def _detect(self, frame: np.ndarray):
+        min_area = (frame.shape[0] / 40.0) ** 2
+        out = []
+        for name, (_, lo, hi) in MARKERS.items():
+            mask = cv2.inRange(frame, lo, hi)
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            for c in contours:
+                x, y, w, h = cv2.boundingRect(c)
+                if w * h >= min_area:
+                    out.append((name, STUB_CONF, (x, y, x + w, y + h)))
+        return out
+
+
+# ---------------------------------------------------------------- замеры стадий
+
+class StageTimer:
+    """Чистое время стадий: время вложенной стадии (enqueue внутри on_frame) вычитается из внешней.
+    Стек вложенности свой у каждого потока (воркеры клипов, потоки конвейера)."""
+
+    def __init__(self):
+        self.stats = {name: {'calls': 0, 'items': 0, 'seconds': 0.0} for name in STAGES}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def wrap(self, stage: str, fn, items=None):
+        timer = self
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            stack = timer._local.__dict__.setdefault('stack', [])
+            stack.append(0.0)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                dt = time.perf_counter() - t0
+                child = stack.pop()
+                if stack:
+                    stack[-1] += dt
+                with timer._lock:
+                    s = timer.stats[stage]
+                    s['calls'] += 1
+                    s['items'] += items(args) if items else 1
+                    s['seconds'] += dt - child
+        return timed
+
+
+class TimedModel:
+    """Модель с замером стадии inference (оборачивает и заглушку, и настоящую)."""
+
+    def __init__(self, model, timer: StageTimer):
+        self.model = model
+        self.predict_batch = timer.wrap('inference', model.predict_batch, items=lambda a: len(a[0]))
+
+    def predict_frame(self, frame, conf: float = 0.5):
+        return self.predict_batch([frame], conf=conf)[0]
+
+
+class QueueSampler:
+    """Фоновый опрос: глубина очереди ClipWriter, кадры, ждущие в InferenceBatcher, RSS процесса."""
+
+    def __init__(self, interval_s: float = 0.01):
+        self.interval_s = interval_s
+        self.writers, self.batchers = [], []
+        self.samples = {'writer_queue': [], 'batcher_pending': [], 'rss_mb': []}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            self.samples['writer_queue'].append(sum(w.queue.qsize() for w in self.writers))
+            self.samples['batcher_pending'].append(sum(len(b._pending) for b in self.batchers))
+            rss = rss_mb()
+            if rss is not None:
+                self.samples['rss_mb'].append(rss)
+
+    def summary(self) -> dict:
+        out = {}
+        for name, values in self.samples.items():
+            if values:
+                out[name] = {'max': max(values), 'mean': round(sum(values) / len(values), 2)}
+        return out
+
+
+def rss_mb() -> Optional[float]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def instrument(timer: StageTimer, sampler: QueueSampler):
+    """Оборачивает методы стадий на уровне классов (только в процессе бенчмарка)."""
+    from buffers import FrameRingBuffer, CompressedFrameBuffer, SourceSeekFrames
+    from pipeline import EventStage, InferenceBatcher
+    from reports import ReportSink
+    from writer import ClipWriter
+
+    for cls in (FrameRingBuffer, CompressedFrameBuffer, SourceSeekFrames):
+        cls.read = timer.wrap('decode', cls.read)
+    EventStage.on_frame = timer.wrap('event_merge', EventStage.on_frame)
+    ClipWriter.enqueue = timer.wrap('enqueue', ClipWriter.enqueue)
+    ClipWriter._process_task = timer.wrap('clip_write', ClipWriter._process_task)
+    for name in ('update', 'flush_detections', 'write_events', 'close'):
+        setattr(ReportSink, name, timer.wrap('report', getattr(ReportSink, name)))
+
+    def register(cls, registry):
+        init = cls.__init__
+
+        @functools.wraps(init)
+        def __init__(self, *args, **kwargs):
+            init(self, *args, **kwargs)
+            registry.append(self)
+        cls.__init__ = __init__
+
+    register(ClipWriter, sampler.writers)
+    register(InferenceBatcher, sampler.batchers)
+
+
+# ---------------------------------------------------------------- один прогон
+
+def run_scenario(scenario: dict, opts: dict) -> dict:
+    """Прогон process_video в текущем процессе (вызывается в дочернем процессе)."""
+    import contextlib
+    import io
+
+    import metrics
+    from main import process_video
+    from reports import EVENTS_CSV
+
+    def clip_counts():
+        return {k[0]: v for k, v in metrics.CLIPS.snapshot()['values']}
+
+    timer, sampler = StageTimer(), QueueSampler()
+    instrument(timer, sampler)
+    t0 = time.perf_counter()
+    if scenario['model'] == 'stub':
+        model = StubYoloModel(opts['stub_delay_ms'])
+    else:
+        from model_iface import load_model
+        model = load_model(opts['model_path'], opts['backend'], opts['threads'])
+    load_s = time.perf_counter() - t0
+    model = TimedModel(model, timer)
+    base_rss = rss_mb()
+
+    out_dir = tempfile.mkdtemp(prefix='bench_out_')
+    clips_before = clip_counts()
+    sampler.start()
+    t0 = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            process_video(opts['model_path'], scenario['video'], out_dir, detect_every_n=opts['every'],
+                          batch_size=opts['batch'], pipelined=opts['pipelined'], compress_buffer=opts['compress_buffer'],
+                          clips_from_source=opts['clips_from_source'], model=model)
+        wall_s = time.perf_counter() - t0
+    finally:
+        sampler.stop()
+    try:
+        frames = timer.stats['event_merge']['items']
+        events_path = os.path.join(out_dir, EVENTS_CSV)
+        events = sum(1 for _ in open(events_path)) - 1 if os.path.exists(events_path) else None
+        clips = len(os.listdir(os.path.join(out_dir, 'clips')))
+        clip_delta = {k: v - clips_before.get(k, 0) for k, v in clip_counts().items()}
+        dropped, spilled = int(clip_delta.get('dropped', 0)), int(clip_delta.get('spilled', 0))
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    stages = {}
+    for name, s in timer.stats.items():
+        stages[name] = dict(s, seconds=round(s['seconds'], 4),
+                            fps=round(frames / s['seconds'], 1) if s['seconds'] > 0 else None)
+    return {
+        'scenario': {k: v for k, v in scenario.items() if k != 'video'},
+        'frames': frames, 'wall_s': round(wall_s, 3), 'fps': round(frames / wall_s, 1) if wall_s else None,
+        'model_load_s': round(load_s, 3), 'stages': stages,
+        'events': events, 'clips': clips, 'clips_dropped': dropped, 'clips_spilled': spilled,
+        'base_rss_mb': round(base_rss, 1) if base_rss else None,
+        'peak_rss_mb': round(peak_rss_mb() or 0.0, 1) or None,
+        'queues': sampler.summary(),
+    }
+
+
+def _child(scenario: dict, opts: dict, results):
+    try:
+        results.put(run_scenario(scenario, opts))
+    except BaseException as e:
+        results.put({'scenario': {k: v for k, v in scenario.items() if k != 'video'}, 'error': repr(e)})
+
+
+def run_isolated(scenario: dict, opts: dict, timeout_s: float = 1800.0) -> dict:
+    """Прогон в отдельном процессе; упавший (в т.ч. убитый OOM) или зависший прогон — результат с error."""
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    p = ctx.Process(target=_child, args=(scenario, opts, results))
+    p.start()
+    deadline = time.monotonic() + timeout_s
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=1.0)
+        except queue.Empty:
+            if not p.is_alive():
+                p.join()
+                error = f"benchmark process exited with code {p.exitcode} without a result"
+                break
+            if time.monotonic() > deadline:
+                p.terminate()
+                p.join()
+                error = f"benchmark process timed out after {timeout_s:g}s"
+                break
+    if result is None:
+        result = {'scenario': {k: v for k, v in scenario.items() if k != 'video'}, 'error': error}
+    p.join()
+    return result
+
+
+# ---------------------------------------------------------------- отчёт
+
+def run_key(r: dict) -> str:
+    s = r['scenario']
+    return f"{s['model']} {s['width']}x{s['height']} {s['seconds']:g}s d={s['density']:g}"
+
+
+def print_run(r: dict, baseline: Optional[Dict[str, dict]] = None):
+    if 'error' in r:
+        print(f"{run_key(r)}: FAILED {r['error']}")
+        return
+    s = r['scenario']
+    print(f"{run_key(r)}: {r['frames']} frames in {r['wall_s']:.2f}s = {r['fps']:.1f} fps | "
+          f"events {r['events']} (episodes {s['episodes']}), clips {r['clips']}, dropped {r['clips_dropped']}, "
+          f"spilled {r.get('clips_spilled', 0)} | "
+          f"peak RSS {r['peak_rss_mb']} MB | queues {r['queues'].get('writer_queue')}")
+    old = (baseline or {}).get(run_key(r))
+    for name in STAGES:
+        st = r['stages'][name]
+        line = f"  {name:>12}: {st['seconds']:8.3f}s {st['calls']:7d} calls  " \
+               f"{st['fps'] if st['fps'] is not None else '-':>10} fps"
+        if old and 'stages' in old:
+            prev = old['stages'][name]['seconds']
+            if prev and st['seconds']:
+                line += f"  x{prev / st['seconds']:.2f} vs baseline"
+        print(line)
+    if old and old.get('fps'):
+        print(f"  {'total':>12}: x{r['fps'] / old['fps']:.2f} vs baseline fps")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACK_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _sizes(text: str):
+    return [tuple(int(v) for v in s.lower().split('x')) for s in text.split(',') if s]
+
+
+def _floats(text: str):
+    return [float(v) for v in text.split(',') if v]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resolutions', default='640x360,1280x720', help='WxH через запятую')
+    parser.add_argument('--seconds', default='30', help='длины видео, с (через запятую)')
+    parser.add_argument('--densities', default='0.05,0.3', help='доля времени с нарушениями (через запятую)')
+    parser.add_argument('--fps', type=float, default=25.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--models', default='stub', help='stub, real или stub,real')
+    parser.add_argument('--model', default=None, help='путь к модели для real (по умолчанию MODEL_PATH)')
+    parser.add_argument('--backend', default='auto')
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--stub-delay-ms', type=float, default=0.0, help='имитация стоимости инференса на кадр')
+    parser.add_argument('--every', type=int, default=5, help='detect_every_n')
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--pipelined', action='store_true')
+    parser.add_argument('--compress-buffer', action='store_true')
+    parser.add_argument('--clips-from-source', action='store_true')
+    parser.add_argument('--video-dir', default=os.path.join(tempfile.gettempdir(), 'leanvision_bench'))
+    parser.add_argument('--out', default=None, help='JSON с результатами (по умолчанию bench/results/...)')
+    parser.add_argument('--compare', default=None, help='прошлый JSON: сравнить время стадий')
+    parser.add_argument('--timeout', type=float, default=1800.0, help='лимит одного прогона, сек')
+    args = parser.parse_args()
+
+    from config import MODEL_PATH
+
+    opts = {'model_path': args.model or MODEL_PATH, 'backend': args.backend, 'threads': args.threads,
+            'stub_delay_ms': args.stub_delay_ms, 'every': args.every, 'batch': args.batch,
+            'pipelined': args.pipelined, 'compress_buffer': args.compress_buffer,
+            'clips_from_source': args.clips_from_source}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {run_key(r): r for r in json.load(f)['runs'] if 'scenario' in r}
+
+    runs = []
+    matrix = itertools.product(_sizes(args.resolutions), _floats(args.seconds), _floats(args.densities))
+    for (w, h), seconds, density in matrix:
+        video, episodes = cached_video(args.video_dir, w, h, args.fps, seconds, density, args.seed)
+        for model in args.models.split(','):
+            scenario = {'model': model, 'width': w, 'height': h, 'fps': args.fps, 'seconds': seconds,
+                        'density': density, 'episodes': len(episodes), 'video': video}
+            r = run_isolated(scenario, opts, args.timeout)
+            print_run(r, baseline)
+            runs.append(r)
+
+    commit = git_commit()
+    out = args.out or os.path.join(BACK_DIR, 'bench', 'results',
+                                   f"pipeline_{commit or 'nogit'}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    meta = {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'opencv': cv2.__version__, 'numpy': np.__version__, 'machine': platform.machine(),
+            'cpus': os.cpu_count(), 'options': opts}
+    with open(out, 'w') as f:
+        json.dump({'meta': meta, 'runs': runs}, f, indent=1)
+    print(f"[BENCH] results -> {out}")
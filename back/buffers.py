@@ -0,0 +1,188 @@
+# buffers.py
+# Буферы кадров для вырезки клипов.
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+
+class FrameRingBuffer:
+    """
+    Кольцевой буфер последних capacity кадров поверх одного заранее выделенного массива (capacity, H, W, 3).
+    cap.read() декодирует прямо в слот буфера, поэтому на кадр нет ни аллокации, ни копии,
+    а память постоянна независимо от длины видео. Кадр idx лежит в слоте idx % capacity.
+
+    Писатель (декодер) один; читатели получают view на слоты. Слот, в который сейчас
+    декодируется следующий кадр, из выдачи исключается.
+    """
+
+    encoded = False  # get_range отдаёт сырые BGR-кадры
+
+    def __init__(self, capacity: int):
+        self.capacity = max(2, int(capacity))
+        self.data: Optional[np.ndarray] = None  # выделяется по размеру первого кадра
+        self.last_idx = -1
+
+    def read(self, cap, need: bool = True) -> Tuple[bool, Optional[np.ndarray]]:
+        """Декодирует следующий кадр из cap в очередной слот. Возвращает (ret, view на слот).
+        need игнорируется: кадр нужен буферу для клипов в любом случае.
+        """
+        idx = self.last_idx + 1
+        if self.data is None:
+            ret, frame = cap.read()
+            if not ret:
+                return False, None
+            self.data = np.empty((self.capacity,) + frame.shape, dtype=frame.dtype)
+            slot = self.data[idx % self.capacity]
+            slot[...] = frame
+        else:
+            slot = self.data[idx % self.capacity]
+            ret, frame = cap.read(slot)
+            if not ret:
+                return False, None
+            if frame is not slot:
+                # бэкенд вернул свой массив (или камера сменила разрешение) — приводим к слоту
+                if frame.shape == slot.shape:
+                    np.copyto(slot, frame)
+                else:
+                    cv2.resize(frame, (slot.shape[1], slot.shape[0]), dst=slot)
+        self.last_idx = idx
+        return True, slot
+
+    def get(self, idx: int) -> Optional[np.ndarray]:
+        """View на кадр idx или None, если он уже вытеснен/ещё не декодирован."""
+        if self.data is None or idx > self.last_idx or idx <= self.last_idx - self.capacity + 1:
+            return None
+        return self.data[idx % self.capacity]
+
+    def get_range(self, start_idx: int, end_idx: int) -> List[Tuple[int, np.ndarray]]:
+        """Кадры с индексами [start_idx, end_idx] (включительно), которые ещё есть в буфере, по порядку."""
+        last = self.last_idx
+        if self.data is None or last < 0:
+            return []
+        lo = max(start_idx, last - self.capacity + 2, 0)
+        hi = min(end_idx, last)
+        return [(i, self.data[i % self.capacity]) for i in range(lo, hi + 1)]
+
+    def __len__(self) -> int:
+        return min(self.last_idx + 1, self.capacity - 1)
+
+    @property
+    def nbytes(self) -> int:
+        return 0 if self.data is None else self.data.nbytes
+
+
+def _encode_jpeg(frame: np.ndarray, params: List[int]) -> Optional[bytes]:
+    success, jpg = cv2.imencode('.jpg', frame, params)
+    return jpg.tobytes() if success else None
+
+
+class CompressedFrameBuffer:
+    """
+    Буфер кадров для клипов в виде JPEG-байтов: каждый кадр кодируется ровно один раз
+    (в небольшом пуле потоков, вне цикла декодирования), а задачи клипов ссылаются на общие bytes.
+    Пересекающиеся события больше не перекодируют одни и те же кадры, а память на кадр — десятки КБ
+    вместо мегабайт.
+
+    Сырые кадры живут только в маленьком FrameRingBuffer на lag_frames (кадры, ещё ждущие инференса)
+    плюс кадры в очереди кодирования; если кодирование отстаёт, read() ждёт самый старый кадр.
+    Интерфейс как у FrameRingBuffer: read(cap), get_range(), last_idx.
+    """
+
+    encoded = True  # get_range отдаёт (idx, jpeg_bytes)
+
+    def __init__(self, capacity: int, lag_frames: int = 0, workers: int = 2, quality: int = 80):
+        self.capacity = max(2, int(capacity))
+        self.max_inflight = 4 * max(1, workers)
+        self.raw = FrameRingBuffer(lag_frames + self.max_inflight + 2)
+        self.last_idx = -1
+        self._slots: List[Union[None, bytes, Future]] = [None] * self.capacity
+        self._inflight: "deque[Future]" = deque()
+        self._params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='jpeg')
+
+    def read(self, cap, need: bool = True) -> Tuple[bool, Optional[np.ndarray]]:
+        """Декодирует кадр в сырое кольцо и ставит его JPEG-кодирование в пул. Возвращает (ret, view)."""
+        # backpressure: слот сырого кольца нельзя перезаписать, пока кадр из него не закодирован
+        while self._inflight and (self._inflight[0].done() or len(self._inflight) >= self.max_inflight):
+            self._inflight.popleft().result()
+        ret, frame = self.raw.read(cap)
+        if not ret:
+            return False, None
+        idx = self.raw.last_idx
+        fut = self._pool.submit(_encode_jpeg, frame, self._params)
+        self._inflight.append(fut)
+        self._slots[idx % self.capacity] = fut
+        self.last_idx = idx
+        return True, frame
+
+    def get_range(self, start_idx: int, end_idx: int) -> List[Tuple[int, bytes]]:
+        """JPEG-байты кадров [start_idx, end_idx] (включительно), которые ещё есть в буфере, по порядку."""
+        last = self.last_idx
+        if last < 0:
+            return []
+        lo = max(start_idx, last - self.capacity + 2, 0)
+        hi = min(end_idx, last)
+        out = []
+        for i in range(lo, hi + 1):
+            jpg = self._slots[i % self.capacity]
+            if isinstance(jpg, Future):
+                jpg = jpg.result()
+            if jpg is None:
+                print(f"[ENQUEUE] jpeg encode failed for frame {i} (skipping)")
+                continue
+            out.append((i, jpg))
+        return out
+
+    def __len__(self) -> int:
+        return min(self.last_idx + 1, self.capacity - 1)
+
+    @property
+    def nbytes(self) -> int:
+        done = [s.result() if isinstance(s, Future) and s.done() else s for s in self._slots]
+        return self.raw.nbytes + sum(len(b) for b in done if isinstance(b, bytes))
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+class SourceSeekFrames:
+    """
+    Режим вырезки клипов из исходного файла: кадры для клипов вообще не буферизуются,
+    ClipWriter открывает свой reader на source_path и читает окно события через seek.
+    Основному циклу нужны только кадры для инференса: остальные пропускаются через cap.grab()
+    (без конвертации в BGR), а сырые кадры живут в маленьком кольце на lag_frames.
+    Подходит только для файлов (не для живых потоков).
+    """
+
+    encoded = False
+
+    def __init__(self, source_path: str, total: int = 0, lag_frames: int = 0):
+        self.source_path = source_path
+        self.total = total
+        self.last_idx = -1
+        self.raw = FrameRingBuffer(lag_frames + 2)
+
+    def read(self, cap, need: bool = True) -> Tuple[bool, Optional[np.ndarray]]:
+        """Продвигается на кадр. Если кадр не нужен для инференса (need=False) — только grab()."""
+        if need:
+            ret, frame = self.raw.read(cap)
+        else:
+            ret, frame = cap.grab(), None
+        if not ret:
+            return False, None
+        self.last_idx += 1
+        return True, frame
+
+    def get_range(self, start_idx: int, end_idx: int) -> list:
+        return []
+
+    def __len__(self) -> int:
+        return 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.raw.nbytes
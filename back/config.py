@@ -1,27 +1,140 @@
-# config.py
-# Центральные параметры системы. Меняйте по окружению/камере.
-
-MODEL_PATH = "models/best.pt"
-INPUT_VIDEO = "input_shift.mp4"
-OUTPUT_DIR = "results_shift"
-
-# параметры инференса
-CONF_THRESH = 0.5
-DETECT_EVERY_N_FRAMES = 5
-
-# параметры клипов
-CLIP_PRE_SEC = 3
-CLIP_POST_SEC = 5
-MERGE_WINDOW_SEC = 10
-FINALIZE_DELAY = 5.0
-
-# классы модели: имена должны совпадать с вашей моделью YOLO
-MODEL_CLASSES = ["floor", "glove", "head", "no_glove", "no_head", "no_uniform", "table", "uniform"]
-VIOLATION_CLASSES = {"no_glove", "no_head", "no_uniform", "floor", "table"}
-
-# очередь/воркеры
-ASYNC_WORKERS = 2
-TASK_QUEUE_MAXSIZE = 200
-
-# webhook
+# config.py
+# Центральные параметры системы. Меняйте по окружению/камере.
+
+MODEL_PATH = "models/best.pt"
+INPUT_VIDEO = "input_shift.mp4"
+OUTPUT_DIR = "results_shift"
+
+# параметры инференса
+CONF_THRESH = 0.5
+DETECT_EVERY_N_FRAMES = 5
+# бэкенд модели: auto (по расширению: .onnx -> ONNX Runtime, иначе ultralytics/PyTorch), torch, onnx, openvino;
+# INFER_THREADS — потоки ONNX Runtime на процесс (0 — все ядра); размер входа, IoU NMS и максимум боксов на кадр
+INFER_BACKEND = "auto"
+INFER_THREADS = 0
+INFER_IMGSZ = 640
+NMS_IOU = 0.7
+MAX_DET = 300
+# батчевый инференс: сколько кадров собирать в один вызов модели
+# и сколько максимум (сек, по часам) может ждать первый кадр неполного батча
+INFER_BATCH_SIZE = 1
+INFER_BATCH_MAX_LATENCY_SEC = 0.5
+# конвейерный режим (--pipelined): размер очередей между стадиями и период лога пропускной способности
+PIPELINE_QUEUE_SIZE = 64
+PIPELINE_LOG_EVERY_SEC = 30
+
+# зоны интереса (--roi roi.json): инференс только по областям кадра; отступ вокруг области (пикс.)
+# и IoU, выше которого боксы одного класса с соседних областей считаются одним объектом
+ROI_CONFIG = None
+ROI_PAD = 16
+ROI_DEDUP_IOU = 0.5
+
+# гейт движения (--motion-gate): модель не запускается, пока на уменьшенной серой копии кадра ничего не меняется.
+# Движение — доля пикселей (MOTION_MIN_AREA), изменившихся с прошлой проверки больше MOTION_PIXEL_THRESH;
+# после движения или детекций полная частота держится MOTION_HOLD_SEC,
+# без движения — контрольный инференс раз в MOTION_IDLE_SEC
+MOTION_GATE = False
+MOTION_GATE_WIDTH = 160
+MOTION_PIXEL_THRESH = 25
+MOTION_MIN_AREA = 0.002
+MOTION_HOLD_SEC = 2.0
+MOTION_IDLE_SEC = 10.0
+
+# параметры клипов
+CLIP_PRE_SEC = 3
+CLIP_POST_SEC = 5
+MERGE_WINDOW_SEC = 10
+FINALIZE_DELAY = 5.0
+# сжатый буфер кадров (--compress-buffer): каждый кадр кодируется в JPEG один раз, в пуле из N потоков
+CLIP_BUFFER_COMPRESSED = False
+CLIP_BUFFER_ENCODERS = 2
+# вырезка клипов из исходного файла через seek (--clips-from-source): буфер кадров не нужен, только для файлов
+CLIP_FROM_SOURCE = False
+
+# отчёты: форматы (parquet — типизированные колонки, csv — совместимость),
+# размер группы строк детекций и период снимка событий (сек)
+REPORT_FORMATS = ("parquet", "csv")
+REPORT_ROW_GROUP = 50000
+REPORT_FLUSH_SEC = 60
+# SQLite-индекс событий всех результатов (для /events)
+EVENT_INDEX_PATH = OUTPUT_DIR + "/events_index.sqlite"
+
+# классы модели: имена должны совпадать с вашей моделью YOLO
+MODEL_CLASSES = ["floor", "glove", "head", "no_glove", "no_head", "no_uniform", "table", "uniform"]
+VIOLATION_CLASSES = {"no_glove", "no_head", "no_uniform", "floor", "table"}
+
+# загрузка видео в API: размер чанка записи/хэширования (байт)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# живые потоки (--source): очередь захваченных кадров; кадры старше STREAM_MAX_LAG_SEC выбрасываются,
+# чтобы задержка не росла, когда инференс не успевает; отчёты и индекс событий обновляются каждые
+# STREAM_REPORT_SEC; при обрыве источника — до STREAM_RECONNECT_TRIES переподключений
+STREAM_QUEUE_FRAMES = 64
+STREAM_MAX_LAG_SEC = 2.0
+STREAM_REPORT_SEC = 30
+STREAM_RECONNECT_TRIES = 10
+STREAM_RECONNECT_SEC = 5.0
+# источники потоков из API (/streams/start): id камеры из STREAM_CAMERAS (-> URL) или URL со схемой из
+# STREAM_ALLOWED_SCHEMES и хостом из STREAM_ALLOWED_HOSTS (плюс synthetic://). Локальные файлы и прочие
+# протоколы FFmpeg через API не открываются; CLI (--source) не ограничен
+STREAM_CAMERAS = {}
+STREAM_ALLOWED_SCHEMES = ("rtsp", "rtsps", "rtmp", "http", "https")
+STREAM_ALLOWED_HOSTS = ()
+
+# несколько камер в одном процессе (--source повторяется): общий движок инференса собирает кадры камер
+# в батч до MULTI_STREAM_BATCH кадров, неполный батч ждёт добора не дольше MULTI_STREAM_MAX_WAIT_SEC
+MULTI_STREAM_BATCH = 8
+MULTI_STREAM_MAX_WAIT_SEC = 0.02
+
+# очередь/воркеры писателя клипов: очередь ограничена объёмом JPEG-кадров задач в памяти
+# (CLIP_QUEUE_MAX_BYTES), задачи сверх него сбрасываются в спул на диске (CLIP_SPOOL_DIR, None — временная
+# директория системы) объёмом до CLIP_SPOOL_MAX_BYTES; клип выбрасывается, только если не влез и туда
+ASYNC_WORKERS = 2
+CLIP_QUEUE_MAX_BYTES = 256 * 1024 ** 2
+CLIP_SPOOL_DIR = None
+CLIP_SPOOL_MAX_BYTES = 4 * 1024 ** 3
+
+# планировщик задач API: процессы с загруженной моделью (сколько задач одновременно на хосте)
+# и максимум задач в очереди — сверх него /process/start отвечает 429
+SCHEDULER_WORKERS = 2
+SCHEDULER_MAX_QUEUE = 100
+# хранилище задач (общее для всех процессов uvicorn): задача running без heartbeat дольше TASK_STALE_SEC
+# считается прерванной и возвращается в очередь (не больше TASK_MAX_ATTEMPTS запусков)
+TASK_STORE_PATH = OUTPUT_DIR + "/tasks.sqlite"
+TASK_POLL_SEC = 1.0
+TASK_HEARTBEAT_SEC = 5.0
+TASK_STALE_SEC = 30.0
+TASK_MAX_ATTEMPTS = 3
+# кэш результатов по (хэш видео, хэш модели, параметры); суммарный размер результатов в OUTPUT_DIR
+# ограничен — сверх лимита удаляются давно не запрошенные (LRU)
+RESULT_CACHE_PATH = OUTPUT_DIR + "/result_cache.sqlite"
+RESULT_CACHE_MAX_BYTES = 50 * 1024 ** 3
+# кэш сырых выходов модели по (видео, модель) для replay без повторного инференса; модель в этом режиме
+# работает с минимальным порогом RAW_CACHE_CONF, а conf задачи применяется уже к кэшу
+RAW_CACHE_DIR = OUTPUT_DIR + "/raw_cache"
+RAW_CACHE_CONF = 0.05
+
+# трассировка задачи (--trace, поле trace в API): таймлайн стадий кадров и задач клипов в out_dir/trace.json
+# (Chrome trace / Perfetto). Кольцевой буфер на TRACE_BUFFER_EVENTS интервалов; пишется каждое
+# TRACE_SAMPLE_EVERY-е окно из TRACE_WINDOW_FRAMES кадров (1 — все кадры)
+TRACE = False
+TRACE_BUFFER_EVENTS = 200000
+TRACE_SAMPLE_EVERY = 1
+TRACE_WINDOW_FRAMES = 250
+
+# прогресс задач по WebSocket (/ws/tasks/{id}): воркер шлёт прогресс не чаще PROGRESS_EVERY_SEC,
+# клиенту уходит не больше одного сообщения за WS_MIN_INTERVAL_SEC (изменения сливаются);
+# строка задачи перечитывается раз в WS_REFRESH_SEC (изменения из других процессов API);
+# последние WS_EVENT_BACKLOG событий задачи получает и подключившийся позже клиент
+PROGRESS_EVERY_SEC = 1.0
+WS_MIN_INTERVAL_SEC = 0.25
+WS_REFRESH_SEC = 5.0
+WS_EVENT_BACKLOG = 200
+
+# метрики Prometheus (/metrics): воркеры планировщика сбрасывают снимки своих метрик в METRICS_DIR
+# раз в METRICS_EXPORT_SEC и в конце задачи, API складывает их
+METRICS_DIR = OUTPUT_DIR + "/metrics"
+METRICS_EXPORT_SEC = 5.0
+
+# webhook
 WEBHOOK_URL = None  # при необходимости укажите URL
\ No newline at end of file
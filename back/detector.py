@@ -1,87 +1,387 @@
-# detector.py
-# Логика объединения детекций в события (блоки), debounce и хранение метаданных событий.
-
-from dataclasses import dataclass, field
-from typing import List, Tuple, Optional
-import threading
-
-from utils import union_bbox, iou, now_iso
-from config import VIOLATION_CLASSES
-
-
-@dataclass
-class Detection:
-    class_name: str
-    conf: float
-    bbox: Tuple[int,int,int,int]
-    frame_idx: int
-    time_s: float
-    wall_time: str
-
-
-@dataclass
-class ViolationEvent:
-    id: int
-    class_names: List[str] = field(default_factory=list)
-    confs: List[float] = field(default_factory=list)
-    bbox: Tuple[int,int,int,int] = (0,0,0,0)
-    frame_idx: int = 0
-    time_s: float = 0.0
-    wall_time_first: str = ""
-    pending: bool = True
-    last_update_s: float = 0.0
-    saved: bool = False
-    enqueued: bool = False
-
-
-class ViolationDetector:
-    """Класс агрегирует детекции в события. Потокобезопасен (лок при регистрации)."""
-
-    def __init__(self, merge_window_sec: int = 10):
-        self.events: List[ViolationEvent] = []
-        self.next_id = 1
-        self.merge_window = merge_window_sec
-        self.lock = threading.Lock()
-
-    def register_detection(self, det: Detection, current_s: float) -> (bool, ViolationEvent):
-        """
-        Регистрируем детекцию. Если она попадает в существующее событие (тот же кадр или
-        близко по времени + пространственно), то сливаем. Иначе создаём новое событие.
-        Возвращаем (is_new_event_created, event)
-        """
-        with self.lock:
-            now = det.time_s
-            for ev in self.events[::-1]:
-                time_close = abs(ev.time_s - now) <= self.merge_window
-                same_frame = (ev.frame_idx == det.frame_idx)
-                spatial = iou(ev.bbox, det.bbox) > 0.1
-                if same_frame or (time_close and spatial):
-                    if det.class_name not in ev.class_names:
-                        ev.class_names.append(det.class_name)
-                    ev.confs.append(det.conf)
-                    ev.bbox = union_bbox(ev.bbox, det.bbox)
-                    if det.time_s < ev.time_s:
-                        ev.time_s = det.time_s
-                        ev.frame_idx = det.frame_idx
-                    ev.last_update_s = current_s
-                    ev.pending = True
-                    ev.saved = False
-                    ev.enqueued = False  # сбрасываем маркер, т.к. появились новые данные
-                    return False, ev
-            # create
-            ev = ViolationEvent(
-                id=self.next_id,
-                class_names=[det.class_name],
-                confs=[det.conf],
-                bbox=det.bbox,
-                frame_idx=det.frame_idx,
-                time_s=det.time_s,
-                wall_time_first=det.wall_time,
-                pending=True,
-                last_update_s=current_s,
-                saved=False,
-                enqueued=False
-            )
-            self.next_id += 1
-            self.events.append(ev)
-            return True, ev
\ No newline at end of file
+# detector.py
+# Логика объединения детекций в события (блоки), debounce и хранение метаданных событий.
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Set, Tuple, Optional
+from collections import deque
+import heapq
+import threading
+
+import numpy as np
+
+from utils import union_bbox, iou, now_iso
+from config import VIOLATION_CLASSES
+
+
+@dataclass
+class Detection:
+    class_name: str
+    conf: float
+    bbox: Tuple[int,int,int,int]
+    frame_idx: int
+    time_s: float
+    wall_time: str
+
+
+@dataclass
+class ViolationEvent:
+    id: int
+    class_names: List[str] = field(default_factory=list)
+    confs: List[float] = field(default_factory=list)
+    bbox: Tuple[int,int,int,int] = (0,0,0,0)
+    frame_idx: int = 0
+    time_s: float = 0.0
+    wall_time_first: str = ""
+    pending: bool = True
+    last_update_s: float = 0.0
+    saved: bool = False
+    enqueued: bool = False
+    clip_path: Optional[str] = None
+
+
+class DetectionStore:
+    """
+    Колоночное хранилище всех детекций смены: растущие массивы NumPy вместо списка Detection.
+    Имена классов и wall_time интернированы (wall_time один на кадр), поэтому на детекцию уходит
+    ~50 байт вместо ~450 у dataclass. Детекции добавляются по порядку кадров, так что frame_idx
+    отсортирован и срез по окну кадров — это два searchsorted (O(log n)).
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._n = 0
+        self._cap = max(16, int(capacity))
+        self.frame_idx = np.empty(self._cap, dtype=np.int64)
+        self.time_s = np.empty(self._cap, dtype=np.float64)
+        self.class_id = np.empty(self._cap, dtype=np.int16)
+        self.conf = np.empty(self._cap, dtype=np.float64)
+        self.bbox = np.empty((self._cap, 4), dtype=np.int32)
+        self.wall_id = np.empty(self._cap, dtype=np.int32)
+        self.class_names: List[str] = []
+        self._class_ids: Dict[str, int] = {}
+        self.wall_times: List[str] = []
+        self._sorted = True
+
+    def __len__(self) -> int:
+        return self._n
+
+    def _grow(self):
+        self._cap *= 2
+        for name in ('frame_idx', 'time_s', 'class_id', 'conf', 'bbox', 'wall_id'):
+            old = getattr(self, name)
+            new = np.empty((self._cap,) + old.shape[1:], dtype=old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self, name, new)
+
+    def add(self, class_name: str, conf: float, bbox: Tuple[int,int,int,int], frame_idx: int,
+            time_s: float, wall_time: str):
+        if self._n == self._cap:
+            self._grow()
+        i = self._n
+        cid = self._class_ids.get(class_name)
+        if cid is None:
+            cid = self._class_ids[class_name] = len(self.class_names)
+            self.class_names.append(class_name)
+        if not self.wall_times or self.wall_times[-1] != wall_time:
+            self.wall_times.append(wall_time)
+        if i and frame_idx < self.frame_idx[i - 1]:
+            self._sorted = False
+        self.frame_idx[i] = frame_idx
+        self.time_s[i] = time_s
+        self.class_id[i] = cid
+        self.conf[i] = conf
+        self.bbox[i] = bbox
+        self.wall_id[i] = len(self.wall_times) - 1
+        self._n += 1
+
+    def append(self, det: Detection):
+        self.add(det.class_name, det.conf, det.bbox, det.frame_idx, det.time_s, det.wall_time)
+
+    def _rows(self, start_idx: int, end_idx: int) -> np.ndarray:
+        fi = self.frame_idx[:self._n]
+        if self._sorted:
+            lo = np.searchsorted(fi, start_idx, side='left')
+            hi = np.searchsorted(fi, end_idx, side='right')
+            return np.arange(lo, hi)
+        return np.flatnonzero((fi >= start_idx) & (fi <= end_idx))
+
+    def range(self, start_idx: int, end_idx: int) -> List[Detection]:
+        """Детекции кадров [start_idx, end_idx] (включительно) в виде Detection."""
+        names, walls = self.class_names, self.wall_times
+        return [Detection(class_name=names[self.class_id[i]], conf=float(self.conf[i]),
+                          bbox=tuple(int(v) for v in self.bbox[i]), frame_idx=int(self.frame_idx[i]),
+                          time_s=float(self.time_s[i]), wall_time=walls[self.wall_id[i]])
+                for i in self._rows(start_idx, end_idx)]
+
+    def __iter__(self):
+        return iter(self.range(-(1 << 62), 1 << 62))
+
+    def to_dataframe(self, lo: int = 0, hi: Optional[int] = None):
+        """Таблица для detections_all (строки [lo, hi)): wall_time, time_s, frame_idx, class_name, conf, bbox."""
+        import pandas as pd
+        hi = self._n if hi is None else min(hi, self._n)
+        names = np.array(self.class_names, dtype=object)
+        walls = np.array(self.wall_times, dtype=object)
+        return pd.DataFrame({
+            'wall_time': walls[self.wall_id[lo:hi]],
+            'time_s': self.time_s[lo:hi],
+            'frame_idx': self.frame_idx[lo:hi],
+            'class_name': names[self.class_id[lo:hi]],
+            'conf': self.conf[lo:hi],
+            'bbox': [tuple(b) for b in self.bbox[lo:hi].tolist()],
+        })
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.frame_idx, self.time_s, self.class_id, self.conf, self.bbox, self.wall_id)
+        return sum(a[:self._n].nbytes for a in arrays) + sum(len(w) for w in self.wall_times)
+
+
+class _GridIndex:
+    """Равномерная сетка по кадру: ячейка -> события, чей bbox её задевает.
+    Пересекающиеся боксы (IoU > 0) обязательно делят хотя бы одну ячейку."""
+
+    def __init__(self, cell: int):
+        self.cell = max(1, int(cell))
+        self.cells: Dict[Tuple[int,int], Dict[int, ViolationEvent]] = {}
+        self.ev_cells: Dict[int, Set[Tuple[int,int]]] = {}
+
+    def _cells_for(self, bbox: Tuple[int,int,int,int]) -> Set[Tuple[int,int]]:
+        c = self.cell
+        return {(cx, cy) for cx in range(bbox[0] // c, bbox[2] // c + 1)
+                for cy in range(bbox[1] // c, bbox[3] // c + 1)}
+
+    def insert(self, ev: ViolationEvent):
+        # bbox события только растёт (union), поэтому достаточно дописать новые ячейки
+        old = self.ev_cells.setdefault(ev.id, set())
+        for key in self._cells_for(ev.bbox) - old:
+            self.cells.setdefault(key, {})[ev.id] = ev
+            old.add(key)
+
+    def remove(self, ev: ViolationEvent):
+        for key in self.ev_cells.pop(ev.id, ()):
+            bucket = self.cells.get(key)
+            if bucket is not None:
+                bucket.pop(ev.id, None)
+                if not bucket:
+                    del self.cells[key]
+
+    def query(self, bbox: Tuple[int,int,int,int]) -> Dict[int, ViolationEvent]:
+        out: Dict[int, ViolationEvent] = {}
+        for key in self._cells_for(bbox):
+            bucket = self.cells.get(key)
+            if bucket:
+                out.update(bucket)
+        return out
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU всех пар боксов (xyxy): a (N,4) x b (M,4) -> (N,M). Семантика как у utils.iou."""
+    a = a.astype(np.float64).reshape(-1, 1, 4)
+    b = b.astype(np.float64).reshape(1, -1, 4)
+    iw = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    ih = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = iw * ih
+    area_a = np.clip(a[..., 2] - a[..., 0], 0, None) * np.clip(a[..., 3] - a[..., 1], 0, None)
+    area_b = np.clip(b[..., 2] - b[..., 0], 0, None) * np.clip(b[..., 3] - b[..., 1], 0, None)
+    denom = area_a + area_b - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denom > 0, inter / np.where(denom > 0, denom, 1), 0.0)
+
+
+class ViolationDetector:
+    """Класс агрегирует детекции в события. Потокобезопасен (лок при регистрации).
+
+    Сопоставление идёт не по всем событиям смены, а только по активным: событие, начавшееся раньше
+    merge_window от самой поздней детекции, уже не может ни с чем слиться и выбывает из индекса.
+    Пространственных кандидатов ищем через сетку (_GridIndex). Результат совпадает с полным
+    перебором self.events[::-1]; для детекций, пришедших не по порядку времени, используется он же.
+    """
+
+    # с какого числа детекций в кадре матрица IoU выгоднее поштучного сопоставления
+    FRAME_BATCH_MIN = 8
+
+    def __init__(self, merge_window_sec: int = 10, grid_cell: int = 128):
+        self.events: List[ViolationEvent] = []
+        self.next_id = 1
+        self.merge_window = merge_window_sec
+        self.lock = threading.Lock()
+        self._active: "deque[ViolationEvent]" = deque()
+        self._grid = _GridIndex(grid_cell)
+        self._watermark = float('-inf')   # самое позднее time_s среди детекций
+        self._frame_idx = None            # кадр, события которого лежат в _frame_events
+        self._frame_events: List[ViolationEvent] = []
+        # pending-события по времени последнего обновления: (last_update_s, seq, event)
+        self._deadlines: List[Tuple[float, int, ViolationEvent]] = []
+        self._seq = 0
+
+    @staticmethod
+    def _matches(ev: ViolationEvent, det: Detection, merge_window: float) -> bool:
+        time_close = abs(ev.time_s - det.time_s) <= merge_window
+        same_frame = (ev.frame_idx == det.frame_idx)
+        return same_frame or (time_close and iou(ev.bbox, det.bbox) > 0.1)
+
+    def _advance(self, det: Detection) -> bool:
+        """Сдвигает окно активных событий. False — детекция из прошлого, нужен полный перебор."""
+        if det.time_s < self._watermark:
+            return False
+        self._watermark = det.time_s
+        horizon = det.time_s - self.merge_window
+        while self._active and self._active[0].time_s < horizon:
+            self._grid.remove(self._active.popleft())
+        if det.frame_idx != self._frame_idx:
+            self._frame_idx = det.frame_idx
+            self._frame_events = []
+        return True
+
+    def _candidates(self, det: Detection) -> Dict[int, ViolationEvent]:
+        cands = self._grid.query(det.bbox)
+        for ev in self._frame_events:
+            cands[ev.id] = ev
+        return cands
+
+    def _merge(self, ev: ViolationEvent, det: Detection, current_s: float):
+        if det.class_name not in ev.class_names:
+            ev.class_names.append(det.class_name)
+        ev.confs.append(det.conf)
+        ev.bbox = union_bbox(ev.bbox, det.bbox)
+        if det.time_s < ev.time_s:
+            ev.time_s = det.time_s
+            ev.frame_idx = det.frame_idx
+        ev.last_update_s = current_s
+        ev.pending = True
+        ev.saved = False
+        ev.enqueued = False  # сбрасываем маркер, т.к. появились новые данные
+        if ev.id in self._grid.ev_cells:
+            self._grid.insert(ev)
+        self._schedule(ev)
+
+    def _create(self, det: Detection, current_s: float) -> ViolationEvent:
+        ev = ViolationEvent(
+            id=self.next_id,
+            class_names=[det.class_name],
+            confs=[det.conf],
+            bbox=det.bbox,
+            frame_idx=det.frame_idx,
+            time_s=det.time_s,
+            wall_time_first=det.wall_time,
+            pending=True,
+            last_update_s=current_s,
+            saved=False,
+            enqueued=False
+        )
+        self.next_id += 1
+        self.events.append(ev)
+        self._active.append(ev)
+        self._grid.insert(ev)
+        if det.frame_idx == self._frame_idx:
+            self._frame_events.append(ev)
+        self._schedule(ev)
+        return ev
+
+    def _schedule(self, ev: ViolationEvent):
+        # старая запись события в куче не удаляется, а пропускается при извлечении (last_update_s сменился)
+        self._seq += 1
+        heapq.heappush(self._deadlines, (ev.last_update_s, self._seq, ev))
+
+    def reschedule(self, ev: ViolationEvent):
+        """Вернуть событие в очередь финализации (например, клип не встал в очередь писателя)."""
+        with self.lock:
+            self._schedule(ev)
+
+    def pop_due(self, current_s: float, finalize_delay: float) -> List[ViolationEvent]:
+        """
+        Извлекает pending-события, которые не обновлялись finalize_delay секунд (по порядку id).
+        Куча упорядочена по last_update_s, поэтому просматриваются только действительно созревшие
+        события, а не весь список за смену.
+        """
+        due: Dict[int, ViolationEvent] = {}
+        with self.lock:
+            heap = self._deadlines
+            while heap and current_s - heap[0][0] >= finalize_delay:
+                stamp, _, ev = heapq.heappop(heap)
+                if stamp != ev.last_update_s or not ev.pending or ev.saved or ev.enqueued:
+                    continue  # устаревшая запись или событие уже ушло на запись
+                due[ev.id] = ev
+        return [due[k] for k in sorted(due)]
+
+    def register_detection(self, det: Detection, current_s: float) -> (bool, ViolationEvent):
+        """
+        Регистрируем детекцию. Если она попадает в существующее событие (тот же кадр или
+        близко по времени + пространственно), то сливаем. Иначе создаём новое событие.
+        Возвращаем (is_new_event_created, event)
+        """
+        with self.lock:
+            return self._register(det, current_s)
+
+    def _register(self, det: Detection, current_s: float) -> (bool, ViolationEvent):
+        if self._advance(det):
+            # самое новое подходящее событие = с наибольшим id среди кандидатов
+            match = None
+            for ev in self._candidates(det).values():
+                if (match is None or ev.id > match.id) and self._matches(ev, det, self.merge_window):
+                    match = ev
+        else:
+            match = next((ev for ev in self.events[::-1] if self._matches(ev, det, self.merge_window)), None)
+        if match is not None:
+            self._merge(match, det, current_s)
+            return False, match
+        return True, self._create(det, current_s)
+
+    def register_frame(self, dets: List[Detection], current_s: float,
+                       on_new: Optional[Callable[[ViolationEvent], None]] = None) -> List[Tuple[bool, ViolationEvent]]:
+        """
+        Пакетная регистрация всех детекций одного кадра: IoU детекций со всеми кандидатами считается
+        одной матрицей NumPy, после слияния пересчитывается только столбец изменённого события.
+        Результат тот же, что у последовательных register_detection. on_new(ev) вызывается сразу
+        после создания события (до обработки следующих детекций кадра). Для кадров с малым числом
+        детекций (< FRAME_BATCH_MIN) накладные расходы NumPy больше выигрыша — там поштучный путь.
+        """
+        if not dets:
+            return []
+        with self.lock:
+            one_frame = all(d.frame_idx == dets[0].frame_idx and d.time_s == dets[0].time_s for d in dets)
+            if len(dets) < self.FRAME_BATCH_MIN or not one_frame or not self._advance(dets[0]):
+                out = []
+                for det in dets:
+                    res = self._register(det, current_s)
+                    if res[0] and on_new is not None:
+                        on_new(res[1])
+                    out.append(res)
+                return out
+
+            cands: Dict[int, ViolationEvent] = {}
+            for det in dets:
+                cands.update(self._candidates(det))
+            evs = sorted(cands.values(), key=lambda e: e.id)
+            det_boxes = np.array([d.bbox for d in dets], dtype=np.float64).reshape(-1, 4)
+            ious = iou_matrix(det_boxes, np.array([e.bbox for e in evs], dtype=np.float64).reshape(-1, 4))
+            t0 = np.array([e.time_s for e in evs], dtype=np.float64)
+            t_now = dets[0].time_s
+            ok_time = np.abs(t0 - t_now) <= self.merge_window
+            same = np.array([e.frame_idx == dets[0].frame_idx for e in evs], dtype=bool)
+
+            out = []
+            for i, det in enumerate(dets):
+                hits = np.flatnonzero(same | (ok_time & (ious[i] > 0.1)))
+                if hits.size:
+                    j = int(hits[-1])  # evs отсортированы по id: последний — самый новый
+                    ev = evs[j]
+                    self._merge(ev, det, current_s)
+                    if i + 1 < len(dets):
+                        ious[i + 1:, j] = iou_matrix(det_boxes[i + 1:], np.array([ev.bbox], dtype=np.float64))[:, 0]
+                    ok_time[j] = abs(ev.time_s - t_now) <= self.merge_window
+                    same[j] = ev.frame_idx == det.frame_idx
+                    out.append((False, ev))
+                    continue
+                ev = self._create(det, current_s)
+                evs.append(ev)
+                col = np.zeros((len(dets), 1))
+                if i + 1 < len(dets):
+                    col[i + 1:] = iou_matrix(det_boxes[i + 1:], np.array([ev.bbox], dtype=np.float64))
+                ious = np.concatenate([ious, col], axis=1)
+                ok_time = np.append(ok_time, True)
+                same = np.append(same, True)
+                out.append((True, ev))
+                if on_new is not None:
+                    on_new(ev)
+            return out
\ No newline at end of file
@@ -0,0 +1,185 @@
+# event_index.py
+# Индекс событий всех результатов в SQLite: /events больше не перечитывает отчёты каждой задачи на каждый запрос.
+# Задача индексируется один раз по завершении; для старых результатов — разовый backfill:
+#   python event_index.py backfill [--output-dir results_shift] [--force]
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from config import OUTPUT_DIR, EVENT_INDEX_PATH
+from reports import load_events, EVENTS_PARQUET, EVENTS_CSV
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,   -- глобальный id события (стабилен при переиндексации)
+    task TEXT NOT NULL,                     -- имя директории результата в OUTPUT_DIR
+    event_id INTEGER NOT NULL,              -- номер события внутри задачи
+    time_s REAL NOT NULL,
+    frame_idx INTEGER NOT NULL,
+    wall_time_first TEXT,
+    class_names TEXT NOT NULL,              -- JSON-списки
+    confs TEXT NOT NULL,
+    bbox TEXT NOT NULL,
+    clip_path TEXT,
+    saved INTEGER NOT NULL,
+    UNIQUE (task, event_id)
+);
+CREATE INDEX IF NOT EXISTS events_time ON events (time_s);
+CREATE TABLE IF NOT EXISTS event_classes (
+    class_name TEXT NOT NULL,
+    event INTEGER NOT NULL REFERENCES events (id) ON DELETE CASCADE,
+    PRIMARY KEY (class_name, event)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS indexed_tasks (
+    task TEXT PRIMARY KEY,
+    source_mtime REAL NOT NULL,
+    indexed_at REAL NOT NULL,
+    n_events INTEGER NOT NULL
+);
+"""
+
+COLUMNS = ('id', 'task', 'event_id', 'time_s', 'frame_idx', 'wall_time_first', 'class_names', 'confs', 'bbox',
+           'clip_path', 'saved')
+
+
+def _report_mtime(task_dir: str) -> float:
+    paths = [os.path.join(task_dir, EVENTS_PARQUET), os.path.join(task_dir, EVENTS_CSV)]
+    return max((os.path.getmtime(p) for p in paths if os.path.exists(p)), default=0.0)
+
+
+class EventIndex:
+    """
+    SQLite-индекс событий. Соединение на поток (sqlite3 не любит общие соединения между потоками),
+    WAL — чтобы чтение /events не ждало записи индекса завершившейся задачи.
+    Выборки — по глобальному id, задаче, классу и диапазону времени, с keyset-пагинацией по id.
+    """
+
+    def __init__(self, path: str = EVENT_INDEX_PATH):
+        self.path = path
+        self._local = threading.local()
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    def index_task(self, task: str, task_dir: str) -> int:
+        """(Пере)индексирует события результата task_dir. Возвращает число событий."""
+        events = load_events(task_dir) or []
+        mtime = _report_mtime(task_dir)
+        conn = self._conn()
+        with conn:
+            stale = {r[0] for r in conn.execute("SELECT id FROM events WHERE task = ?", (task,))}
+            for e in events:
+                cur = conn.execute(
+                    "INSERT INTO events (task, event_id, time_s, frame_idx, wall_time_first, class_names, confs, bbox,"
+                    " clip_path, saved) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (task, event_id) DO UPDATE SET time_s=excluded.time_s,"
+                    " frame_idx=excluded.frame_idx, wall_time_first=excluded.wall_time_first,"
+                    " class_names=excluded.class_names, confs=excluded.confs, bbox=excluded.bbox,"
+                    " clip_path=excluded.clip_path, saved=excluded.saved"
+                    " RETURNING id",
+                    (task, int(e['id']), float(e['time_s']), int(e['frame_idx']), e['wall_time_first'],
+                     json.dumps(list(e['class_names'])), json.dumps([float(c) for c in e['confs']]),
+                     json.dumps([int(v) for v in e['bbox']]), e['clip_path'], int(bool(e['saved']))))
+                gid = cur.fetchone()[0]
+                stale.discard(gid)
+                conn.execute("DELETE FROM event_classes WHERE event = ?", (gid,))
+                conn.executemany("INSERT OR IGNORE INTO event_classes (class_name, event) VALUES (?, ?)",
+                                 [(c, gid) for c in e['class_names']])
+            # события, которых в новом отчёте больше нет
+            conn.executemany("DELETE FROM events WHERE id = ?", [(i,) for i in stale])
+            conn.execute("INSERT OR REPLACE INTO indexed_tasks (task, source_mtime, indexed_at, n_events)"
+                         " VALUES (?, ?, ?, ?)", (task, mtime, time.time(), len(events)))
+        return len(events)
+
+    def remove_task(self, task: str):
+        """Убирает события результата (например, вытесненного из кэша)."""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM events WHERE task = ?", (task,))
+            conn.execute("DELETE FROM indexed_tasks WHERE task = ?", (task,))
+
+    def backfill(self, output_dir: str = OUTPUT_DIR, force: bool = False) -> int:
+        """Индексирует все результаты в output_dir; неизменившиеся отчёты пропускаются (если не force)."""
+        done = dict(self._conn().execute("SELECT task, source_mtime FROM indexed_tasks").fetchall())
+        total = 0
+        for sub in sorted(os.listdir(output_dir)):
+            task_dir = os.path.join(output_dir, sub)
+            if not os.path.isdir(task_dir):
+                continue
+            mtime = _report_mtime(task_dir)
+            if not mtime or (not force and done.get(sub) == mtime):
+                continue
+            try:
+                n = self.index_task(sub, task_dir)
+            except Exception as e:
+                print(f"[INDEX] skip {sub}: {e}")
+                continue
+            print(f"[INDEX] {sub}: {n} events")
+            total += n
+        return total
+
+    def get(self, event_id: int) -> Optional[dict]:
+        row = self._conn().execute(f"SELECT {', '.join(COLUMNS)} FROM events WHERE id = ?", (event_id,)).fetchone()
+        return _row(row) if row else None
+
+    def list(self, limit: int = 50, after: Optional[int] = None, task: Optional[str] = None,
+             class_name: Optional[str] = None, time_from: Optional[float] = None,
+             time_to: Optional[float] = None) -> List[dict]:
+        """События по возрастанию id, начиная после after (keyset: страница не зависит от глубины)."""
+        sql = f"SELECT {', '.join('e.' + c for c in COLUMNS)} FROM events e"
+        where, args = [], []
+        if class_name is not None:
+            sql += " JOIN event_classes c ON c.event = e.id AND c.class_name = ?"
+            args.append(class_name)
+        if after is not None:
+            where.append("e.id > ?")
+            args.append(after)
+        if task is not None:
+            where.append("e.task = ?")
+            args.append(task)
+        if time_from is not None:
+            where.append("e.time_s >= ?")
+            args.append(time_from)
+        if time_to is not None:
+            where.append("e.time_s <= ?")
+            args.append(time_to)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY e.id LIMIT ?"
+        args.append(max(0, int(limit)))
+        return [_row(r) for r in self._conn().execute(sql, args).fetchall()]
+
+
+def _row(row) -> dict:
+    r = dict(zip(COLUMNS, row))
+    r['class_names'] = json.loads(r['class_names'])
+    r['confs'] = json.loads(r['confs'])
+    r['bbox'] = tuple(json.loads(r['bbox']))
+    r['saved'] = bool(r['saved'])
+    return r
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Индекс событий результатов')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    bf = sub.add_parser('backfill', help='проиндексировать существующие результаты')
+    bf.add_argument('--output-dir', default=OUTPUT_DIR)
+    bf.add_argument('--index', default=EVENT_INDEX_PATH)
+    bf.add_argument('--force', action='store_true', help='переиндексировать и неизменившиеся результаты')
+    args = parser.parse_args()
+    n = EventIndex(args.index).backfill(args.output_dir, force=args.force)
+    print(f"[INDEX] backfill done: {n} events")
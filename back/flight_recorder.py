@@ -0,0 +1,86 @@
+# flight_recorder.py
+# «Бортовой самописец» задачи (--trace): интервалы стадий кадра (декодирование, инференс батча, события)
+# и задач клипов (постановка в очередь с JPEG, ожидание в очереди, запись, webhook) в кольцевом буфере,
+# который в конце задачи сохраняется как Chrome trace (out_dir/trace.json) — открывается в
+# chrome://tracing или ui.perfetto.dev. Запись интервала — кортеж в deque(maxlen), без блокировок и ввода-вывода.
+# На длинной смене пишутся не все кадры: окна по TRACE_WINDOW_FRAMES кадров, каждое sample_every-е
+# (непрерывные куски таймлайна полезнее разрозненных кадров); задачи клипов пишутся всегда.
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from config import TRACE_BUFFER_EVENTS, TRACE_SAMPLE_EVERY, TRACE_WINDOW_FRAMES
+from utils import atomic_write
+
+TRACE_FILE = "trace.json"
+
+
+class FlightRecorder:
+    """
+    begin() -> t0; span(name, t0, ...) записывает интервал от t0 до сейчас в текущем потоке.
+    counter(name, value) — значение во времени (например, глубина очереди писателя).
+    Хранятся последние capacity записей; dropped — сколько вытеснено.
+    """
+
+    def __init__(self, capacity: int = TRACE_BUFFER_EVENTS, sample_every: int = TRACE_SAMPLE_EVERY,
+                 window_frames: int = TRACE_WINDOW_FRAMES):
+        self.capacity = max(1, int(capacity))
+        self.sample_every = max(1, int(sample_every))
+        self.window_frames = max(1, int(window_frames))
+        self.recorded = 0
+        self._events: "deque[tuple]" = deque(maxlen=self.capacity)
+        self._t0 = time.perf_counter_ns()
+        self._threads = {}
+
+    def sampled(self, frame_idx: int) -> bool:
+        """Попадает ли кадр в записываемое окно."""
+        return (frame_idx // self.window_frames) % self.sample_every == 0
+
+    @staticmethod
+    def begin() -> int:
+        return time.perf_counter_ns()
+
+    def span(self, name: str, t0: int, cat: str = 'frame', args: Optional[dict] = None):
+        tid = threading.get_ident()
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+        self._events.append(('X', name, cat, t0, time.perf_counter_ns() - t0, tid, args))
+        self.recorded += 1
+
+    def counter(self, name: str, value: float):
+        self._events.append(('C', name, 'counter', time.perf_counter_ns(), 0, 0, {name: value}))
+        self.recorded += 1
+
+    @property
+    def dropped(self) -> int:
+        return max(0, self.recorded - len(self._events))
+
+    def to_chrome(self) -> dict:
+        pid = os.getpid()
+        out = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+               for tid, name in list(self._threads.items())]
+        for ph, name, cat, t0, dur, tid, args in list(self._events):
+            ev = {"name": name, "cat": cat, "ph": ph, "ts": (t0 - self._t0) / 1000.0, "pid": pid, "tid": tid}
+            if ph == 'X':
+                ev["dur"] = dur / 1000.0
+            if args:
+                ev["args"] = args
+            out.append(ev)
+        return {"traceEvents": out, "displayTimeUnit": "ms",
+                "otherData": {"sample_every": self.sample_every, "window_frames": self.window_frames,
+                              "recorded": self.recorded, "dropped": self.dropped}}
+
+    def dump(self, path: str) -> str:
+        """Атомарно пишет Chrome trace JSON в path."""
+        trace = self.to_chrome()
+
+        def write(tmp):
+            with open(tmp, 'w') as f:
+                json.dump(trace, f)
+        atomic_write(path, write)
+        print(f"[TRACE] {self.recorded} spans ({self.dropped} dropped by ring buffer) -> {path}")
+        return path
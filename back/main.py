@@ -1,129 +1,433 @@
-# main.py
-# Главный CLI: сборка пайплайна, цикл по кадрам, логика finalize (debounce) и экспорт отчетов.
-
-import argparse
-from collections import deque
-import pandas as pd
-from tqdm import tqdm
-import os
-import cv2
-
-from config import *
-from utils import ensure_dir, now_iso
-from model_iface import YoloModel
-from detector import ViolationDetector, Detection
-from writer import ClipWriter
-
-
-def process_video(model_path, video_path, out_dir, conf_thresh=CONF_THRESH, detect_every_n=DETECT_EVERY_N_FRAMES,
-                  merge_sec=MERGE_WINDOW_SEC, finalize_delay=FINALIZE_DELAY, save_immediately=False,
-                  workers=ASYNC_WORKERS, webhook=None):
-    ensure_dir(out_dir)
-    clips_dir = os.path.join(out_dir, 'clips')
-    ensure_dir(clips_dir)
-
-    model = YoloModel(model_path)
-    cap = cv2.VideoCapture(video_path)
-    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
-    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
-
-    # буфер кадров
-    max_buffer_sec = CLIP_PRE_SEC + CLIP_POST_SEC + finalize_delay + 2
-    frames_buffer = deque(maxlen=int(max_buffer_sec * fps) + 10)
-
-    detector = ViolationDetector(merge_window_sec=merge_sec)
-    writer = ClipWriter(workers=workers, queue_max=TASK_QUEUE_MAXSIZE, webhook=webhook)
-
-    all_detections = []
-    pbar = tqdm(total=total, desc='Processing frames')
-    idx = 0
-    try:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            frames_buffer.append((idx, frame.copy()))
-            current_s = idx / fps
-            wall_t = now_iso()
-
-            # финализировать pending события при простое
-            for ev in list(detector.events):
-                if ev.pending and not ev.saved and not ev.enqueued:
-                    if current_s - ev.last_update_s >= finalize_delay:
-                        clip_filename = f"event_{ev.id}_{'_'.join(ev.class_names)}_{int(ev.time_s)}s.mp4"
-                        clip_path = os.path.join(clips_dir, clip_filename)
-                        success = writer.enqueue(frames_buffer, ev.frame_idx, fps, clip_path, all_detections, ev,
-                                                  pre_sec=CLIP_PRE_SEC, post_sec=CLIP_POST_SEC)
-                        if success:
-                            print(f"[ENQUEUE] {ev.id}")
-
-            if idx % detect_every_n == 0:
-                dets = model.predict_frame(frame, conf=conf_thresh)
-                for cname, conf, bbox in dets:
-                    if conf < conf_thresh:
-                        continue
-                    det = Detection(class_name=cname, conf=conf, bbox=bbox, frame_idx=idx, time_s=current_s, wall_time=wall_t)
-                    all_detections.append(det)
-                    if cname in VIOLATION_CLASSES:
-                        is_new, ev = detector.register_detection(det, current_s)
-                        if is_new and save_immediately:
-                            clip_path = os.path.join(clips_dir, f"event_{ev.id}_{'_'.join(ev.class_names)}_{int(ev.time_s)}s.mp4")
-                            writer.enqueue(frames_buffer, ev.frame_idx, fps, clip_path, all_detections, ev,
-                                           pre_sec=CLIP_PRE_SEC, post_sec=CLIP_POST_SEC)
-            idx += 1
-            pbar.update(1)
-    finally:
-        # финализировать оставшиеся
-        for ev in detector.events:
-            if ev.pending and not ev.saved and not ev.enqueued:
-                clip_path = os.path.join(clips_dir, f"event_{ev.id}_{'_'.join(ev.class_names)}_{int(ev.time_s)}s_final.mp4")
-                writer.enqueue(frames_buffer, ev.frame_idx, fps, clip_path, all_detections, ev,
-                               pre_sec=CLIP_PRE_SEC, post_sec=CLIP_POST_SEC)
-        writer.shutdown()
-        pbar.close()
-        cap.release()
-
-    # экспорт отчётов
-    det_rows = []
-    for d in all_detections:
-        det_rows.append({'wall_time': d.wall_time, 'time_s': d.time_s, 'frame_idx': d.frame_idx,
-                         'class_name': d.class_name, 'conf': d.conf, 'bbox': d.bbox})
-    df = pd.DataFrame(det_rows)
-    df.to_csv(os.path.join(out_dir, 'detections_all.csv'), index=False)
-
-    ev_rows = []
-    for e in detector.events:
-        ev_rows.append({'id': e.id, 'class_names': e.class_names, 'confs': e.confs, 'time_s': e.time_s,
-                        'frame_idx': e.frame_idx, 'wall_time_first': e.wall_time_first, 'bbox': e.bbox,
-                        'clip_path': e.clip_path, 'saved': e.saved})
-    pd.DataFrame(ev_rows).to_csv(os.path.join(out_dir, 'violations_events.csv'), index=False)
-
-    print('Done')
-
-
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--model', default=MODEL_PATH)
-    parser.add_argument('--video', default=INPUT_VIDEO)
-    parser.add_argument('--out', default=OUTPUT_DIR)
-    parser.add_argument('--conf', type=float, default=CONF_THRESH)
-    parser.add_argument('--every', type=int, default=DETECT_EVERY_N_FRAMES)
-    parser.add_argument('--merge_sec', type=int, default=MERGE_WINDOW_SEC)
-    parser.add_argument('--finalize-delay', type=float, default=FINALIZE_DELAY)
-    parser.add_argument('--save-immediately', action='store_true')
-    parser.add_argument('--workers', type=int, default=ASYNC_WORKERS)
-    parser.add_argument('--webhook', type=str, default=None)
-    args = parser.parse_args()
-
-    process_video(
-        model_path=args.model,
-        video_path=args.video,
-        out_dir=args.out,
-        conf_thresh=args.conf,
-        detect_every_n=args.every,
-        merge_sec=args.merge_sec,
-        finalize_delay=args.finalize_delay,
-        save_immediately=args.save_immediately,
-        workers=args.workers,
-        webhook=args.webhook
+# main.py
+# Главный CLI: сборка пайплайна, цикл по кадрам, логика finalize (debounce) и экспорт отчетов.
+
+import argparse
+from tqdm import tqdm
+import os
+import time
+import cv2
+
+from config import *
+from utils import ensure_dir, now_iso
+from model_iface import load_model
+from detector import ViolationDetector
+from writer import ClipWriter, JPEG_QUALITY
+from buffers import FrameRingBuffer, CompressedFrameBuffer, SourceSeekFrames
+from reports import ReportSink
+from pipeline import FrameItem, InferenceBatcher, EventStage, ProgressReporter, run_pipelined
+from raw_cache import RawDetectionRecorder, RawDetections
+from stream import LiveCapture
+from motion import MotionGate
+from roi import RoiModel, load_roi
+import metrics
+from flight_recorder import FlightRecorder, TRACE_FILE
+
+
+def process_video(model_path, video_path, out_dir, conf_thresh=CONF_THRESH, detect_every_n=DETECT_EVERY_N_FRAMES,
+                  merge_sec=MERGE_WINDOW_SEC, finalize_delay=FINALIZE_DELAY, save_immediately=False,
+                  workers=ASYNC_WORKERS, webhook=None, batch_size=INFER_BATCH_SIZE, pipelined=False,
+                  compress_buffer=CLIP_BUFFER_COMPRESSED, clips_from_source=CLIP_FROM_SOURCE,
+                  report_formats=REPORT_FORMATS, model=None, violation_classes=VIOLATION_CLASSES,
+                  raw_cache_path=None, motion_gate=MOTION_GATE, roi=ROI_CONFIG, backend=INFER_BACKEND,
+                  trace=TRACE, trace_sample_every=TRACE_SAMPLE_EVERY, on_progress=None, on_event=None):
+    """model — уже загруженная модель (тёплый воркер планировщика); иначе грузится из model_path.
+    raw_cache_path — сохранить сырые выходы модели (при conf RAW_CACHE_CONF) для replay_video;
+    с motion_gate не сохраняется: пропущенные гейтом кадры replay принял бы за кадры без детекций.
+    motion_gate — не запускать модель на кадрах без движения (MotionGate).
+    roi — зоны интереса камеры (путь к JSON или dict): инференс только по ним (RoiModel).
+    backend — бэкенд модели (model_iface.load_model): auto, torch, onnx, openvino.
+    trace — таймлайн стадий кадров и клипов в out_dir/trace.json (FlightRecorder), каждое
+    trace_sample_every-е окно кадров.
+    on_progress(dict) — прогресс (кадры done/total, fps, ETA) не чаще PROGRESS_EVERY_SEC и в конце;
+    on_event(dict) — каждое финализированное событие (pipeline.event_message)."""
+    ensure_dir(out_dir)
+    batch_size = batch_size or INFER_BATCH_SIZE
+    tracer = FlightRecorder(sample_every=trace_sample_every or TRACE_SAMPLE_EVERY) if trace else None
+    t_task = FlightRecorder.begin()
+
+    model = _with_roi(model or load_model(model_path, backend), roi)
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+
+    # кольцевой буфер кадров (+ запас на кадры, ожидающие в неполном батче инференса,
+    # и в конвейерном режиме — на кадры в очередях между стадиями)
+    max_buffer_sec = CLIP_PRE_SEC + CLIP_POST_SEC + finalize_delay + 2
+    lag_frames = batch_size * detect_every_n + (2 * PIPELINE_QUEUE_SIZE if pipelined else 0)
+    buffer_frames = int(max_buffer_sec * fps) + lag_frames + 10
+    if clips_from_source:
+        # клипы читаются воркерами из исходного файла — буфер кадров не нужен
+        frames_buffer = SourceSeekFrames(video_path, total=total, lag_frames=lag_frames)
+    elif compress_buffer:
+        # кадры кодируются в JPEG один раз при декодировании; сырых кадров держим только lag_frames
+        frames_buffer = CompressedFrameBuffer(buffer_frames, lag_frames=lag_frames,
+                                              workers=CLIP_BUFFER_ENCODERS, quality=JPEG_QUALITY)
+    else:
+        frames_buffer = FrameRingBuffer(buffer_frames)
+
+    stage, writer, sink = _make_stage(out_dir, frames_buffer, fps, conf_thresh, merge_sec, finalize_delay,
+                                      save_immediately, workers, webhook, report_formats, violation_classes,
+                                      tracer=tracer, on_event=on_event)
+    infer_conf, recorder = conf_thresh, None
+    if raw_cache_path and motion_gate:
+        print("[RAW] motion gate skips inference on static frames; raw detections are not cached for this run")
+    elif raw_cache_path:
+        # модель работает с минимальным conf, порог conf_thresh применяет стадия событий
+        infer_conf = min(conf_thresh, RAW_CACHE_CONF)
+        recorder = RawDetectionRecorder(raw_cache_path, fps, total, detect_every_n, infer_conf,
+                                        meta={"video": os.path.abspath(video_path), "model": model_path})
+    gate = MotionGate() if motion_gate else None
+    batcher = InferenceBatcher(model, infer_conf, batch_size=batch_size, max_latency_s=INFER_BATCH_MAX_LATENCY_SEC,
+                               recorder=recorder, gate=gate, tracer=tracer)
+
+    pbar = tqdm(total=total, desc='Processing frames')
+    frames_decoded = metrics.FRAMES_DECODED.labels('video')
+    progress = ProgressReporter(total, on_progress) if on_progress is not None else None
+
+    def frame_done():
+        frames_decoded.inc()
+        pbar.update(1)
+        if progress is not None:
+            progress.frame_done(len(stage.detector.events))
+
+    try:
+        if pipelined:
+            # декодирование и инференс в отдельных потоках, события — здесь
+            run_pipelined(cap, fps, detect_every_n, batcher, stage, frames_buffer,
+                          queue_size=PIPELINE_QUEUE_SIZE, log_every_s=PIPELINE_LOG_EVERY_SEC,
+                          on_frame_done=frame_done, tracer=tracer)
+        else:
+            idx = 0
+            while True:
+                # декодируем прямо в слот кольцевого буфера (без копии)
+                infer = idx % detect_every_n == 0
+                t_span = tracer.begin() if tracer is not None else 0
+                ret, frame = frames_buffer.read(cap, need=infer)
+                if not ret:
+                    break
+                if tracer is not None and tracer.sampled(idx):
+                    tracer.span('decode', t_span, args={'frame': idx})
+                item = FrameItem(idx=idx, frame=frame, current_s=idx / fps, wall_time=now_iso(), infer=infer)
+                # детекции уходят в детектор строго по порядку кадров, когда готов их батч
+                for ready in batcher.push(item):
+                    stage.on_frame(ready)
+                idx += 1
+                frame_done()
+            for ready in batcher.flush():
+                stage.on_frame(ready)
+    finally:
+        stage.finalize_all()
+        writer.shutdown()
+        if isinstance(frames_buffer, CompressedFrameBuffer):
+            frames_buffer.close()
+        pbar.close()
+        cap.release()
+        if tracer is not None:
+            tracer.span('process_video', t_task, cat='task', args={'video': os.path.basename(video_path)})
+            tracer.dump(os.path.join(out_dir, TRACE_FILE))
+
+    if recorder is not None:
+        recorder.header['total'] = frames_buffer.last_idx + 1
+        recorder.save()
+    # дописываем оставшиеся детекции и финальный снимок событий
+    sink.close(stage.detections, stage.detector.events)
+
+    if gate is not None:
+        print(f"[MOTION] {gate}")
+    metrics.REGISTRY.export_now()
+    if progress is not None:
+        progress.finish(len(stage.detector.events))
+    print('Done')
+
+
+def process_stream(model_path, source, out_dir, conf_thresh=CONF_THRESH, detect_every_n=DETECT_EVERY_N_FRAMES,
+                   merge_sec=MERGE_WINDOW_SEC, finalize_delay=FINALIZE_DELAY, save_immediately=False,
+                   workers=ASYNC_WORKERS, webhook=None, batch_size=INFER_BATCH_SIZE, report_formats=REPORT_FORMATS,
+                   model=None, violation_classes=VIOLATION_CLASSES, max_lag_sec=STREAM_MAX_LAG_SEC,
+                   report_sec=STREAM_REPORT_SEC, event_index_path=None, duration_s=None, stop_file=None,
+                   motion_gate=MOTION_GATE, roi=ROI_CONFIG, on_stats=None, backend=INFER_BACKEND, on_event=None):
+    """
+    Непрерывная обработка живого источника (RTSP/HTTP/pipe/камера, synthetic://, файл в темпе камеры).
+    Нет конца файла: отчёты (детекции и снимок событий) и строки индекса событий (event_index_path)
+    обновляются каждые report_sec секунд. Если инференс не успевает за камерой, кадры старше max_lag_sec
+    выбрасываются (LiveCapture), поэтому время кадра — момент захвата, а не idx / fps.
+    on_stats(dict) получает fps, задержку и счётчики кадров при каждом сбросе отчётов и в конце;
+    on_event(dict) — каждое финализированное событие.
+    Останавливается по концу источника, duration_s, появлению stop_file или Ctrl+C.
+    """
+    ensure_dir(out_dir)
+    batch_size = batch_size or 1
+    model = _with_roi(model or load_model(model_path, backend), roi)
+    cap = LiveCapture(source, max_queue=STREAM_QUEUE_FRAMES, max_lag_sec=max_lag_sec,
+                      reconnect_tries=STREAM_RECONNECT_TRIES, reconnect_sec=STREAM_RECONNECT_SEC)
+    fps = cap.fps
+
+    max_buffer_sec = CLIP_PRE_SEC + CLIP_POST_SEC + finalize_delay + 2
+    frames_buffer = FrameRingBuffer(int(max_buffer_sec * fps) + batch_size * detect_every_n + 10)
+    stage, writer, sink = _make_stage(out_dir, frames_buffer, fps, conf_thresh, merge_sec, finalize_delay,
+                                      save_immediately, workers, webhook, report_formats, violation_classes,
+                                      on_event=on_event)
+    gate = MotionGate() if motion_gate else None
+    batcher = InferenceBatcher(model, conf_thresh, batch_size=batch_size, max_latency_s=INFER_BATCH_MAX_LATENCY_SEC,
+                               gate=gate)
+    index = None
+    if event_index_path:
+        from event_index import EventIndex
+        index = EventIndex(event_index_path)
+    task = os.path.basename(os.path.normpath(out_dir))
+
+    last_stats = {"t": time.monotonic(), "frames": 0}
+
+    def stats(done=False) -> dict:
+        now = time.monotonic()
+        elapsed = now - last_stats["t"]
+        st = {"task": task, "frames": idx, "captured": cap.captured, "dropped": cap.dropped, "queued": cap.queued,
+              "fps": (idx - last_stats["frames"]) / elapsed if elapsed > 0 else 0.0,
+              "lag_s": now - cap.capture_ts if cap.capture_ts else 0.0,
+              "events": len(stage.detector.events), "done": done}
+        last_stats.update(t=now, frames=idx)
+        if on_stats is not None:
+            on_stats(st)
+        return st
+
+    def report():
+        sink.flush_detections(stage.detections)
+        sink.write_events(stage.detector.events)
+        if index is not None:
+            index.index_task(task, out_dir)
+        st = stats()
+        print(f"[STREAM] {task}: frames={st['frames']} fps={st['fps']:.1f} captured={st['captured']} "
+              f"dropped={st['dropped']} queued={st['queued']} lag={st['lag_s']:.2f}s events={st['events']}"
+              + (f" | {gate}" if gate is not None else ""))
+
+    frames_decoded = metrics.FRAMES_DECODED.labels('stream')
+    idx = 0
+    start = None
+    last_report = last_stop_check = time.monotonic()
+    try:
+        while True:
+            infer = idx % detect_every_n == 0
+            ret, frame = frames_buffer.read(cap)
+            if not ret:
+                break
+            if start is None:
+                start = cap.capture_ts
+            current_s = cap.capture_ts - start
+            frames_decoded.inc()
+            item = FrameItem(idx=idx, frame=frame, current_s=current_s, wall_time=now_iso(), infer=infer)
+            for ready in batcher.push(item):
+                stage.on_frame(ready)
+            idx += 1
+            now = time.monotonic()
+            if now - last_report >= report_sec:
+                last_report = now
+                report()
+            if stop_file and now - last_stop_check >= 1.0:
+                last_stop_check = now
+                if os.path.exists(stop_file):
+                    print("[STREAM] stop requested")
+                    break
+            if duration_s is not None and current_s >= duration_s:
+                break
+        for ready in batcher.flush():
+            stage.on_frame(ready)
+    except KeyboardInterrupt:
+        print("[STREAM] interrupted")
+    finally:
+        cap.release()
+        stage.finalize_all()
+        writer.shutdown()
+
+    sink.close(stage.detections, stage.detector.events)
+    if index is not None:
+        index.index_task(task, out_dir)
+    stats(done=True)
+    metrics.REGISTRY.export_now()
+    print(f'Done (stream {task}: {idx} frames processed, {cap.dropped} dropped)')
+
+
+def _with_roi(model, roi):
+    spec = load_roi(roi)
+    if spec and spec.get("regions"):
+        print(f"[ROI] inference on {len(spec['regions'])} regions")
+        return RoiModel(model, spec)
+    return model
+
+
+def _make_stage(out_dir, frames_buffer, fps, conf_thresh, merge_sec, finalize_delay, save_immediately, workers,
+                webhook, report_formats, violation_classes, tracer=None,
+                on_event=None):
+    """Детектор событий, писатель клипов и отчёты — общие для обработки и replay."""
+    clips_dir = os.path.join(out_dir, 'clips')
+    ensure_dir(clips_dir)
+    detector = ViolationDetector(merge_window_sec=merge_sec)
+    writer = ClipWriter(workers=workers, webhook=webhook, tracer=tracer)
+    # отчёты пишутся по ходу обработки (детекции — группами строк, события — снимками)
+    sink = ReportSink(out_dir, formats=report_formats or REPORT_FORMATS, row_group=REPORT_ROW_GROUP,
+                      flush_sec=REPORT_FLUSH_SEC)
+    stage = EventStage(detector, writer, frames_buffer, fps, clips_dir, conf_thresh, finalize_delay,
+                       save_immediately=save_immediately, sink=sink, violation_classes=violation_classes,
+                       tracer=tracer, on_event=on_event)
+    return stage, writer, sink
+
+
+def replay_video(raw_cache_path, video_path, out_dir, conf_thresh=CONF_THRESH, detect_every_n=None,
+                 merge_sec=MERGE_WINDOW_SEC, finalize_delay=FINALIZE_DELAY, save_immediately=False,
+                 workers=ASYNC_WORKERS, webhook=None, report_formats=REPORT_FORMATS,
+                 violation_classes=VIOLATION_CLASSES):
+    """
+    Пересборка событий, отчётов и клипов из кэша сырых детекций (process_video(..., raw_cache_path=...))
+    без модели и без декодирования видео: кадры идут со скоростью логики событий, клипы читаются
+    из исходного файла через seek. detect_every_n должен быть кратен шагу, с которым записан кэш.
+    """
+    raw = RawDetections(raw_cache_path)
+    every = detect_every_n or raw.every
+    if every % raw.every:
+        raise ValueError(f"detect_every_n={every} is not a multiple of the cached step {raw.every}")
+    if conf_thresh < raw.min_conf:
+        print(f"[REPLAY] conf {conf_thresh} is below the cached minimum {raw.min_conf}; using cached detections only")
+    ensure_dir(out_dir)
+    fps, total = raw.fps, raw.total
+    frames_buffer = SourceSeekFrames(video_path, total=total)
+    # задачи клипов в режиме seek — только индексы кадров, в бюджет байт очереди писателя они не входят
+    stage, writer, sink = _make_stage(out_dir, frames_buffer, fps, conf_thresh, merge_sec, finalize_delay,
+                                      save_immediately, workers, webhook, report_formats, violation_classes)
+    cached = iter(raw)
+    next_idx, next_dets = next(cached, (None, None))
+    try:
+        for idx in range(total):
+            dets = None
+            if idx == next_idx:
+                dets = next_dets
+                next_idx, next_dets = next(cached, (None, None))
+            infer = idx % every == 0
+            frames_buffer.last_idx = idx
+            stage.on_frame(FrameItem(idx=idx, frame=None, current_s=idx / fps, wall_time=now_iso(), infer=infer,
+                                     dets=dets if infer else None))
+    finally:
+        stage.finalize_all()
+        writer.shutdown()
+
+    sink.close(stage.detections, stage.detector.events)
+    print(f'Done (replay of {len(raw)} cached frames)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--video', default=INPUT_VIDEO)
+    parser.add_argument('--out', default=OUTPUT_DIR)
+    parser.add_argument('--conf', type=float, default=CONF_THRESH)
+    parser.add_argument('--every', type=int, default=DETECT_EVERY_N_FRAMES)
+    parser.add_argument('--merge_sec', type=int, default=MERGE_WINDOW_SEC)
+    parser.add_argument('--finalize-delay', type=float, default=FINALIZE_DELAY)
+    parser.add_argument('--save-immediately', action='store_true')
+    parser.add_argument('--workers', type=int, default=ASYNC_WORKERS)
+    parser.add_argument('--webhook', type=str, default=None)
+    parser.add_argument('--batch-size', type=int, default=INFER_BATCH_SIZE)
+    parser.add_argument('--pipelined', action='store_true', help='декодирование/инференс/события в отдельных потоках')
+    parser.add_argument('--compress-buffer', action='store_true', help='хранить буфер кадров для клипов в JPEG')
+    parser.add_argument('--clips-from-source', action='store_true', help='вырезать клипы из исходного файла (seek), без буфера кадров')
+    parser.add_argument('--report-formats', type=str, default=','.join(REPORT_FORMATS), help='parquet,csv')
+    parser.add_argument('--motion-gate', action='store_true', help='пропускать инференс на кадрах без движения')
+    parser.add_argument('--backend', default=INFER_BACKEND, choices=['auto', 'torch', 'onnx', 'openvino'],
+                        help='бэкенд модели (onnx/openvino — CPU без PyTorch)')
+    parser.add_argument('--threads', type=int, default=INFER_THREADS, help='потоки ONNX Runtime (0 — все ядра)')
+    parser.add_argument('--roi', type=str, default=ROI_CONFIG, help='JSON с зонами интереса камеры (rect/polygon)')
+    parser.add_argument('--raw-cache', type=str, default=None, help='сохранить сырые детекции модели в этот файл')
+    parser.add_argument('--replay', type=str, default=None,
+                        help='пересобрать события/отчёты/клипы из кэша сырых детекций, без модели')
+    parser.add_argument('--source', type=str, action='append', default=None,
+                        help='живой источник: rtsp://, http://, pipe/FIFO, индекс камеры или synthetic://WxH@FPS; '
+                             'повторите для нескольких камер (имя=источник) — одна модель на все')
+    parser.add_argument('--duration', type=float, default=None, help='живой поток: остановиться через N секунд')
+    parser.add_argument('--trace', action='store_true', help='таймлайн стадий в <out>/trace.json (Chrome trace)')
+    parser.add_argument('--trace-sample', type=int, default=TRACE_SAMPLE_EVERY,
+                        help='трассировать каждое N-е окно из TRACE_WINDOW_FRAMES кадров')
+    args = parser.parse_args()
+    report_formats = [f for f in args.report_formats.split(',') if f]
+
+    if args.source and len(args.source) > 1:
+        from multistream import parse_sources, process_streams
+        process_streams(
+            parse_sources(args.source),
+            out_dir=args.out,
+            model_path=args.model,
+            batch_size=args.batch_size if args.batch_size > 1 else MULTI_STREAM_BATCH,
+            conf_thresh=args.conf,
+            detect_every_n=args.every,
+            merge_sec=args.merge_sec,
+            finalize_delay=args.finalize_delay,
+            save_immediately=args.save_immediately,
+            workers=args.workers,
+            webhook=args.webhook,
+            report_formats=report_formats,
+            event_index_path=EVENT_INDEX_PATH,
+            duration_s=args.duration,
+            motion_gate=args.motion_gate,
+            roi=args.roi,
+            model=load_model(args.model, args.backend, args.threads)
+        )
+        raise SystemExit(0)
+
+    if args.source:
+        process_stream(
+            model_path=args.model,
+            source=args.source[0],
+            out_dir=args.out,
+            conf_thresh=args.conf,
+            detect_every_n=args.every,
+            merge_sec=args.merge_sec,
+            finalize_delay=args.finalize_delay,
+            save_immediately=args.save_immediately,
+            workers=args.workers,
+            webhook=args.webhook,
+            batch_size=args.batch_size,
+            report_formats=report_formats,
+            event_index_path=EVENT_INDEX_PATH,
+            duration_s=args.duration,
+            motion_gate=args.motion_gate,
+            roi=args.roi,
+            model=load_model(args.model, args.backend, args.threads)
+        )
+        raise SystemExit(0)
+
+    if args.replay:
+        replay_video(
+            raw_cache_path=args.replay,
+            video_path=args.video,
+            out_dir=args.out,
+            conf_thresh=args.conf,
+            detect_every_n=args.every,
+            merge_sec=args.merge_sec,
+            finalize_delay=args.finalize_delay,
+            save_immediately=args.save_immediately,
+            workers=args.workers,
+            webhook=args.webhook,
+            report_formats=report_formats
+        )
+        raise SystemExit(0)
+
+    process_video(
+        model_path=args.model,
+        video_path=args.video,
+        out_dir=args.out,
+        conf_thresh=args.conf,
+        detect_every_n=args.every,
+        merge_sec=args.merge_sec,
+        finalize_delay=args.finalize_delay,
+        save_immediately=args.save_immediately,
+        workers=args.workers,
+        webhook=args.webhook,
+        batch_size=args.batch_size,
+        pipelined=args.pipelined,
+        compress_buffer=args.compress_buffer,
+        clips_from_source=args.clips_from_source,
+        report_formats=report_formats,
+        raw_cache_path=args.raw_cache,
+        motion_gate=args.motion_gate,
+        roi=args.roi,
+        trace=args.trace,
+        trace_sample_every=args.trace_sample,
+        model=load_model(args.model, args.backend, args.threads)
     )
\ No newline at end of file
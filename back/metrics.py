@@ -0,0 +1,348 @@
+# metrics.py
+# Метрики в текстовом формате Prometheus (без внешних зависимостей): счётчики, gauge и гистограммы
+# в памяти процесса. Обработка идёт в процессах-воркерах планировщика, поэтому каждый воркер раз в
+# METRICS_EXPORT_SEC (и в конце задачи) сбрасывает снимок своих метрик в METRICS_DIR/proc-<pid>-<старт>.json,
+# а /metrics в API складывает снимки всех процессов хоста. Счётчики завершившихся процессов сворачиваются
+# в METRICS_DIR/archive.json (сумма не уменьшается, файлы не копятся). Обновление метрики — словарь и
+# блокировка, без ввода-вывода, поэтому их можно держать включёнными на горячем пути.
+
+import atexit
+import bisect
+import contextlib
+import glob
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils import atomic_write
+
+try:
+    import fcntl
+except ImportError:  # Windows: сворачивание снимков без межпроцессной блокировки
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+ARCHIVE_FILE = "archive.json"
+_SNAPSHOT_RE = re.compile(r'proc-(\d+)-(\d+)\.json$')
+
+
+class _Child:
+    """Метрика с конкретными значениями меток (кэшируется в labels())."""
+    __slots__ = ('_metric', '_key')
+
+    def __init__(self, metric: "_Metric", key: Tuple[str, ...]):
+        self._metric = metric
+        self._key = key
+
+    def inc(self, amount: float = 1.0):
+        self._metric._add(self._key, amount)
+
+    def dec(self, amount: float = 1.0):
+        self._metric._add(self._key, -amount)
+
+    def set(self, value: float):
+        self._metric._set(self._key, value)
+
+    def observe(self, value: float):
+        self._metric._observe(self._key, value)
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._children: Dict[Tuple[str, ...], _Child] = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values) -> _Child:
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = _Child(self, tuple(str(v) for v in values))
+        return child
+
+    def inc(self, amount: float = 1.0):
+        self._add((), amount)
+
+    def _add(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = [[list(k), v] for k, v in self._values.items()]
+        return {"type": self.type, "help": self.documentation, "labels": list(self.labelnames), "values": values}
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def dec(self, amount: float = 1.0):
+        self._add((), -amount)
+
+    def set(self, value: float):
+        self._set((), value)
+
+    def _set(self, key, value):
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram(_Metric):
+    """Значение — [счётчики по корзинам (последняя — +Inf), сумма]; корзины в снимке не накопительные."""
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float):
+        self._observe((), value)
+
+    def _observe(self, key, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            v[0][i] += 1
+            v[1] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = [[list(k), [list(v[0]), v[1]]] for k, v in self._values.items()]
+        return {"type": self.type, "help": self.documentation, "labels": list(self.labelnames),
+                "buckets": list(self.buckets), "values": values}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._export_dir: Optional[str] = None
+        self._export_lock = threading.Lock()
+        # время старта в имени снимка: pid переиспользуется, а снимок нового процесса не должен затереть
+        # снимок завершившегося
+        self._started_ms = int(time.time() * 1000)
+
+    def register(self, metric: _Metric):
+        if any(m.name == metric.name for m in self._metrics):
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics.append(metric)
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {m.name: m.snapshot() for m in self._metrics}
+
+    # ---- снимки процессов-воркеров ----
+
+    def start_export(self, directory: str, interval_s: float):
+        """Сбрасывать снимок метрик этого процесса в directory/proc-<pid>-<старт>.json каждые interval_s
+        и при выходе."""
+        if self._export_dir is not None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        self._export_dir = directory
+
+        def loop():
+            while True:
+                time.sleep(interval_s)
+                self.export_now()
+
+        threading.Thread(target=loop, name='metrics-export', daemon=True).start()
+        atexit.register(self.export_now)
+
+    def export_now(self):
+        """Сбросить снимок сейчас (конец задачи); без start_export — ничего не делает."""
+        if self._export_dir is None:
+            return
+        with self._export_lock:
+            path = os.path.join(self._export_dir, self._snapshot_name())
+            data = {"pid": os.getpid(), "started_ms": self._started_ms, "metrics": self.snapshot()}
+            try:
+                atomic_write(path, lambda tmp: _dump_json(tmp, data))
+            except OSError as e:
+                print(f"[METRICS] export failed: {e}")
+
+    def _snapshot_name(self) -> str:
+        return f"proc-{os.getpid()}-{self._started_ms}.json"
+
+    def collect(self, directory: Optional[str] = None) -> List[Dict[str, dict]]:
+        """Снимок этого процесса и снимки из directory (кроме своего). Счётчики завершившихся процессов
+        остаются в сумме (иначе счётчик «уменьшится»), их gauge — нет: очередь мёртвого процесса пуста.
+        Снимки завершившихся процессов (pid не жив или у pid есть снимок новее) сворачиваются в archive.json."""
+        snapshots = [self.snapshot()]
+        if not directory or not os.path.isdir(directory):
+            return snapshots
+        with _dir_lock(directory):
+            found = []
+            for path in glob.glob(os.path.join(directory, 'proc-*.json')):
+                m = _SNAPSHOT_RE.search(os.path.basename(path))
+                if m:
+                    found.append((int(m.group(1)), int(m.group(2)), path))
+            newest = {}
+            for pid, started, _ in found:
+                newest[pid] = max(started, newest.get(pid, 0))
+            dead, dead_paths = [], []
+            for pid, started, path in sorted(found):
+                if os.path.basename(path) == self._snapshot_name():
+                    continue
+                try:
+                    with open(path) as f:
+                        metrics = json.load(f).get("metrics", {})
+                except (OSError, ValueError):
+                    continue
+                if started == newest[pid] and _alive(pid):
+                    snapshots.append(metrics)
+                else:
+                    dead.append({name: m for name, m in metrics.items() if m["type"] != 'gauge'})
+                    dead_paths.append(path)
+            archive_path = os.path.join(directory, ARCHIVE_FILE)
+            try:
+                with open(archive_path) as f:
+                    archive = json.load(f)
+            except (OSError, ValueError):
+                archive = {}
+            if dead:
+                archive = _as_snapshot(merge([archive] + dead))
+                try:
+                    atomic_write(archive_path, lambda tmp: _dump_json(tmp, archive))
+                    for path in dead_paths:
+                        os.remove(path)
+                except OSError as e:
+                    print(f"[METRICS] cannot fold snapshots of finished processes: {e}")
+                    snapshots.extend(dead)
+                    archive = {}
+            snapshots.append(archive)
+        return snapshots
+
+    def render(self, directory: Optional[str] = None) -> str:
+        """Текст для /metrics: метрики всех процессов, одинаковые метки складываются."""
+        return render(self.collect(directory))
+
+
+@contextlib.contextmanager
+def _dir_lock(directory: str):
+    """Межпроцессная блокировка directory: API-процессы сворачивают снимки по очереди."""
+    with open(os.path.join(directory, '.lock'), 'w') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _alive(pid) -> bool:
+    try:
+        os.kill(int(pid), 0)
+    except PermissionError:
+        return True
+    except (OSError, TypeError, ValueError):
+        return False
+    return True
+
+
+def _dump_json(path: str, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def _fmt(v: float) -> str:
+    v = float(v)
+    if v == float('inf'):
+        return '+Inf'
+    return str(int(v)) if v.is_integer() and abs(v) < 1e15 else repr(v)
+
+
+def _escape(v: str) -> str:
+    return v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def merge(snapshots: List[Dict[str, dict]]) -> Dict[str, dict]:
+    """Сумма снимков по метрикам и меткам: values — словарь {метки: значение}."""
+    merged: Dict[str, dict] = {}
+    for snap in snapshots:
+        for name, m in snap.items():
+            into = merged.setdefault(name, {**m, "values": {}})
+            for key, value in m["values"]:
+                key = tuple(key)
+                old = into["values"].get(key)
+                if m["type"] == 'histogram':
+                    if old is None or len(old[0]) != len(value[0]):
+                        old = into["values"][key] = [[0] * len(value[0]), 0.0]
+                    old[0] = [a + b for a, b in zip(old[0], value[0])]
+                    old[1] += value[1]
+                else:
+                    into["values"][key] = (old or 0.0) + value
+    return merged
+
+
+def _as_snapshot(merged: Dict[str, dict]) -> Dict[str, dict]:
+    return {name: {**m, "values": [[list(k), v] for k, v in m["values"].items()]} for name, m in merged.items()}
+
+
+def render(snapshots: List[Dict[str, dict]]) -> str:
+    merged = merge(snapshots)
+    lines = []
+    for name, m in merged.items():
+        lines.append(f"# HELP {name} {m['help']}")
+        lines.append(f"# TYPE {name} {m['type']}")
+        for key, value in sorted(m["values"].items()):
+            if m["type"] != 'histogram':
+                lines.append(f"{name}{_labels(m['labels'], key)} {_fmt(value)}")
+                continue
+            counts, total = value
+            acc = 0
+            for le, n in zip(list(m["buckets"]) + [float('inf')], counts):
+                acc += n
+                lines.append(f"{name}_bucket{_labels(m['labels'], key, ('le', _fmt(le)))} {acc}")
+            lines.append(f"{name}_sum{_labels(m['labels'], key)} {_fmt(total)}")
+            lines.append(f"{name}_count{_labels(m['labels'], key)} {acc}")
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# ---- метрики обработки ----
+
+FRAMES_DECODED = Counter('leanvision_frames_decoded_total', 'Decoded frames', ('source',))
+INFERENCE_SECONDS = Histogram('leanvision_inference_seconds', 'Duration of one model call (frame or batch)',
+                              ('backend',), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+INFERENCE_FRAMES = Counter('leanvision_inference_frames_total', 'Frames passed to the model', ('backend',))
+DETECTIONS = Counter('leanvision_detections_total', 'Detections at or above the task conf threshold',
+                     ('class_name',))
+EVENTS = Counter('leanvision_events_total',
+                 'Violation events: opened - new event, merged - detection merged into an event, '
+                 'finalized - event handed to the clip writer', ('stage',))
+WRITER_QUEUE = Gauge('leanvision_writer_queue_depth', 'Clip tasks waiting in ClipWriter queues')
+WRITER_QUEUE_BYTES = Gauge('leanvision_writer_queue_bytes',
+                           'JPEG frames of queued clip tasks: memory - held in RAM, spool - spilled to disk',
+                           ('where',))
+CLIPS = Counter('leanvision_clips_total',
+                'Clip tasks: enqueued, spilled (frames moved to the disk spool), reloaded (read back from the spool), '
+                'dropped (memory budget and spool full), written, failed', ('result',))
+CLIP_ENCODE_SECONDS = Histogram('leanvision_clip_encode_seconds', 'JPEG encoding of clip frames at enqueue')
+CLIP_WRITE_SECONDS = Histogram('leanvision_clip_write_seconds', 'Writing one clip in a writer worker',
+                               buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+WEBHOOK = Counter('leanvision_webhook_total', 'Webhook calls: ok, non_2xx, error', ('result',))
+WEBHOOK_SECONDS = Histogram('leanvision_webhook_seconds', 'Webhook request duration')
+TASKS = Gauge('leanvision_tasks', 'Tasks in the task store by status', ('status',))
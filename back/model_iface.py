@@ -1,37 +1,342 @@
-# model_iface.py
-# Интерфейс для загрузки и запуска вашей YOLO модели (ultralytics API).
-
-from ultralytics import YOLO
-from typing import List, Tuple
-import numpy as np
-
-from config import MODEL_CLASSES
-
-
-class YoloModel:
-    """Класс-обёртка вокруг ultralytics YOLO для удобства вызова."""
-    def __init__(self, path: str):
-        # загрузка модели
-        self.model = YOLO(path)
-        # если имена классов не заданы в модели — ставим по конфигу
-        if not getattr(self.model, 'names', None):
-            self.model.names = {i: name for i, name in enumerate(MODEL_CLASSES)}
-
-    def predict_frame(self, frame: np.ndarray, conf: float=0.5) -> List[Tuple[str, float, Tuple[int,int,int,int]]]:
-        """Запускает инференс по одному кадру и возвращает список (class_name, conf, xyxy).
-        Возвращаемые боксы уже в координатах кадра (целые числа).
-        """
-        results = self.model.predict(source=frame, imgsz=640, conf=conf, verbose=False)
-        res = results[0] if isinstance(results, list) else results
-        boxes = getattr(res, 'boxes', None)
-        if boxes is None:
-            return []
-        xyxy = boxes.xyxy.cpu().numpy() if hasattr(boxes.xyxy, 'cpu') else np.array(boxes.xyxy)
-        confs = boxes.conf.cpu().numpy() if hasattr(boxes.conf, 'cpu') else np.array(boxes.conf)
-        cls_idxs = boxes.cls.cpu().numpy().astype(int) if hasattr(boxes.cls, 'cpu') else np.array(boxes.cls).astype(int)
-        out = []
-        for box, c, cls in zip(xyxy, confs, cls_idxs):
-            x1, y1, x2, y2 = map(int, box.tolist())
-            name = self.model.names.get(int(cls), str(int(cls)))
-            out.append((name, float(c), (x1, y1, x2, y2)))
-        return out
\ No newline at end of file
+# model_iface.py
+# Интерфейс для загрузки и запуска вашей YOLO модели: бэкенды с одинаковым выходом predict_frame / predict_batch.
+#   torch    — ultralytics (PyTorch), как было;
+#   onnx     — ONNX Runtime на CPU: свой letterbox, декодирование выхода и NMS, контроль числа потоков;
+#   openvino — тот же ONNX через OpenVINO Execution Provider (пакет onnxruntime-openvino).
+# Экспорт .pt -> .onnx (и INT8-квантизация) и проверка совпадения с PyTorch-моделью:
+#   python model_iface.py export --model models/best.pt [--int8]
+#   python model_iface.py parity --model models/best.pt --onnx models/best.onnx --video input_shift.mp4
+
+import argparse
+import ast
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from config import MODEL_CLASSES, INFER_BACKEND, INFER_IMGSZ, INFER_THREADS, NMS_IOU, MAX_DET
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировки, от порчи файла всё равно защищает запись во временный + rename
+    fcntl = None
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+Det = Tuple[str, float, Tuple[int, int, int, int]]
+LETTERBOX_FILL = 114
+
+
+class YoloModel:
+    """Класс-обёртка вокруг ultralytics YOLO для удобства вызова."""
+    def __init__(self, path: str):
+        from ultralytics import YOLO
+        # загрузка модели
+        self.model = YOLO(path)
+        # если имена классов не заданы в модели — ставим по конфигу
+        if not getattr(self.model, 'names', None):
+            self.model.names = {i: name for i, name in enumerate(MODEL_CLASSES)}
+
+    def predict_frame(self, frame: np.ndarray, conf: float=0.5) -> List[Tuple[str, float, Tuple[int,int,int,int]]]:
+        """Запускает инференс по одному кадру и возвращает список (class_name, conf, xyxy).
+        Возвращаемые боксы уже в координатах кадра (целые числа).
+        """
+        t0 = time.perf_counter()
+        results = self.model.predict(source=frame, imgsz=INFER_IMGSZ, conf=conf, verbose=False)
+        _observe('torch', 1, t0)
+        res = results[0] if isinstance(results, list) else results
+        return self._parse_result(res)
+
+    def predict_batch(self, frames: Sequence[np.ndarray], conf: float=0.5) -> List[List[Tuple[str, float, Tuple[int,int,int,int]]]]:
+        """Инференс по списку кадров одним вызовом модели.
+        Возвращает список результатов в том же порядке, что и кадры (формат как у predict_frame).
+        """
+        if not frames:
+            return []
+        t0 = time.perf_counter()
+        results = self.model.predict(source=list(frames), imgsz=INFER_IMGSZ, conf=conf, verbose=False)
+        _observe('torch', len(frames), t0)
+        return [self._parse_result(res) for res in results]
+
+    def _parse_result(self, res) -> List[Tuple[str, float, Tuple[int,int,int,int]]]:
+        boxes = getattr(res, 'boxes', None)
+        if boxes is None:
+            return []
+        xyxy = boxes.xyxy.cpu().numpy() if hasattr(boxes.xyxy, 'cpu') else np.array(boxes.xyxy)
+        confs = boxes.conf.cpu().numpy() if hasattr(boxes.conf, 'cpu') else np.array(boxes.conf)
+        cls_idxs = boxes.cls.cpu().numpy().astype(int) if hasattr(boxes.cls, 'cpu') else np.array(boxes.cls).astype(int)
+        out = []
+        for box, c, cls in zip(xyxy, confs, cls_idxs):
+            x1, y1, x2, y2 = map(int, box.tolist())
+            name = self.model.names.get(int(cls), str(int(cls)))
+            out.append((name, float(c), (x1, y1, x2, y2)))
+        return out
+
+
+def _observe(backend: str, frames: int, t0: float):
+    """Метрики вызова модели: длительность (с) и число кадров."""
+    metrics.INFERENCE_SECONDS.labels(backend).observe(time.perf_counter() - t0)
+    metrics.INFERENCE_FRAMES.labels(backend).inc(frames)
+
+
+def letterbox(frame: np.ndarray, size: int = INFER_IMGSZ) -> Tuple[np.ndarray, float, Tuple[int, int]]:
+    """Масштаб с сохранением пропорций в квадрат size x size с серыми полями (как у ultralytics).
+    Возвращает (изображение, масштаб, (отступ x, отступ y))."""
+    h, w = frame.shape[:2]
+    r = min(size / h, size / w)
+    nw, nh = int(round(w * r)), int(round(h * r))
+    # поля делятся пополам с тем же округлением, что у ultralytics
+    px, py = int(round((size - nw) / 2 - 0.1)), int(round((size - nh) / 2 - 0.1))
+    out = np.full((size, size, 3), LETTERBOX_FILL, dtype=np.uint8)
+    resized = frame if (nw, nh) == (w, h) else cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    out[py:py + nh, px:px + nw] = resized
+    return out, r, (px, py)
+
+
+def decode_yolo(pred: np.ndarray, conf: float, iou: float = NMS_IOU,
+                max_det: int = MAX_DET) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Выход YOLOv8/11 одного кадра (4 + nc, anchors): cx, cy, w, h и вероятности классов.
+    Порог conf, NMS по классам. Возвращает (xyxy в пикселях входа модели, conf, class_id).
+    """
+    pred = pred.T
+    scores_all = pred[:, 4:]
+    cls = scores_all.argmax(axis=1)
+    scores = scores_all[np.arange(len(cls)), cls]
+    keep = scores >= conf
+    boxes, scores, cls = pred[keep, :4], scores[keep], cls[keep]
+    if not len(scores):
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64)
+    xywh = boxes.copy()
+    xywh[:, 0] -= boxes[:, 2] / 2
+    xywh[:, 1] -= boxes[:, 3] / 2
+    idx = cv2.dnn.NMSBoxesBatched(xywh.tolist(), scores.tolist(), cls.tolist(), conf, iou, top_k=max_det)
+    idx = np.asarray(idx, dtype=np.int64).reshape(-1)[:max_det]
+    xyxy = np.concatenate([xywh[idx, :2], xywh[idx, :2] + xywh[idx, 2:4]], axis=1)
+    return xyxy, scores[idx], cls[idx]
+
+
+def _class_names(session) -> dict:
+    # ultralytics кладёт имена классов в метаданные ONNX строкой вида "{0: 'floor', ...}"
+    try:
+        meta = session.get_modelmeta().custom_metadata_map
+        names = ast.literal_eval(meta['names'])
+        return {int(k): v for k, v in names.items()}
+    except Exception:
+        return {i: name for i, name in enumerate(MODEL_CLASSES)}
+
+
+class OnnxModel:
+    """
+    YOLO (экспорт ultralytics в ONNX) на ONNX Runtime без PyTorch. Выход как у YoloModel.predict_frame.
+    threads — потоки внутри оператора (0 — по числу ядер); несколько процессов-воркеров на одном хосте
+    лучше ограничивать, чтобы они не делили ядра. provider='openvino' — OpenVINO Execution Provider.
+    Модель с фиксированным батчем 1 вызывается по кадру, с динамическим — одним вызовом на батч.
+    """
+
+    def __init__(self, path: str, threads: int = INFER_THREADS, provider: str = 'cpu', imgsz: Optional[int] = None,
+                 session=None):
+        if session is None:
+            import onnxruntime as ort
+            opts = ort.SessionOptions()
+            opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            opts.intra_op_num_threads = int(threads or 0)
+            opts.inter_op_num_threads = 1
+            providers = ['CPUExecutionProvider']
+            if provider == 'openvino':
+                providers.insert(0, 'OpenVINOExecutionProvider')
+            session = ort.InferenceSession(path, sess_options=opts, providers=providers)
+        self.session = session
+        inp = session.get_inputs()[0]
+        self.input_name = inp.name
+        shape = inp.shape
+        self.imgsz = imgsz or (shape[2] if isinstance(shape[2], int) else INFER_IMGSZ)
+        self.dynamic_batch = not isinstance(shape[0], int)
+        self.names = _class_names(session)
+        self.backend = 'onnx' if provider == 'cpu' else provider
+
+    def _preprocess(self, frames: Sequence[np.ndarray]):
+        blobs, metas = [], []
+        for f in frames:
+            img, r, pad = letterbox(f, self.imgsz)
+            blobs.append(img[:, :, ::-1].transpose(2, 0, 1))  # BGR HWC -> RGB CHW
+            metas.append((r, pad, f.shape[:2]))
+        x = np.ascontiguousarray(np.stack(blobs), dtype=np.float32)
+        x *= 1.0 / 255.0
+        return x, metas
+
+    def _postprocess(self, pred: np.ndarray, meta, conf: float) -> List[Det]:
+        r, (px, py), (h, w) = meta
+        xyxy, scores, cls = decode_yolo(pred, conf)
+        xyxy = (xyxy - (px, py, px, py)) / r
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, w)
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, h)
+        return [(self.names.get(int(c), str(int(c))), float(s), tuple(int(v) for v in b))
+                for b, s, c in zip(xyxy, scores, cls)]
+
+    def predict_frame(self, frame: np.ndarray, conf: float = 0.5) -> List[Det]:
+        return self.predict_batch([frame], conf=conf)[0]
+
+    def predict_batch(self, frames: Sequence[np.ndarray], conf: float = 0.5) -> List[List[Det]]:
+        if not len(frames):
+            return []
+        t0 = time.perf_counter()
+        x, metas = self._preprocess(frames)
+        if self.dynamic_batch:
+            preds = self.session.run(None, {self.input_name: x})[0]
+        else:
+            preds = np.concatenate([self.session.run(None, {self.input_name: x[i:i + 1]})[0]
+                                    for i in range(len(x))])
+        out = [self._postprocess(p, m, conf) for p, m in zip(preds, metas)]
+        _observe(self.backend, len(frames), t0)
+        return out
+
+
+def export_onnx(pt_path: str, imgsz: int = INFER_IMGSZ, int8: bool = False) -> str:
+    """Экспорт ultralytics .pt -> .onnx (динамический батч); int8 — динамическая INT8-квантизация весов."""
+    from ultralytics import YOLO
+    path = YOLO(pt_path).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        q_path = os.path.splitext(path)[0] + '.int8.onnx'
+        quantize_dynamic(path, q_path, weight_type=QuantType.QUInt8)
+        path = q_path
+    return path
+
+
+def resolve_backend(path: str, backend: Optional[str] = INFER_BACKEND) -> str:
+    """Фактический бэкенд: auto (или None) — по расширению файла (.onnx -> onnx, иначе torch)."""
+    backend = backend or 'auto'
+    if backend == 'auto':
+        return 'onnx' if path.endswith('.onnx') else 'torch'
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown inference backend: {backend}")
+    if backend == 'torch' and path.endswith('.onnx'):
+        raise ValueError("torch backend needs a .pt model")
+    return backend
+
+
+def ensure_onnx(pt_path: str) -> str:
+    """
+    Соседний .onnx для .pt; экспортируется один раз. Воркеры планировщика грузят модель одновременно:
+    экспорт идёт под файловой блокировкой, в отдельной временной директории, и готовый файл
+    появляется атомарно (os.replace) — никто не прочитает недописанный .onnx.
+    """
+    onnx_path = os.path.splitext(pt_path)[0] + '.onnx'
+    if os.path.exists(onnx_path):
+        return onnx_path
+    with open(onnx_path + '.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(onnx_path):  # экспортировал другой процесс, пока мы ждали
+            return onnx_path
+        print(f"[MODEL] exporting {pt_path} -> {onnx_path}")
+        tmp_dir = tempfile.mkdtemp(prefix='.export_', dir=os.path.dirname(os.path.abspath(pt_path)))
+        try:
+            tmp_pt = os.path.join(tmp_dir, os.path.basename(pt_path))
+            shutil.copyfile(pt_path, tmp_pt)
+            os.replace(export_onnx(tmp_pt), onnx_path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return onnx_path
+
+
+def load_model(path: str, backend: str = INFER_BACKEND, threads: int = INFER_THREADS):
+    """
+    Модель выбранного бэкенда (resolve_backend). onnx/openvino с .pt — берётся соседний .onnx
+    (ensure_onnx: экспортируется один раз).
+    """
+    backend = resolve_backend(path, backend)
+    if backend == 'torch':
+        return YoloModel(path)
+    if not path.endswith('.onnx'):
+        path = ensure_onnx(path)
+    return OnnxModel(path, threads=threads, provider='cpu' if backend == 'onnx' else 'openvino')
+
+
+def _match(ref: List[Det], cand: List[Det], iou_thresh: float) -> List[Tuple[Det, Det, float]]:
+    from utils import iou
+    pairs, used = [], set()
+    for r in sorted(ref, key=lambda d: -d[1]):
+        best, best_iou = None, iou_thresh
+        for j, c in enumerate(cand):
+            if j in used or c[0] != r[0]:
+                continue
+            v = iou(r[2], c[2])
+            if v >= best_iou:
+                best, best_iou = j, v
+        if best is not None:
+            used.add(best)
+            pairs.append((r, cand[best], best_iou))
+    return pairs
+
+
+def parity_check(ref_model, cand_model, frames: Sequence[np.ndarray], conf: float = 0.25,
+                 iou_thresh: float = 0.5) -> dict:
+    """Сравнение детекций двух бэкендов на одних кадрах: доля совпавших боксов (тот же класс, IoU >= iou_thresh)
+    от эталона (recall) и от кандидата (precision), средний IoU и разница conf совпавших."""
+    n_ref = n_cand = 0
+    ious, dconf = [], []
+    for f in frames:
+        ref, cand = ref_model.predict_frame(f, conf=conf), cand_model.predict_frame(f, conf=conf)
+        n_ref += len(ref)
+        n_cand += len(cand)
+        for r, c, v in _match(ref, cand, iou_thresh):
+            ious.append(v)
+            dconf.append(abs(r[1] - c[1]))
+    matched = len(ious)
+    return {"frames": len(frames), "ref": n_ref, "cand": n_cand, "matched": matched,
+            "recall": matched / n_ref if n_ref else 1.0, "precision": matched / n_cand if n_cand else 1.0,
+            "mean_iou": float(np.mean(ious)) if ious else 1.0, "max_conf_diff": float(max(dconf, default=0.0))}
+
+
+def _sample_frames(video_path: str, n: int) -> List[np.ndarray]:
+    cap = cv2.VideoCapture(video_path)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    step = max(1, total // n) if total else 1
+    frames, idx = [], 0
+    while len(frames) < n:
+        ret = cap.grab()
+        if not ret:
+            break
+        if idx % step == 0:
+            ok, f = cap.retrieve()
+            if ok:
+                frames.append(f)
+        idx += 1
+    cap.release()
+    return frames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бэкенды модели: экспорт в ONNX и проверка совпадения с PyTorch')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    ex = sub.add_parser('export', help='экспорт .pt -> .onnx')
+    ex.add_argument('--model', default='models/best.pt')
+    ex.add_argument('--imgsz', type=int, default=INFER_IMGSZ)
+    ex.add_argument('--int8', action='store_true', help='дополнительно INT8-квантизация весов')
+    pc = sub.add_parser('parity', help='сравнить детекции ONNX/OpenVINO с PyTorch на кадрах видео')
+    pc.add_argument('--model', default='models/best.pt')
+    pc.add_argument('--onnx', required=True)
+    pc.add_argument('--backend', default='onnx', choices=['onnx', 'openvino'])
+    pc.add_argument('--video', required=True)
+    pc.add_argument('--frames', type=int, default=200)
+    pc.add_argument('--conf', type=float, default=0.25)
+    pc.add_argument('--min-recall', type=float, default=0.97)
+    args = parser.parse_args()
+
+    if args.cmd == 'export':
+        print(export_onnx(args.model, imgsz=args.imgsz, int8=args.int8))
+    else:
+        report = parity_check(YoloModel(args.model), load_model(args.onnx, backend=args.backend),
+                              _sample_frames(args.video, args.frames), conf=args.conf)
+        print(report)
+        ok = report["recall"] >= args.min_recall and report["precision"] >= args.min_recall
+        print("[PARITY] OK" if ok else "[PARITY] FAILED")
+        sys.exit(0 if ok else 1)
\ No newline at end of file
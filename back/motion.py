@@ -0,0 +1,71 @@
+# motion.py
+# Гейт движения перед инференсом: на статичных кадрах (пустая кухня) YOLO не запускается.
+# Движение ищется разностью кадров на уменьшенной серой копии — это доли миллисекунды против
+# десятков миллисекунд на инференс.
+
+import cv2
+import numpy as np
+
+from config import MOTION_GATE_WIDTH, MOTION_PIXEL_THRESH, MOTION_MIN_AREA, MOTION_HOLD_SEC, MOTION_IDLE_SEC
+
+
+class MotionGate:
+    """
+    Решает, нужен ли инференс на кадре, который по шагу detect_every_n должен идти в модель.
+    - движение — доля пикселей, изменившихся больше pixel_thresh с прошлого проверенного кадра
+      (уменьшенные серые копии), не меньше min_area;
+    - после движения или найденных детекций (note_detections) ещё hold_sec инференс идёт с полной частотой:
+      человек может замереть у стола, а события не должны рваться;
+    - без движения раз в idle_sec всё равно делается контрольный инференс.
+    checked / skipped — сколько кадров прошло через гейт и сколько из них обошлись без модели.
+    """
+
+    def __init__(self, width: int = MOTION_GATE_WIDTH, pixel_thresh: float = MOTION_PIXEL_THRESH,
+                 min_area: float = MOTION_MIN_AREA, hold_sec: float = MOTION_HOLD_SEC,
+                 idle_sec: float = MOTION_IDLE_SEC):
+        self.width = width
+        self.pixel_thresh = pixel_thresh
+        self.min_area = min_area
+        self.hold_sec = hold_sec
+        self.idle_sec = idle_sec
+        self.checked = 0
+        self.skipped = 0
+        self._prev = None
+        self._active_until = float('-inf')
+        self._last_infer = float('-inf')
+
+    def _small_gray(self, frame: np.ndarray) -> np.ndarray:
+        h, w = frame.shape[:2]
+        width = min(self.width, w)
+        small = cv2.resize(frame, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def motion(self, frame: np.ndarray) -> bool:
+        """Есть ли движение относительно прошлого проверенного кадра."""
+        gray = self._small_gray(frame)
+        prev, self._prev = self._prev, gray
+        if prev is None or prev.shape != gray.shape:
+            # первый кадр сравнить не с чем; инференс на нём всё равно будет (контрольный)
+            return False
+        changed = np.count_nonzero(cv2.absdiff(gray, prev) > self.pixel_thresh)
+        return changed >= self.min_area * gray.size
+
+    def should_infer(self, frame: np.ndarray, current_s: float) -> bool:
+        self.checked += 1
+        moving = self.motion(frame)
+        if moving:
+            self._active_until = current_s + self.hold_sec
+        if moving or current_s <= self._active_until or current_s - self._last_infer >= self.idle_sec:
+            self._last_infer = current_s
+            return True
+        self.skipped += 1
+        return False
+
+    def note_detections(self, current_s: float):
+        """Модель что-то нашла — держим полную частоту инференса (детекции приходят с задержкой батча)."""
+        self._active_until = max(self._active_until, current_s + self.hold_sec)
+
+    def __str__(self):
+        pct = 100.0 * self.skipped / self.checked if self.checked else 0.0
+        return f"motion gate: skipped {self.skipped} of {self.checked} inference frames ({pct:.1f}%)"
@@ -0,0 +1,246 @@
+# multistream.py
+# Несколько камер в одном процессе с одной моделью: у каждого потока свой контекст (LiveCapture, буфер кадров,
+# ViolationDetector, ClipWriter, отчёты — это обычный process_stream в своём потоке), а инференс идёт через
+# общий движок, который собирает кадры разных камер в один батч. 12 камер — одна копия модели в памяти
+# и крупные батчи вместо 12 моделей с вызовами по одному кадру.
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config import (CONF_THRESH, MULTI_STREAM_BATCH, MULTI_STREAM_MAX_WAIT_SEC, STREAM_REPORT_SEC,
+                    MODEL_PATH)
+from utils import atomic_write, ensure_dir
+
+STATS_FILE = "streams.json"
+
+
+class _Request:
+    __slots__ = ('stream', 'frames', 'conf', 'future')
+
+    def __init__(self, stream: str, frames: List[np.ndarray], conf: float):
+        self.stream = stream
+        self.frames = frames
+        self.conf = conf
+        self.future: Future = Future()
+
+
+class SharedInferenceEngine:
+    """
+    Один поток инференса на все потоки. У каждой камеры своя очередь запросов; батч собирается по кругу
+    (round-robin): по одному запросу от каждой камеры с ожидающими кадрами, пока не наберётся batch_size кадров,
+    поэтому быстрая камера не может занять модель целиком. Неполный батч ждёт добора не дольше max_wait_s.
+    Модель вызывается с минимальным conf из запросов батча, ответ каждой камеры фильтруется по её conf.
+    """
+
+    def __init__(self, model, batch_size: int = MULTI_STREAM_BATCH, max_wait_s: float = MULTI_STREAM_MAX_WAIT_SEC):
+        self.model = model
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait_s = max_wait_s
+        self.batches = 0
+        self.frames: Dict[str, int] = {}
+        self._queues: Dict[str, "deque[_Request]"] = {}
+        self._order: List[str] = []
+        self._next = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name='shared-inference', daemon=True)
+        self._thread.start()
+
+    def client(self, stream: str) -> "EngineClient":
+        with self._cond:
+            if stream not in self._queues:
+                self._queues[stream] = deque()
+                self._order.append(stream)
+                self.frames[stream] = 0
+        return EngineClient(self, stream)
+
+    def submit(self, stream: str, frames: Sequence[np.ndarray], conf: float) -> Future:
+        req = _Request(stream, list(frames), conf)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("inference engine is shut down")
+            self._queues[stream].append(req)
+            self._cond.notify()
+        return req.future
+
+    def _pending(self) -> int:
+        return sum(len(r.frames) for q in self._queues.values() for r in q)
+
+    def _take_batch(self) -> List[_Request]:
+        """Round-robin по камерам, начиная со следующей после той, с которой начинали прошлый батч."""
+        batch, n = [], 0
+        order = self._order
+        start = self._next
+        progress = True
+        while n < self.batch_size and progress:
+            progress = False
+            for k in range(len(order)):
+                q = self._queues[order[(start + k) % len(order)]]
+                if q and n < self.batch_size:
+                    req = q.popleft()
+                    batch.append(req)
+                    n += len(req.frames)
+                    progress = True
+        if order:
+            self._next = (start + 1) % len(order)
+        return batch
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._pending():
+                    self._cond.wait()
+                if self._closed and not self._pending():
+                    return
+                # добираем батч, пока есть камеры, от которых ещё может прийти запрос
+                deadline = time.monotonic() + self.max_wait_s
+                while (self._pending() < self.batch_size and not self._closed
+                       and not all(self._queues.values())):
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+                batch = self._take_batch()
+            self._run(batch)
+
+    def _run(self, batch: List[_Request]):
+        frames = [f for req in batch for f in req.frames]
+        try:
+            results = self.model.predict_batch(frames, conf=min(req.conf for req in batch))
+        except BaseException as e:
+            for req in batch:
+                req.future.set_exception(e)
+            return
+        self.batches += 1
+        pos = 0
+        for req in batch:
+            part = results[pos:pos + len(req.frames)]
+            pos += len(req.frames)
+            self.frames[req.stream] += len(req.frames)
+            req.future.set_result([[d for d in dets if d[1] >= req.conf] for dets in part])
+
+    @property
+    def mean_batch(self) -> float:
+        return sum(self.frames.values()) / self.batches if self.batches else 0.0
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=10.0)
+
+
+class EngineClient:
+    """«Модель» одной камеры: predict_batch отправляет кадры в общий движок и ждёт свой ответ."""
+
+    def __init__(self, engine: SharedInferenceEngine, stream: str):
+        self.engine = engine
+        self.stream = stream
+
+    def predict_batch(self, frames: Sequence[np.ndarray], conf: float = 0.5):
+        if not len(frames):
+            return []
+        return self.engine.submit(self.stream, frames, conf).result()
+
+    def predict_frame(self, frame: np.ndarray, conf: float = 0.5):
+        return self.predict_batch([frame], conf=conf)[0]
+
+
+def parse_sources(specs: Sequence[str]) -> Dict[str, str]:
+    """'name=url' или просто 'url' (имя cam<i>)."""
+    sources = {}
+    for i, spec in enumerate(specs):
+        name, sep, url = spec.partition('=')
+        if not sep or '://' in name:
+            name, url = f"cam{i}", spec
+        sources[name] = url
+    return sources
+
+
+def process_streams(sources: Dict[str, object], out_dir: str, model_path: str = MODEL_PATH, model=None,
+                    batch_size: int = MULTI_STREAM_BATCH, max_wait_s: float = MULTI_STREAM_MAX_WAIT_SEC,
+                    conf_thresh: float = CONF_THRESH, report_sec: float = STREAM_REPORT_SEC,
+                    stop_file: Optional[str] = None, **stream_kwargs) -> Dict[str, dict]:
+    """
+    Обрабатывает камеры sources {имя: источник} одновременно; результаты — в out_dir/<имя>.
+    Источник может быть dict {"source": ..., <параметры process_stream камеры>}, например своя roi.
+    Остальные параметры (detect_every_n, merge_sec, roi, motion_gate, duration_s, event_index_path, ...)
+    передаются в process_stream каждой камеры. Статистика по камерам (fps, задержка, потерянные кадры)
+    и общего движка (средний размер батча) пишется в out_dir/streams.json при каждом сбросе отчётов.
+    Возвращает итоговую статистику по камерам.
+    """
+    from main import process_stream
+
+    ensure_dir(out_dir)
+    if model is None:
+        from model_iface import load_model
+        model = load_model(model_path)
+    engine = SharedInferenceEngine(model, batch_size=batch_size, max_wait_s=max_wait_s)
+    stop_file = stop_file or os.path.join(out_dir, "STOP")
+    stats: Dict[str, dict] = {}
+    errors: Dict[str, BaseException] = {}
+    lock = threading.Lock()
+
+    def write_stats():
+        data = {"streams": stats, "engine": {"batches": engine.batches, "mean_batch": round(engine.mean_batch, 2),
+                                             "frames": dict(engine.frames)}}
+
+        def write(tmp):
+            with open(tmp, 'w') as f:
+                json.dump(data, f, indent=1)
+        atomic_write(os.path.join(out_dir, STATS_FILE), write)
+
+    def on_stats(name):
+        def update(st):
+            with lock:
+                stats[name] = {k: round(v, 3) if isinstance(v, float) else v for k, v in st.items()}
+                write_stats()
+        return update
+
+    def run(name, source):
+        kwargs = dict(stream_kwargs, conf_thresh=conf_thresh, report_sec=report_sec, stop_file=stop_file)
+        if isinstance(source, dict):
+            kwargs.update(source)
+            source = kwargs.pop("source")
+        try:
+            process_stream(model_path, source, os.path.join(out_dir, name), model=engine.client(name), batch_size=1,
+                           on_stats=on_stats(name), **kwargs)
+        except BaseException as e:
+            print(f"[MULTI] stream {name} failed: {e}")
+            with lock:
+                errors[name] = e
+                stats.setdefault(name, {})["error"] = str(e)
+                write_stats()
+
+    threads = [threading.Thread(target=run, args=(name, source), name=f"stream-{name}", daemon=True)
+               for name, source in sources.items()]
+    for t in threads:
+        t.start()
+    try:
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(timeout=0.5)
+    except KeyboardInterrupt:
+        print("[MULTI] interrupted, stopping streams")
+        open(stop_file, 'w').close()
+        for t in threads:
+            t.join()
+    finally:
+        engine.shutdown()
+        if os.path.exists(stop_file):
+            os.remove(stop_file)
+
+    with lock:
+        # ошибка камеры остаётся в её статистике и после финального сброса
+        for name, e in errors.items():
+            stats.setdefault(name, {})["error"] = str(e)
+        write_stats()
+    print(f"[MULTI] {len(sources)} streams done, {engine.batches} batches, mean batch {engine.mean_batch:.1f}")
+    return stats
@@ -0,0 +1,401 @@
+# pipeline.py
+# Стадии обработки кадров: батчевый инференс, стадия событий (finalize + регистрация детекций)
+# и конвейерный режим, в котором декодирование и инференс идут в отдельных потоках.
+
+import os
+import time
+import queue
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from config import VIOLATION_CLASSES, CLIP_PRE_SEC, CLIP_POST_SEC, PROGRESS_EVERY_SEC
+from utils import now_iso
+from detector import ViolationDetector, ViolationEvent, Detection, DetectionStore
+from writer import ClipWriter
+from buffers import SourceSeekFrames
+from reports import ReportSink
+import metrics
+
+
+@dataclass
+class FrameItem:
+    """Кадр, прошедший декодирование. dets заполняется после инференса (только для infer=True)."""
+    idx: int
+    frame: Optional[np.ndarray]
+    current_s: float
+    wall_time: str
+    infer: bool = False
+    dets: Optional[List[Tuple[str, float, Tuple[int,int,int,int]]]] = None
+
+    @property
+    def ready(self) -> bool:
+        return not self.infer or self.dets is not None
+
+
+class InferenceBatcher:
+    """
+    Собирает кадры для инференса в батчи и вызывает model.predict_batch.
+    Принимает все кадры подряд (и с инференсом, и без), а отдаёт их строго в порядке кадров:
+    кадр выходит, только когда он и все предыдущие кадры готовы.
+    Неполный батч сбрасывается, если первый кадр в нём ждёт дольше max_latency_s.
+    recorder (RawDetectionRecorder) получает выходы модели по каждому кадру — для кэша сырых детекций.
+    gate (MotionGate) снимает инференс с кадров без движения: такой кадр проходит дальше как infer=False.
+    tracer (FlightRecorder) получает интервал каждого батча из записываемых окон.
+    """
+
+    def __init__(self, model, conf: float, batch_size: int = 1, max_latency_s: float = 0.5, recorder=None,
+                 gate=None, tracer=None):
+        self.model = model
+        self.conf = conf
+        self.recorder = recorder
+        self.gate = gate
+        self.tracer = tracer
+        self.batch_size = max(1, int(batch_size))
+        self.max_latency_s = max_latency_s
+        self._pending: "deque[FrameItem]" = deque()
+        self._batch: List[FrameItem] = []
+        self._batch_started = 0.0
+
+    def push(self, item: FrameItem) -> List[FrameItem]:
+        """Добавляет кадр; возвращает кадры, готовые к стадии событий (может быть пусто)."""
+        self._pending.append(item)
+        if item.infer and self.gate is not None and not self.gate.should_infer(item.frame, item.current_s):
+            item.infer = False
+        if item.infer:
+            if not self._batch:
+                self._batch_started = time.monotonic()
+            self._batch.append(item)
+            if len(self._batch) >= self.batch_size:
+                self._run_batch()
+        return self.poll()
+
+    def poll(self) -> List[FrameItem]:
+        """Сбрасывает батч по таймауту и возвращает готовые кадры."""
+        if self._batch and time.monotonic() - self._batch_started >= self.max_latency_s:
+            self._run_batch()
+        return self._drain()
+
+    def flush(self) -> List[FrameItem]:
+        """Принудительно прогоняет неполный батч (конец видео) и отдаёт всё накопленное."""
+        if self._batch:
+            self._run_batch()
+        return self._drain()
+
+    def _run_batch(self):
+        batch, self._batch = self._batch, []
+        traced = self.tracer is not None and self.tracer.sampled(batch[0].idx)
+        t0 = self.tracer.begin() if traced else 0
+        results = self.model.predict_batch([it.frame for it in batch], conf=self.conf)
+        if traced:
+            self.tracer.span('inference', t0, args={'frame': batch[0].idx, 'frames': len(batch)})
+        for it, dets in zip(batch, results):
+            it.dets = dets
+            if self.recorder is not None:
+                self.recorder.add(it.idx, dets)
+            if dets and self.gate is not None:
+                self.gate.note_detections(it.current_s)
+
+    def _drain(self) -> List[FrameItem]:
+        out = []
+        while self._pending and self._pending[0].ready:
+            out.append(self._pending.popleft())
+        return out
+
+
+def clip_path_for(clips_dir: str, ev: ViolationEvent, suffix: str = "") -> str:
+    """Имя файла клипа события: event_<id>_<классы>_<сек>s[suffix].mp4"""
+    return os.path.join(clips_dir, f"event_{ev.id}_{'_'.join(ev.class_names)}_{int(ev.time_s)}s{suffix}.mp4")
+
+
+class EventStage:
+    """
+    Стадия событий: на каждом кадре финализирует "остывшие" события (debounce),
+    а для кадров с инференсом регистрирует детекции в детекторе. Кадры должны приходить по порядку.
+    Детекции ниже conf_thresh отбрасываются здесь (модель могла работать с меньшим conf для кэша).
+    on_event(dict) получает каждое финализированное событие (ушедшее на запись клипа), см. event_message.
+    Клип вырезается из буфера, только когда стадия дошла до его последнего кадра (событие + CLIP_POST_SEC;
+    декодер к этому моменту его уже прочитал) или до конца видео. Обрезка по текущему last_idx буфера давала
+    бы в конвейерном режиме клипы разной длины: декодер убегает вперёд на неопределённое число кадров.
+    """
+
+    def __init__(self, detector: ViolationDetector, writer: ClipWriter, frames_buffer, fps: float,
+                 clips_dir: str, conf_thresh: float, finalize_delay: float, save_immediately: bool = False,
+                 sink: Optional[ReportSink] = None, violation_classes=VIOLATION_CLASSES, tracer=None,
+                 on_event: Optional[Callable[[dict], None]] = None):
+        self.detector = detector
+        self.writer = writer
+        self.frames_buffer = frames_buffer
+        self.fps = fps
+        self.clips_dir = clips_dir
+        self.conf_thresh = conf_thresh
+        self.finalize_delay = finalize_delay
+        self.save_immediately = save_immediately
+        self.detections = DetectionStore()
+        self.sink = sink
+        self.violation_classes = set(violation_classes)
+        self.tracer = tracer
+        self.on_event = on_event
+        # клипы, ждущие своих кадров: (последний кадр клипа, кадр события, событие, путь, finalized)
+        self._waiting: List[Tuple[int, int, ViolationEvent, str, bool]] = []
+        self._frame_idx = -1  # последний кадр, дошедший до стадии
+
+    def on_frame(self, item: FrameItem):
+        traced = self.tracer is not None and self.tracer.sampled(item.idx)
+        t0 = self.tracer.begin() if traced else 0
+        self._frame_idx = item.idx
+        self.flush_waiting()
+        self.finalize_due(item.current_s)
+        if item.dets:
+            self.register(item)
+        if self.sink is not None:
+            self.sink.update(self.detections, self.detector.events)
+        if traced:
+            self.tracer.span('events', t0, args={'frame': item.idx, 'dets': len(item.dets or ())})
+
+    def finalize_due(self, current_s: float):
+        # финализировать pending события при простое (детектор отдаёт только созревшие)
+        for ev in self.detector.pop_due(current_s, self.finalize_delay):
+            success = self._enqueue(ev, clip_path_for(self.clips_dir, ev))
+            if success:
+                print(f"[ENQUEUE] {ev.id}")
+            else:
+                # повторим на следующем кадре, как и при полном просмотре событий
+                self.detector.reschedule(ev)
+
+    def register(self, item: FrameItem):
+        violations = []
+        for cname, conf, bbox in item.dets:
+            if conf < self.conf_thresh:
+                continue
+            metrics.DETECTIONS.labels(cname).inc()
+            self.detections.add(cname, conf, bbox, item.idx, item.current_s, item.wall_time)
+            if cname in self.violation_classes:
+                violations.append(Detection(class_name=cname, conf=conf, bbox=bbox, frame_idx=item.idx,
+                                            time_s=item.current_s, wall_time=item.wall_time))
+        # все нарушения кадра сопоставляются с событиями одним пакетом
+        on_new = self._enqueue_new if self.save_immediately else None
+        results = self.detector.register_frame(violations, item.current_s, on_new=on_new)
+        if results:
+            opened = sum(1 for is_new, _ in results if is_new)
+            if opened:
+                metrics.EVENTS.labels('opened').inc(opened)
+            if len(results) > opened:
+                metrics.EVENTS.labels('merged').inc(len(results) - opened)
+
+    def _enqueue_new(self, ev: ViolationEvent):
+        # ранний клип (save_immediately): событие ещё открыто — финализированным его считает finalize_due
+        self._enqueue(ev, clip_path_for(self.clips_dir, ev), finalized=False)
+
+    def finalize_all(self):
+        # финализировать оставшиеся (конец видео): новых кадров не будет, ждущие клипы режутся по последнему
+        for ev in self.detector.events:
+            if ev.pending and not ev.saved and not ev.enqueued:
+                self._enqueue(ev, clip_path_for(self.clips_dir, ev, suffix="_final"))
+        self.flush_waiting(eof=True)
+
+    def flush_waiting(self, eof: bool = False):
+        """Отправляет писателю клипы, до последнего кадра которых дошла стадия (eof — все оставшиеся)."""
+        if not self._waiting:
+            return
+        last = self._frame_idx
+        waiting, self._waiting = self._waiting, []
+        for entry in waiting:
+            end_idx, frame_idx, ev, clip_path, finalized = entry
+            if not eof and end_idx > last:
+                self._waiting.append(entry)
+            elif not self._write(ev, frame_idx, clip_path, finalized):
+                if eof:
+                    ev.enqueued = False  # писатель отбросил клип
+                else:
+                    self._waiting.append(entry)  # очередь писателя полна — попробуем на следующем кадре
+
+    def _enqueue(self, ev: ViolationEvent, clip_path: str, finalized: bool = True) -> bool:
+        end_idx = ev.frame_idx + int(round(CLIP_POST_SEC * self.fps))
+        # SourceSeekFrames: воркер писателя сам читает окно из исходного файла — ждать декодера не нужно
+        if isinstance(self.frames_buffer, SourceSeekFrames) or end_idx <= self._frame_idx:
+            return self._write(ev, ev.frame_idx, clip_path, finalized)
+        # конец клипа ещё впереди: событие занято (как в очереди писателя), клип — в ожидании
+        ev.enqueued = True
+        self._waiting.append((end_idx, ev.frame_idx, ev, clip_path, finalized))
+        return True
+
+    def _write(self, ev: ViolationEvent, frame_idx: int, clip_path: str, finalized: bool) -> bool:
+        ok = self.writer.enqueue(self.frames_buffer, frame_idx, self.fps, clip_path, self.detections, ev,
+                                 pre_sec=CLIP_PRE_SEC, post_sec=CLIP_POST_SEC)
+        if ok and finalized:
+            metrics.EVENTS.labels('finalized').inc()
+            if self.on_event is not None:
+                self.on_event(event_message(ev, clip_path))
+        return ok
+
+
+def event_message(ev: ViolationEvent, clip_path: str) -> dict:
+    """Финализированное событие для подписчиков (JSON-совместимо)."""
+    return {'type': 'event', 'id': ev.id, 'class_names': list(ev.class_names),
+            'avg_conf': sum(ev.confs) / len(ev.confs) if ev.confs else None, 'time_s': ev.time_s,
+            'frame_idx': ev.frame_idx, 'wall_time_first': ev.wall_time_first, 'bbox': list(ev.bbox),
+            'clip_path': clip_path}
+
+
+class ProgressReporter:
+    """Прогресс обработки файла для on_progress: кадры done/total, средний fps, ETA, число событий.
+    frame_done() можно звать на каждом кадре — колбэк вызывается не чаще every_s и в finish()."""
+
+    def __init__(self, total: int, callback: Callable[[dict], None], every_s: float = PROGRESS_EVERY_SEC):
+        self.total = total
+        self.callback = callback
+        self.every_s = every_s
+        self.frames = 0
+        self._start = self._last = time.monotonic()
+
+    def frame_done(self, events: int):
+        self.frames += 1
+        now = time.monotonic()
+        if now - self._last >= self.every_s:
+            self._last = now
+            self._emit(now, events, done=False)
+
+    def finish(self, events: int):
+        self._emit(time.monotonic(), events, done=True)
+
+    def _emit(self, now: float, events: int, done: bool):
+        elapsed = now - self._start
+        fps = self.frames / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.frames) / fps if fps > 0 and self.total > self.frames and not done else None
+        self.callback({'type': 'progress', 'frames': self.frames, 'total': self.total, 'fps': round(fps, 2),
+                       'eta_s': round(eta, 1) if eta is not None else None, 'events': events, 'done': done})
+
+
+@dataclass
+class StageStats:
+    """Счётчики стадии конвейера: сколько кадров прошло и сколько времени стадия реально работала."""
+    name: str
+    items: int = 0
+    busy_s: float = 0.0
+
+    @property
+    def fps(self) -> float:
+        return self.items / self.busy_s if self.busy_s > 0 else 0.0
+
+    def __str__(self):
+        return f"{self.name}: {self.items} frames, {self.fps:.1f} fps (busy {self.busy_s:.1f}s)"
+
+
+def _put(q: "queue.Queue", item, stop: threading.Event) -> bool:
+    """Блокирующий put с проверкой stop — backpressure без вечного зависания при ошибке соседа."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def run_pipelined(cap, fps: float, detect_every_n: int, batcher: InferenceBatcher, stage: EventStage,
+                  frames_buffer, queue_size: int = 64, log_every_s: float = 30.0,
+                  on_frame_done: Optional[Callable[[], None]] = None, tracer=None) -> List[StageStats]:
+    """
+    Конвейерный режим: поток декодирования -> поток инференса -> стадия событий (в вызывающем потоке).
+    Стадии связаны ограниченными очередями (queue_size), поэтому быстрый декодер ждёт медленный инференс,
+    а не копит кадры в памяти. Кадры приходят в стадию событий в том же порядке, что и в последовательном
+    режиме, поэтому отчёты совпадают. Декодер пишет кадры сразу в frames_buffer; его ёмкость должна
+    покрывать кадры в очередях (2 * queue_size), чтобы слоты не перезаписывались раньше времени.
+    Возвращает статистику стадий.
+    """
+    decode_q: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    event_q: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    stats = [StageStats('decode'), StageStats('inference'), StageStats('event')]
+    dec_stats, inf_stats, ev_stats = stats
+
+    def decoder():
+        try:
+            idx = 0
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                t_span = tracer.begin() if tracer is not None else 0
+                infer = idx % detect_every_n == 0
+                ret, frame = frames_buffer.read(cap, need=infer)
+                if not ret:
+                    break
+                if tracer is not None and tracer.sampled(idx):
+                    tracer.span('decode', t_span, args={'frame': idx})
+                item = FrameItem(idx=idx, frame=frame, current_s=idx / fps, wall_time=now_iso(), infer=infer)
+                dec_stats.busy_s += time.perf_counter() - t0
+                dec_stats.items += 1
+                if not _put(decode_q, item, stop):
+                    return
+                idx += 1
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(decode_q, None, stop)
+
+    def inference():
+        try:
+            while not stop.is_set():
+                try:
+                    item = decode_q.get(timeout=0.05)
+                except queue.Empty:
+                    item = False
+                t0 = time.perf_counter()
+                if item is None:
+                    ready = batcher.flush()
+                elif item is False:
+                    ready = batcher.poll()
+                else:
+                    ready = batcher.push(item)
+                inf_stats.busy_s += time.perf_counter() - t0
+                for r in ready:
+                    inf_stats.items += 1
+                    if not _put(event_q, r, stop):
+                        return
+                if item is None:
+                    break
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(event_q, None, stop)
+
+    threads = [threading.Thread(target=decoder, name='decode', daemon=True),
+               threading.Thread(target=inference, name='inference', daemon=True)]
+    for t in threads:
+        t.start()
+
+    last_log = time.monotonic()
+    try:
+        while True:
+            try:
+                item = event_q.get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    break
+                continue
+            if item is None:
+                break
+            t0 = time.perf_counter()
+            stage.on_frame(item)
+            ev_stats.busy_s += time.perf_counter() - t0
+            ev_stats.items += 1
+            if on_frame_done is not None:
+                on_frame_done()
+            if log_every_s and time.monotonic() - last_log >= log_every_s:
+                last_log = time.monotonic()
+                print(f"[PIPELINE] {' | '.join(map(str, stats))} | queues decode={decode_q.qsize()} event={event_q.qsize()}")
+    finally:
+        stop.set()
+        for t in threads:
+            t.join(timeout=5.0)
+
+    if errors:
+        raise errors[0]
+    print(f"[PIPELINE] {' | '.join(map(str, stats))}")
+    return stats
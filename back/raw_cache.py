@@ -0,0 +1,102 @@
+# raw_cache.py
+# Кэш «сырых» выходов модели по кадрам (при минимальном conf) для пары видео + модель.
+# Подбор merge_sec / finalize_delay / conf / VIOLATION_CLASSES после этого не требует повторного YOLO:
+# replay_video (main.py) восстанавливает события, отчёты и клипы из кэша со скоростью логики событий.
+#
+# Формат — .npz без сжатия, колонками: frame_idx (int32, кадры с инференсом), offsets (int64, n+1),
+# class_id (uint16), conf (float32 — как отдаёт модель, без потерь), bbox (int32, m x 4) + JSON-заголовок.
+# Фильтр conf после NMS эквивалентен прогону модели с этим conf: жадный NMS обрабатывает боксы по убыванию
+# уверенности, так что боксы ниже порога не влияют на судьбу боксов выше него.
+
+import json
+import os
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from utils import atomic_write
+
+RAW_CACHE_VERSION = 1
+RAW_CACHE_SUFFIX = '.lvraw.npz'
+
+Det = Tuple[str, float, Tuple[int, int, int, int]]
+
+
+def raw_cache_path(cache_dir: str, video_sha256: str, model_sha256: str) -> str:
+    return os.path.join(cache_dir, f"{video_sha256}_{model_sha256[:16]}{RAW_CACHE_SUFFIX}")
+
+
+class RawDetectionRecorder:
+    """Копит выходы модели по кадрам (InferenceBatcher зовёт add) и атомарно сохраняет их в конце обработки."""
+
+    def __init__(self, path: str, fps: float, total: int, every: int, conf: float, meta: Optional[dict] = None):
+        self.path = path
+        self.header = {"version": RAW_CACHE_VERSION, "fps": fps, "total": total, "every": every, "conf": conf,
+                       **(meta or {})}
+        self.class_names: List[str] = []
+        self._class_ids = {}
+        self.frame_idx: List[int] = []
+        self.counts: List[int] = []
+        self.class_id: List[int] = []
+        self.conf: List[float] = []
+        self.bbox: List[Tuple[int, int, int, int]] = []
+
+    def add(self, frame_idx: int, dets: List[Det]):
+        self.frame_idx.append(frame_idx)
+        self.counts.append(len(dets))
+        for name, conf, bbox in dets:
+            cid = self._class_ids.get(name)
+            if cid is None:
+                cid = self._class_ids[name] = len(self.class_names)
+                self.class_names.append(name)
+            self.class_id.append(cid)
+            self.conf.append(conf)
+            self.bbox.append(bbox)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        header = dict(self.header, frames=len(self.frame_idx), class_names=self.class_names)
+
+        def write(tmp):
+            with open(tmp, 'wb') as f:  # файловый объект: np.savez не дописывает своё расширение
+                np.savez(f, header=np.frombuffer(json.dumps(header).encode(), dtype=np.uint8),
+                         frame_idx=np.asarray(self.frame_idx, dtype=np.int32),
+                         offsets=np.concatenate([[0], np.cumsum(self.counts, dtype=np.int64)]).astype(np.int64),
+                         class_id=np.asarray(self.class_id, dtype=np.uint16),
+                         conf=np.asarray(self.conf, dtype=np.float32),
+                         bbox=np.asarray(self.bbox, dtype=np.int32).reshape(-1, 4))
+        atomic_write(self.path, write)
+        print(f"[RAW] saved {len(self.frame_idx)} frames / {len(self.conf)} detections -> {self.path}")
+
+
+class RawDetections:
+    """Загруженный кэш: header (fps, total, every, conf, ...) и детекции по кадрам."""
+
+    def __init__(self, path: str):
+        with np.load(path) as z:
+            self.header = json.loads(z['header'].tobytes().decode())
+            if self.header.get('version') != RAW_CACHE_VERSION:
+                raise ValueError(f"unsupported raw cache version in {path}")
+            self.frame_idx = z['frame_idx']
+            self.offsets = z['offsets']
+            self.class_id = z['class_id']
+            self.conf = z['conf']
+            self.bbox = z['bbox']
+        self.class_names: List[str] = self.header['class_names']
+        self.fps: float = self.header['fps']
+        self.total: int = self.header['total']
+        self.every: int = self.header['every']
+        self.min_conf: float = self.header['conf']
+
+    def __len__(self) -> int:
+        return len(self.frame_idx)
+
+    def __iter__(self) -> Iterator[Tuple[int, List[Det]]]:
+        """(frame_idx, [(class_name, conf, bbox)]) в порядке кадров, в формате YoloModel.predict_batch."""
+        names = self.class_names
+        conf = self.conf.tolist()
+        cls = self.class_id.tolist()
+        bbox = [tuple(b) for b in self.bbox.tolist()]
+        off = self.offsets.tolist()
+        for i, idx in enumerate(self.frame_idx.tolist()):
+            yield idx, [(names[cls[j]], conf[j], bbox[j]) for j in range(off[i], off[i + 1])]
@@ -0,0 +1,228 @@
+# reports.py
+# Инкрементальная запись отчётов: детекции сбрасываются группами строк прямо во время обработки,
+# события — атомарными снимками. Основной формат — Parquet с типизированными колонками
+# (списки вместо строк "[...]"), CSV — для совместимости.
+
+import os
+import time
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from detector import DetectionStore, ViolationEvent
+from utils import atomic_write, ensure_dir
+
+DETECTIONS_CSV = 'detections_all.csv'
+EVENTS_CSV = 'violations_events.csv'
+DETECTIONS_PARQUET = 'detections_all.parquet'   # директория с part-NNNNN.parquet
+EVENTS_PARQUET = 'violations_events.parquet'
+
+EVENT_COLUMNS = ['id', 'class_names', 'confs', 'time_s', 'frame_idx', 'wall_time_first', 'bbox', 'clip_path', 'saved']
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        return pa, pq
+    except ImportError:
+        return None, None
+
+
+def _event_rows(events: Iterable[ViolationEvent]) -> List[dict]:
+    return [{'id': e.id, 'class_names': list(e.class_names), 'confs': list(e.confs), 'time_s': e.time_s,
+             'frame_idx': e.frame_idx, 'wall_time_first': e.wall_time_first, 'bbox': e.bbox,
+             'clip_path': e.clip_path, 'saved': e.saved} for e in events]
+
+
+class ReportSink:
+    """
+    Пишет отчёты по ходу обработки, чтобы падение на 7-м часу смены не уносило всё.
+    - детекции: каждые row_group строк из DetectionStore уходят в отдельный part-файл Parquet
+      (каждый part — законченный файл) и дописываются в CSV;
+    - события: раз в flush_sec секунд снимок всех событий атомарно перезаписывается.
+    update() дешёвый, его можно звать на каждом кадре.
+    """
+
+    def __init__(self, out_dir: str, formats: Sequence[str] = ('parquet', 'csv'), row_group: int = 50000,
+                 flush_sec: float = 60.0):
+        self.out_dir = out_dir
+        self.formats = set(formats)
+        self.row_group = max(1, int(row_group))
+        self.flush_sec = flush_sec
+        self._flushed = 0
+        self._parts = 0
+        self._last_events = time.monotonic()
+        self.pa, self.pq = _pyarrow()
+        if 'parquet' in self.formats and self.pa is None:
+            print("[REPORT] pyarrow is not installed - writing CSV only")
+            self.formats.discard('parquet')
+            self.formats.add('csv')
+        ensure_dir(out_dir)
+        if 'parquet' in self.formats:
+            # part-файлы прошлого (прерванного) запуска той же задачи не должны смешаться с новыми
+            pq_dir = os.path.join(out_dir, DETECTIONS_PARQUET)
+            ensure_dir(pq_dir)
+            for name in os.listdir(pq_dir):
+                os.remove(os.path.join(pq_dir, name))
+        if 'csv' in self.formats:
+            # заголовок CSV пишется с первой группой строк
+            path = os.path.join(out_dir, DETECTIONS_CSV)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def update(self, detections: DetectionStore, events: List[ViolationEvent]):
+        if len(detections) - self._flushed >= self.row_group:
+            self.flush_detections(detections, full_only=True)
+        if self.flush_sec and time.monotonic() - self._last_events >= self.flush_sec:
+            self.write_events(events)
+
+    def flush_detections(self, detections: DetectionStore, full_only: bool = False):
+        """Сбрасывает ещё не записанные детекции группами по row_group строк
+        (full_only — только полные группы, хвост остаётся до следующего сброса)."""
+        n = len(detections)
+        if full_only:
+            n = self._flushed + (n - self._flushed) // self.row_group * self.row_group
+        while self._flushed < n:
+            lo, hi = self._flushed, min(n, self._flushed + self.row_group)
+            if 'parquet' in self.formats:
+                path = os.path.join(self.out_dir, DETECTIONS_PARQUET, f"part-{self._parts:05d}.parquet")
+                table = self._detections_table(detections, lo, hi)
+                atomic_write(path, lambda p: self.pq.write_table(table, p))
+                self._parts += 1
+            if 'csv' in self.formats:
+                df = detections.to_dataframe(lo, hi)
+                df.to_csv(os.path.join(self.out_dir, DETECTIONS_CSV), mode='a', header=(lo == 0), index=False)
+            self._flushed = hi
+
+    def write_events(self, events: List[ViolationEvent]):
+        """Атомарно перезаписывает снимок событий."""
+        self._last_events = time.monotonic()
+        rows = _event_rows(events)
+        if 'parquet' in self.formats:
+            table = self._events_table(rows)
+            atomic_write(os.path.join(self.out_dir, EVENTS_PARQUET), lambda p: self.pq.write_table(table, p))
+        if 'csv' in self.formats:
+            df = pd.DataFrame(rows, columns=EVENT_COLUMNS)
+            atomic_write(os.path.join(self.out_dir, EVENTS_CSV), lambda p: df.to_csv(p, index=False))
+
+    def close(self, detections: DetectionStore, events: List[ViolationEvent]):
+        self.flush_detections(detections)
+        if 'csv' in self.formats and self._flushed == 0:
+            detections.to_dataframe().to_csv(os.path.join(self.out_dir, DETECTIONS_CSV), index=False)
+        self.write_events(events)
+
+    def _detections_table(self, d: DetectionStore, lo: int, hi: int):
+        pa = self.pa
+        wall = d.wall_id[lo:hi]
+        w0 = int(wall.min()) if hi > lo else 0
+        w1 = int(wall.max()) + 1 if hi > lo else 0
+        return pa.table({
+            'wall_time': pa.DictionaryArray.from_arrays(pa.array(wall - w0, pa.int32()),
+                                                        pa.array(d.wall_times[w0:w1], pa.string())),
+            'time_s': pa.array(d.time_s[lo:hi]),
+            'frame_idx': pa.array(d.frame_idx[lo:hi]),
+            'class_name': pa.DictionaryArray.from_arrays(pa.array(d.class_id[lo:hi].astype(np.int32)),
+                                                         pa.array(d.class_names, pa.string())),
+            'conf': pa.array(d.conf[lo:hi]),
+            'bbox': pa.FixedSizeListArray.from_arrays(pa.array(np.ascontiguousarray(d.bbox[lo:hi]).reshape(-1)), 4),
+        })
+
+    def _events_table(self, rows: List[dict]):
+        pa = self.pa
+        schema = pa.schema([
+            ('id', pa.int64()),
+            ('class_names', pa.list_(pa.string())),
+            ('confs', pa.list_(pa.float64())),
+            ('time_s', pa.float64()),
+            ('frame_idx', pa.int64()),
+            ('wall_time_first', pa.string()),
+            ('bbox', pa.list_(pa.int32(), 4)),
+            ('clip_path', pa.string()),
+            ('saved', pa.bool_()),
+        ])
+        cols = {c: [r[c] for r in rows] for c in EVENT_COLUMNS}
+        cols['bbox'] = [list(b) for b in cols['bbox']]
+        return pa.table(cols, schema=schema)
+
+
+def _to_list(v) -> list:
+    if v is None:
+        return []
+    if isinstance(v, np.ndarray):
+        return v.tolist()
+    return list(v)
+
+
+def load_events(task_dir: str) -> Optional[List[dict]]:
+    """
+    Загружает события результата: из Parquet (типизированные списки, без разбора строк),
+    иначе из CSV старого формата. None — если отчёта нет.
+    """
+    pq_path = os.path.join(task_dir, EVENTS_PARQUET)
+    if os.path.exists(pq_path):
+        _, pq = _pyarrow()
+        if pq is not None:
+            rows = pq.read_table(pq_path).to_pylist()
+            for r in rows:
+                r['class_names'] = _to_list(r['class_names'])
+                r['confs'] = _to_list(r['confs'])
+                r['bbox'] = tuple(_to_list(r['bbox']))
+            return rows
+    csv_path = os.path.join(task_dir, EVENTS_CSV)
+    if os.path.exists(csv_path):
+        return _load_events_csv(csv_path)
+    return None
+
+
+def _parse_list(value, default):
+    # поля class_names/confs/bbox в CSV сохранены как питоновские/JSON-строки
+    import ast
+    import json
+    if not isinstance(value, str):
+        return default
+    try:
+        return json.loads(value)
+    except Exception:
+        try:
+            return ast.literal_eval(value)
+        except Exception:
+            return default
+
+
+def _load_events_csv(path: str) -> List[dict]:
+    try:
+        df = pd.read_csv(path)
+    except pd.errors.EmptyDataError:
+        return []
+    rows = []
+    for r in df.to_dict('records'):
+        class_names = _parse_list(r.get('class_names'), [r.get('class_names')])
+        confs = _parse_list(r.get('confs'), [])
+        clip_path = r.get('clip_path')
+        wall_time = r.get('wall_time_first')
+        rows.append({
+            'id': int(r.get('id', 0)),
+            'class_names': class_names if isinstance(class_names, list) else [class_names],
+            'confs': confs if isinstance(confs, list) else [],
+            'time_s': float(r.get('time_s', 0.0)),
+            'frame_idx': int(r.get('frame_idx', 0)),
+            'wall_time_first': wall_time if isinstance(wall_time, str) else '',
+            'bbox': tuple(_parse_list(r.get('bbox'), ())),
+            'clip_path': clip_path if isinstance(clip_path, str) else None,
+            'saved': bool(r.get('saved', False)),
+        })
+    return rows
+
+
+def load_detections(task_dir: str) -> Optional[pd.DataFrame]:
+    """Детекции результата: Parquet (bbox — список из 4 int), иначе CSV."""
+    pq_dir = os.path.join(task_dir, DETECTIONS_PARQUET)
+    _, pq = _pyarrow()
+    if os.path.isdir(pq_dir) and pq is not None and os.listdir(pq_dir):
+        return pq.read_table(pq_dir).to_pandas()
+    csv_path = os.path.join(task_dir, DETECTIONS_CSV)
+    if os.path.exists(csv_path):
+        return pd.read_csv(csv_path)
+    return None
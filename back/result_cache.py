@@ -0,0 +1,172 @@
+# result_cache.py
+# Кэш результатов обработки по содержимому: ключ = SHA-256 видео + SHA-256 файла модели + нормализованные
+# параметры, влияющие на результат. Повторный запуск того же видео с теми же настройками сразу отдаёт готовые
+# отчёты и клипы. Результаты в OUTPUT_DIR ограничены по размеру: вытесняются давно не запрошенные (LRU).
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+from config import (RESULT_CACHE_PATH, RESULT_CACHE_MAX_BYTES, CONF_THRESH, DETECT_EVERY_N_FRAMES,
+                    MERGE_WINDOW_SEC, FINALIZE_DELAY, REPORT_FORMATS, CLIP_PRE_SEC, CLIP_POST_SEC,
+                    VIOLATION_CLASSES, MOTION_GATE, INFER_BACKEND)
+from model_iface import resolve_backend
+from upload_store import file_sha256
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    task_id TEXT NOT NULL,
+    out_dir TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_lru ON results (last_used);
+"""
+
+
+def normalize_params(params: dict) -> dict:
+    """Только то, что меняет отчёты/клипы, с подставленными значениями по умолчанию.
+    batch_size, pipelined, compress_buffer, clips_from_source, workers, webhook, replay на результат не влияют.
+    Бэкенд модели (он тоже меняет результат) подставляет key() — фактический, для конкретного файла модели."""
+    def pick(name, default):
+        value = params.get(name)
+        return default if value is None else value
+    return {
+        "conf": float(pick("conf", CONF_THRESH)),
+        "every": int(pick("every", DETECT_EVERY_N_FRAMES)),
+        "merge_sec": float(pick("merge_sec", MERGE_WINDOW_SEC)),
+        "finalize_delay": float(pick("finalize_delay", FINALIZE_DELAY)),
+        "save_immediately": bool(pick("save_immediately", False)),
+        "report_formats": sorted(pick("report_formats", REPORT_FORMATS)),
+        "motion_gate": bool(pick("motion_gate", MOTION_GATE)),
+        "roi": params.get("roi"),
+        "violation_classes": sorted(pick("violation_classes", VIOLATION_CLASSES)),
+        # настройки из config, которые тоже определяют результат
+        "clip_pre_sec": CLIP_PRE_SEC,
+        "clip_post_sec": CLIP_POST_SEC,
+    }
+
+
+def dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResultCache:
+    """
+    on_evict(task_dir_name) вызывается для каждого вытесненного результата (например, чтобы убрать его
+    события из индекса). Удаляются только результаты, зарегистрированные в кэше (завершённые задачи).
+    """
+
+    def __init__(self, path: str = RESULT_CACHE_PATH, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def remember_hash(self, path: str, sha256: str):
+        """Хэш уже известен (посчитан при загрузке) — не перечитывать файл."""
+        st = os.stat(path)
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                         (os.path.abspath(path), st.st_size, st.st_mtime_ns, sha256))
+
+    def file_hash(self, path: str) -> str:
+        """SHA-256 файла; пересчитывается, только если поменялись размер или mtime."""
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        row = self._conn().execute("SELECT size, mtime_ns, sha256 FROM file_hashes WHERE path = ?", (key,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        digest = file_sha256(path)
+        self.remember_hash(path, digest)
+        return digest
+
+    def key(self, video_path: str, model_path: str, params: dict) -> str:
+        model = self.file_hash(model_path) if os.path.exists(model_path) else f"missing:{model_path}"
+        backend = resolve_backend(model_path, params.get("backend") or INFER_BACKEND)
+        payload = json.dumps({"video": self.file_hash(video_path), "model": model, "backend": backend,
+                              "params": normalize_params(params)}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Готовый результат по ключу (и отметка об использовании для LRU) или None."""
+        conn = self._conn()
+        row = conn.execute("SELECT task_id, out_dir FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if not os.path.isdir(row[1]):
+            # результат удалили руками — забываем
+            with conn:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            return None
+        with conn:
+            conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        return {"task_id": row[0], "out_dir": row[1]}
+
+    def put(self, key: str, task_id: str, out_dir: str):
+        """Регистрирует готовый результат и вытесняет старые, если кэш превысил max_bytes."""
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                         (key, task_id, out_dir, dir_size(out_dir), now, now))
+        self.evict(protect=key)
+
+    def total_bytes(self) -> int:
+        return self._conn().execute("SELECT COALESCE(SUM(size_bytes), 0) FROM results").fetchone()[0]
+
+    def evict(self, protect: Optional[str] = None) -> int:
+        """Удаляет давно не использованные результаты, пока суммарный размер больше max_bytes."""
+        removed = 0
+        with self._lock:
+            conn = self._conn()
+            total = self.total_bytes()
+            if total <= self.max_bytes:
+                return 0
+            rows = conn.execute("SELECT key, out_dir, size_bytes FROM results ORDER BY last_used").fetchall()
+            for key, out_dir, size in rows:
+                if total <= self.max_bytes:
+                    break
+                if key == protect:
+                    continue
+                with conn:
+                    conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                shutil.rmtree(out_dir, ignore_errors=True)
+                if self.on_evict:
+                    self.on_evict(os.path.basename(out_dir))
+                total -= size
+                removed += 1
+                print(f"[CACHE] evicted {out_dir} ({size / 1e6:.1f} MB)")
+        return removed
@@ -0,0 +1,142 @@
+# roi.py
+# Зоны интереса (ROI) камеры: инференс только по вырезанным областям кадра (стол заготовки, мойки, линия)
+# вместо всего кадра. Каждая область масштабируется моделью до imgsz сама, поэтому у объекта больше пикселей
+# при том же вычислении, а пустые части сцены не считаются вовсе.
+#
+# Конфиг — JSON (файл на камеру/видео или dict из API):
+#   {"pad": 16, "regions": [{"name": "table", "rect": [x1, y1, x2, y2]},
+#                           {"name": "sink", "polygon": [[x, y], ...]}]}
+# Координаты в пикселях кадра или в долях (все значения области <= 1). Полигон вырезается по охватывающему
+# прямоугольнику, пиксели вне полигона закрашиваются серым (114, как поля letterbox у YOLO), а бокс
+# засчитывается, только если его центр внутри полигона.
+
+import json
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+
+from config import ROI_PAD, ROI_DEDUP_IOU
+from utils import iou
+
+Det = Tuple[str, float, Tuple[int, int, int, int]]
+FILL_VALUE = 114
+
+
+@dataclass
+class Region:
+    name: str
+    x1: int
+    y1: int
+    x2: int
+    y2: int
+    polygon: Optional[np.ndarray] = None  # (n, 2) int32, координаты кадра
+    mask: Optional[np.ndarray] = None     # bool (y2 - y1, x2 - x1): True — пиксель внутри полигона
+
+
+def load_roi(spec: Union[None, str, dict]) -> Optional[dict]:
+    """Путь к JSON-файлу, готовый dict или None (весь кадр)."""
+    if spec is None or isinstance(spec, dict):
+        return spec
+    with open(spec) as f:
+        return json.load(f)
+
+
+def _scale(points: Sequence[Sequence[float]], w: int, h: int) -> np.ndarray:
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if pts.size and pts.max() <= 1.0:
+        pts = pts * (w, h)
+    return np.round(pts).astype(np.int32)
+
+
+def build_regions(spec: dict, frame_shape: Tuple[int, ...]) -> List[Region]:
+    """Области в координатах кадра данного размера (с отступом pad, обрезанные по границам кадра)."""
+    h, w = frame_shape[:2]
+    pad = int(spec.get("pad", ROI_PAD))
+    regions = []
+    for i, r in enumerate(spec.get("regions", [])):
+        name = r.get("name", f"roi{i}")
+        if "polygon" in r:
+            polygon = _scale(r["polygon"], w, h)
+            (x1, y1), (x2, y2) = polygon.min(axis=0), polygon.max(axis=0)
+        elif "rect" in r:
+            polygon = None
+            (x1, y1), (x2, y2) = _scale(r["rect"], w, h)
+        else:
+            raise ValueError(f"ROI region {name!r} needs 'rect' or 'polygon'")
+        x1, y1 = max(0, int(x1) - pad), max(0, int(y1) - pad)
+        x2, y2 = min(w, int(x2) + pad), min(h, int(y2) + pad)
+        if x2 <= x1 or y2 <= y1:
+            raise ValueError(f"ROI region {name!r} is outside the {w}x{h} frame")
+        mask = None
+        if polygon is not None:
+            m = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+            cv2.fillPoly(m, [polygon - (x1, y1)], 1)
+            mask = m.astype(bool)
+        regions.append(Region(name, x1, y1, x2, y2, polygon, mask))
+    return regions
+
+
+def _inside(region: Region, bbox: Tuple[int, int, int, int]) -> bool:
+    if region.polygon is None:
+        return True
+    cx, cy = (bbox[0] + bbox[2]) / 2.0, (bbox[1] + bbox[3]) / 2.0
+    return cv2.pointPolygonTest(region.polygon.reshape(-1, 1, 2), (cx, cy), False) >= 0
+
+
+def dedupe(dets: List[Det], iou_thresh: float = ROI_DEDUP_IOU) -> List[Det]:
+    """Один объект на стыке пересекающихся областей: из боксов одного класса с IoU > iou_thresh
+    остаётся самый уверенный."""
+    kept: List[Det] = []
+    for d in sorted(dets, key=lambda d: -d[1]):
+        if all(k[0] != d[0] or iou(k[2], d[2]) <= iou_thresh for k in kept):
+            kept.append(d)
+    return kept
+
+
+class RoiModel:
+    """
+    Обёртка над моделью с тем же интерфейсом (predict_frame / predict_batch): кадр режется на области ROI,
+    все вырезки всех кадров батча идут в модель одним вызовом, боксы возвращаются в координатах кадра.
+    """
+
+    def __init__(self, model, spec: dict):
+        self.model = model
+        self.spec = spec
+        self._regions: Dict[Tuple[int, ...], List[Region]] = {}
+
+    def regions(self, frame_shape: Tuple[int, ...]) -> List[Region]:
+        regions = self._regions.get(frame_shape)
+        if regions is None:
+            regions = self._regions[frame_shape] = build_regions(self.spec, frame_shape)
+        return regions
+
+    def _crop(self, frame: np.ndarray, r: Region) -> np.ndarray:
+        crop = frame[r.y1:r.y2, r.x1:r.x2]
+        if r.mask is None:
+            return np.ascontiguousarray(crop)
+        crop = crop.copy()  # не портим кадр в буфере клипов
+        crop[~r.mask] = FILL_VALUE
+        return crop
+
+    def predict_frame(self, frame: np.ndarray, conf: float = 0.5) -> List[Det]:
+        return self.predict_batch([frame], conf=conf)[0]
+
+    def predict_batch(self, frames: Sequence[np.ndarray], conf: float = 0.5) -> List[List[Det]]:
+        if not frames:
+            return []
+        crops, owners = [], []
+        for i, frame in enumerate(frames):
+            for r in self.regions(frame.shape):
+                crops.append(self._crop(frame, r))
+                owners.append((i, r))
+        out: List[List[Det]] = [[] for _ in frames]
+        for (i, r), dets in zip(owners, self.model.predict_batch(crops, conf=conf)):
+            for name, c, (x1, y1, x2, y2) in dets:
+                bbox = (x1 + r.x1, y1 + r.y1, x2 + r.x1, y2 + r.y1)
+                if _inside(r, bbox):
+                    out[i].append((name, c, bbox))
+        if len(self.spec.get("regions", [])) > 1:
+            out = [dedupe(dets) for dets in out]
+        return out
@@ -0,0 +1,313 @@
+# scheduler.py
+# Планировщик задач обработки для API: пул процессов с «тёплыми» воркерами (модель загружается
+# и прогревается один раз на процесс), очередь с приоритетами и контроль допуска.
+# Задачи не уходят в пул пачкой: в пул отдаётся ровно столько, сколько свободных воркеров,
+# остальные ждут в очереди (TaskStore), где у них есть позиция и оценка времени.
+
+import heapq
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional
+
+import cv2
+import numpy as np
+
+from config import (MODEL_PATH, SCHEDULER_WORKERS, TASK_POLL_SEC, TASK_HEARTBEAT_SEC, TASK_STALE_SEC,
+                    TASK_MAX_ATTEMPTS, METRICS_DIR, METRICS_EXPORT_SEC, INFER_BACKEND)
+import metrics
+from task_store import TaskStore, owner_id
+
+
+# ---- код воркер-процесса ----
+
+_models: Dict[str, object] = {}
+_updates = None        # очередь сообщений о задачах в процесс API (см. Scheduler.on_update)
+_current_task: Optional[str] = None
+
+
+def _init_worker(updates, initializer: Optional[Callable], initargs: tuple):
+    global _updates
+    _updates = updates
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_task(target: Callable, task_id: str, job: dict):
+    global _current_task
+    _current_task = task_id
+    try:
+        return target(job)
+    finally:
+        _current_task = None
+
+
+def publish(msg: dict):
+    """Сообщение о текущей задаче воркера (прогресс, событие) в процесс API; вне пула ничего не делает."""
+    if _updates is None or _current_task is None:
+        return
+    try:
+        _updates.put_nowait((_current_task, msg))
+    except Exception as e:
+        print(f"[SCHED] cannot publish task update: {e}")
+
+
+def _load_model(path: str, backend: str = INFER_BACKEND):
+    from model_iface import load_model, resolve_backend
+    key = (path, resolve_backend(path, backend))
+    model = _models.get(key)
+    if model is None:
+        model = load_model(path, key[1])
+        # прогрев: первый инференс (инициализация на устройстве, fuse слоёв) не должен попадать в задачу
+        model.predict_frame(np.zeros((640, 640, 3), dtype=np.uint8))
+        _models[key] = model
+    return model
+
+
+def warm_worker(model_path: str = MODEL_PATH, backend: str = INFER_BACKEND):
+    """initializer пула: загрузить модель заранее. Ошибку не пробрасываем — иначе пул станет broken.
+    Заодно включает сброс метрик процесса для /metrics API."""
+    metrics.REGISTRY.start_export(METRICS_DIR, METRICS_EXPORT_SEC)
+    try:
+        _load_model(model_path, backend)
+        print(f"[SCHED] worker ready: {model_path}")
+    except Exception as e:
+        print(f"[SCHED] worker warmup failed ({model_path}): {e}")
+
+
+def run_job(kwargs: dict):
+    """Задача воркера: process_video / process_stream с уже загруженной моделью процесса
+    или replay_video из кэша детекций. Прогресс и финализированные события уходят в API (publish)."""
+    from main import process_video, replay_video, process_stream
+    kwargs = dict(kwargs)
+    mode = kwargs.pop('mode', None)
+    if mode == 'replay':
+        replay_video(**kwargs)
+        return
+    model_path = kwargs.pop('model_path', None) or MODEL_PATH
+    model = _load_model(model_path, kwargs.pop('backend', None) or INFER_BACKEND)
+    if mode == 'stream':
+        process_stream(model_path=model_path, model=model, on_event=publish,
+                       on_stats=lambda st: publish(dict(st, type='progress')), **kwargs)
+    else:
+        process_video(model_path=model_path, model=model, on_progress=publish, on_event=publish, **kwargs)
+
+
+def probe_duration(video_path: str) -> float:
+    """Длительность видео в секундах по метаданным (0 — если не удалось определить)."""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0.0
+        return frames / fps if fps > 0 else 0.0
+    finally:
+        cap.release()
+
+
+# ---- планировщик (процесс API) ----
+
+class Scheduler:
+    """
+    Раздаёт задачи из TaskStore пулу из workers процессов (spawn); initializer(*initargs) — прогрев воркера,
+    target(job) — сама задача (job — JSON-аргументы из хранилища).
+    Очередь живёт в хранилище, поэтому планировщиков может быть несколько (по одному на процесс uvicorn):
+    claim() атомарно берёт задачу, только если на хосте запущено меньше workers.
+    on_done(task_id) вызывается в процессе API после успешной задачи (исключение делает задачу error).
+    on_update(task_id, msg) получает в процессе API (из служебного потока) смену статуса задачи
+    ({"type": "status", ...}) и сообщения воркера из scheduler.publish (прогресс, финализированные события).
+
+    Поток раздачи заодно обновляет heartbeat своих задач и возвращает в очередь задачи, чей процесс API
+    перестал подавать признаки жизни (упал или перезапущен посреди обработки).
+    Если воркер пула умер (BrokenProcessPool), пул пересоздаётся; задача, которую не удалось отдать в пул,
+    возвращается в очередь.
+
+    ETA: по последним завершённым задачам — среднее «секунд обработки на секунду видео»
+    (и среднее время задачи — для видео без длительности); раздача очереди свободным воркерам моделируется.
+    """
+
+    def __init__(self, store: TaskStore, target: Callable, workers: int = SCHEDULER_WORKERS,
+                 initializer: Optional[Callable] = None, initargs: tuple = (),
+                 on_done: Optional[Callable] = None, on_update: Optional[Callable] = None,
+                 poll_sec: float = TASK_POLL_SEC,
+                 heartbeat_sec: float = TASK_HEARTBEAT_SEC, stale_sec: float = TASK_STALE_SEC,
+                 max_attempts: int = TASK_MAX_ATTEMPTS):
+        self.store = store
+        self.target = target
+        self.workers = max(1, int(workers))
+        self.initializer, self.initargs = initializer, initargs
+        self.on_done = on_done
+        self.on_update = on_update
+        self._updates = None
+        self.poll_sec, self.heartbeat_sec = poll_sec, heartbeat_sec
+        self.stale_sec, self.max_attempts = stale_sec, max_attempts
+        self.owner = owner_id()
+        self._running: Dict[str, float] = {}   # task_id -> started_at (задачи этого процесса)
+        self._cond = threading.Condition()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def start(self):
+        with self._cond:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, name='scheduler', daemon=True)
+                self._dispatcher.start()
+
+    def wake(self):
+        """Новая задача в хранилище — не ждать следующего опроса."""
+        with self._cond:
+            self._cond.notify_all()
+
+    def _dispatch_loop(self):
+        next_beat = 0.0
+        while not self._stopped:
+            try:
+                if time.monotonic() >= next_beat:
+                    self.store.heartbeat(self.owner)
+                    for task_id in self.store.requeue_stale(self.stale_sec, self.max_attempts):
+                        print(f"[SCHED] requeued interrupted task {task_id}")
+                    next_beat = time.monotonic() + self.heartbeat_sec
+                while len(self._running) < self.workers and not self._stopped:
+                    task = self.store.claim(self.owner, self.workers)
+                    if task is None or not self._launch(task):
+                        break
+            except Exception as e:
+                print(f"[SCHED] dispatch error: {e}")
+            with self._cond:
+                if not self._stopped:
+                    self._cond.wait(self.poll_sec)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._cond:
+            if self._pool is None:
+                ctx = multiprocessing.get_context('spawn')
+                if self._updates is None:
+                    # очередь передаётся воркерам при старте процесса (через initializer) — иначе её не передать
+                    self._updates = ctx.Queue()
+                    threading.Thread(target=self._updates_loop, args=(self._updates,), name='scheduler-updates',
+                                     daemon=True).start()
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=_init_worker,
+                                                 initargs=(self._updates, self.initializer, self.initargs))
+            return self._pool
+
+    def _drop_pool(self, pool: ProcessPoolExecutor):
+        """Сломанный пул (воркер умер) больше не принимает задач — следующий _launch создаст новый."""
+        with self._cond:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        print("[SCHED] process pool is broken, restarting workers")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _launch(self, task: dict) -> bool:
+        task_id = task['task_id']
+        pool = self._get_pool()
+        try:
+            # колбэк завершения приходит из потока пула; в пул оттуда ничего не отдаём — только будим раздачу
+            fut = pool.submit(_run_task, self.target, task_id, task['job'])
+        except Exception as e:
+            # задача не запущена: вернуть её в очередь, иначе она навсегда осталась бы running под нашим heartbeat
+            print(f"[SCHED] cannot submit task {task_id}: {e}")
+            self.store.release(task_id, self.owner)
+            if isinstance(e, BrokenProcessPool):
+                self._drop_pool(pool)
+            return False
+        with self._cond:
+            self._running[task_id] = time.monotonic()
+        self._update(task_id, {"type": "status", "status": "running"})
+        fut.add_done_callback(lambda f, task_id=task_id, pool=pool: self._finished(task_id, f, pool))
+        return True
+
+    def _update(self, task_id: str, msg: dict):
+        if self.on_update is None:
+            return
+        try:
+            self.on_update(task_id, msg)
+        except Exception as e:
+            print(f"[SCHED] on_update failed for {task_id}: {e}")
+
+    def _updates_loop(self, updates):
+        while True:
+            item = updates.get()
+            if item is None:
+                return
+            self._update(*item)
+
+    def _finished(self, task_id: str, fut, pool: Optional[ProcessPoolExecutor] = None):
+        error = None if fut.cancelled() else fut.exception()
+        if fut.cancelled():
+            error = RuntimeError("cancelled")
+        if isinstance(error, BrokenProcessPool) and pool is not None:
+            self._drop_pool(pool)
+        if error is None and self.on_done:
+            try:
+                self.on_done(task_id)
+            except Exception as e:
+                error = e
+        if not self.store.finish(task_id, self.owner, None if error is None else str(error)):
+            print(f"[SCHED] task {task_id} was taken over by another worker, result dropped")
+        else:
+            self._update(task_id, {"type": "status", "status": "done" if error is None else "error"})
+        with self._cond:
+            self._running.pop(task_id, None)
+            self._cond.notify_all()
+
+    def position(self, task_id: str) -> Optional[int]:
+        """Позиция задачи в очереди (0 — следующая); None — если она уже запущена или неизвестна."""
+        return self.store.position(task_id)
+
+    def _estimator(self) -> Callable[[dict], Optional[float]]:
+        rates, durations = [], []
+        for t in self.store.recent_done():
+            elapsed = t['finished_at'] - t['started_at']
+            durations.append(elapsed)
+            if t['video_s'] > 0:
+                rates.append(elapsed / t['video_s'])
+        rate = sum(rates) / len(rates) if rates else None
+        avg = sum(durations) / len(durations) if durations else None
+        return lambda t: rate * t['video_s'] if rate is not None and t['video_s'] > 0 else avg
+
+    def eta(self, task_id: str) -> Optional[float]:
+        """Оценка, через сколько секунд задача завершится; None — пока нет истории или задача не ждёт/не идёт."""
+        estimate, now = self._estimator(), time.time()
+        running = self.store.running()
+        # свободные моменты воркеров хоста: остаток запущенных задач, для простаивающих — 0
+        free = []
+        for t in running:
+            est = estimate(t)
+            if est is None:
+                return None
+            left = max(0.0, est - (now - t['started_at']))
+            if t['task_id'] == task_id:
+                return left
+            free.append(left)
+        ahead = self.store.queue_ahead(task_id)
+        if not ahead:
+            return None
+        free += [0.0] * (self.workers - len(free))
+        heapq.heapify(free)
+        finish = None
+        for t in ahead:
+            est = estimate(t)
+            if est is None:
+                return None
+            finish = heapq.heappop(free) + est
+            heapq.heappush(free, finish)
+        return finish
+
+    def stats(self) -> dict:
+        with self._cond:
+            local = len(self._running)
+        return {"workers": self.workers, "running_here": local, **self.store.counts()}
+
+    def shutdown(self, wait: bool = True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            pool = self._pool
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+        if self._updates is not None:
+            self._updates.put(None)
@@ -0,0 +1,233 @@
+# stream.py
+# Источники живого видео для process_stream (main.py): RTSP/HTTP/pipe/камера, локальный файл в темпе камеры
+# и синтетический генератор кадров (тесты, стенд без камеры).
+#
+# LiveCapture читает источник в фоновом потоке без остановки, как камера отдаёт кадры, и держит короткую
+# очередь. Потребитель (цикл инференса) берёт кадры по порядку; если он отстал и кадр старше max_lag_sec —
+# кадр выбрасывается. Так задержка от камеры до события ограничена, а не растёт с каждой минутой.
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+import cv2
+import numpy as np
+
+
+class SyntheticSource:
+    """
+    Генератор кадров с интерфейсом cv2.VideoCapture (read/get/release): однотонный кадр со значением
+    пикселя idx % 256 и движущимся квадратом, в темпе fps (realtime) или так быстро, как читают.
+    frames=None — бесконечный поток.
+    """
+
+    def __init__(self, width: int = 320, height: int = 240, fps: float = 25.0, frames: Optional[int] = None,
+                 realtime: bool = True):
+        self.shape = (height, width, 3)
+        self.fps = fps
+        self.frames = frames
+        self.realtime = realtime
+        self.idx = 0
+        self._t0 = None
+
+    def read(self, image: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        if self.frames is not None and self.idx >= self.frames:
+            return False, None
+        if self.realtime:
+            if self._t0 is None:
+                self._t0 = time.monotonic()
+            delay = self._t0 + self.idx / self.fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        if image is None or image.shape != self.shape:
+            image = np.empty(self.shape, dtype=np.uint8)
+        image[...] = self.idx % 256
+        h, w = self.shape[:2]
+        x = (self.idx * 4) % max(1, w - 32)
+        image[h // 2 - 16:h // 2 + 16, x:x + 32] = 255
+        self.idx += 1
+        return True, image
+
+    def get(self, prop) -> float:
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return 0.0
+        return 0.0
+
+    def isOpened(self) -> bool:
+        return True
+
+    def release(self):
+        pass
+
+
+def open_source(source: str):
+    """
+    synthetic://[WxH@FPS] — генератор; число — индекс камеры; существующий файл — как есть
+    (LiveCapture проигрывает его в темпе fps); остальное (rtsp://, http://, pipe/FIFO) — cv2 через FFmpeg.
+    """
+    if source.startswith('synthetic://'):
+        spec = source[len('synthetic://'):]
+        width, height, fps = 320, 240, 25.0
+        if spec:
+            size, _, rate = spec.partition('@')
+            if size:
+                width, height = (int(v) for v in size.lower().split('x'))
+            if rate:
+                fps = float(rate)
+        return SyntheticSource(width, height, fps)
+    if source.isdigit():
+        return cv2.VideoCapture(int(source))
+    if os.path.exists(source) and not os.path.isfile(source):
+        # именованный канал (mkfifo) — читаем через FFmpeg как поток
+        return cv2.VideoCapture(source, cv2.CAP_FFMPEG)
+    if os.path.isfile(source):
+        return cv2.VideoCapture(source)
+    return cv2.VideoCapture(source, cv2.CAP_FFMPEG)
+
+
+def resolve_client_source(source: str, cameras: Dict[str, str], schemes: Iterable[str],
+                          hosts: Iterable[str]) -> str:
+    """
+    Источник из запроса API: id камеры из cameras (-> её URL), synthetic:// или URL со схемой из schemes
+    и хостом из hosts. Локальные файлы, устройства и прочие протоколы FFmpeg клиенту недоступны —
+    иначе через поток можно читать файлы сервера и ходить на внутренние адреса. ValueError — если нельзя.
+    """
+    if source in cameras:
+        return cameras[source]
+    if source.startswith('synthetic://'):
+        return source
+    url = urlparse(source)
+    if url.scheme.lower() not in set(schemes):
+        raise ValueError(f"stream source must be a configured camera id or a {'/'.join(schemes)} URL")
+    if (url.hostname or '').lower() not in {h.lower() for h in hosts}:
+        raise ValueError(f"stream host {url.hostname!r} is not in the allowed list")
+    return source
+
+
+class LiveCapture:
+    """
+    Фоновое чтение живого источника. read(image) совместим с cv2.VideoCapture, так что
+    FrameRingBuffer.read(cap) работает без изменений; capture_ts — время (monotonic) захвата
+    последнего отданного кадра.
+
+    Кадры теряются намеренно в двух местах (счётчики dropped_queue / dropped_lag):
+    - очередь из max_queue кадров переполнена — вытесняется самый старый;
+    - при выдаче кадр старше max_lag_sec — пропускается, потребитель получает более свежий.
+    Файл (pace=True) проигрывается в темпе своего fps — как камера, для проверки на стенде.
+    Если источник оборвался, делается до reconnect_tries переподключений (open_fn(source)).
+    Источник (cap) принадлежит потоку чтения: переподключает и закрывает его только он, release() лишь
+    останавливает поток — так закрытие из другого потока не гоняется с чтением и переоткрытием.
+    """
+
+    def __init__(self, source, max_queue: int = 64, max_lag_sec: float = 2.0, pace: Optional[bool] = None,
+                 reconnect_tries: int = 0, reconnect_sec: float = 5.0, open_fn=open_source):
+        self.source = source
+        self.open_fn = open_fn
+        self.cap = open_fn(source) if isinstance(source, str) else source
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 25.0
+        if pace is None:
+            pace = isinstance(source, str) and os.path.isfile(source)
+        self.pace = pace
+        self.max_lag_sec = max_lag_sec
+        self.reconnect_tries = reconnect_tries
+        self.reconnect_sec = reconnect_sec
+        self.captured = 0
+        self.dropped_queue = 0
+        self.dropped_lag = 0
+        self.capture_ts = 0.0
+        self._frames: "deque[Tuple[np.ndarray, float]]" = deque()
+        self._max_queue = max(1, int(max_queue))
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._eof = False
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._reader, name='live-capture', daemon=True)
+        self._thread.start()
+
+    def _reader(self):
+        t0 = time.monotonic()
+        n = 0
+        tries = 0
+        try:
+            while not self._stop.is_set():
+                ret, frame = self.cap.read()
+                if not ret:
+                    if tries >= self.reconnect_tries or not isinstance(self.source, str):
+                        break
+                    tries += 1
+                    print(f"[STREAM] source lost, reconnect {tries}/{self.reconnect_tries} in {self.reconnect_sec}s")
+                    if self._stop.wait(self.reconnect_sec):
+                        break
+                    self.cap.release()
+                    self.cap = self.open_fn(self.source)
+                    continue
+                tries = 0
+                if self.pace:
+                    delay = t0 + n / self.fps - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    n += 1
+                ts = time.monotonic()
+                with self._cond:
+                    if len(self._frames) >= self._max_queue:
+                        self._frames.popleft()
+                        self.dropped_queue += 1
+                    self._frames.append((frame, ts))
+                    self.captured += 1
+                    self._cond.notify()
+        except BaseException as e:
+            self._error = e
+        finally:
+            self.cap.release()
+            with self._cond:
+                self._eof = True
+                self._cond.notify_all()
+
+    def read(self, image: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        """Следующий достаточно свежий кадр (блокирует до его появления); (False, None) — поток закончился."""
+        with self._cond:
+            while True:
+                while not self._frames and not self._eof:
+                    self._cond.wait(0.5)
+                if not self._frames:
+                    if self._error is not None:
+                        raise self._error
+                    return False, None
+                frame, ts = self._frames.popleft()
+                if self.max_lag_sec and self._frames and time.monotonic() - ts > self.max_lag_sec:
+                    # отстали от реального времени — этот кадр уже не нужен, есть более свежие
+                    self.dropped_lag += 1
+                    continue
+                break
+        self.capture_ts = ts
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame
+
+    def get(self, prop) -> float:
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0.0
+
+    @property
+    def dropped(self) -> int:
+        return self.dropped_queue + self.dropped_lag
+
+    @property
+    def queued(self) -> int:
+        return len(self._frames)
+
+    def release(self):
+        self._stop.set()
+        with self._cond:
+            self._frames.clear()
+        self._thread.join(timeout=5.0)
+        if self._thread.is_alive():
+            # поток висит в cap.read(); источник он закроет сам, когда чтение вернётся
+            print("[STREAM] capture thread is still reading, source will be closed when it returns")
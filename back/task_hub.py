@@ -0,0 +1,138 @@
+# task_hub.py
+# Pub/sub прогресса задач для WebSocket: воркеры публикуют прогресс и финализированные события,
+# хаб хранит по задаче последнее состояние и раздаёт его всем подписчикам. Сообщение уходит только
+# при изменении и не чаще min_interval_s на клиента (изменения за это время сливаются в одно),
+# медленный клиент не задерживает остальных — у каждого своя корутина.
+
+import asyncio
+import threading
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, Optional, Set
+
+from config import WS_MIN_INTERVAL_SEC, WS_REFRESH_SEC, WS_EVENT_BACKLOG
+
+FINAL_STATUSES = ("done", "error")
+
+
+class _Subscriber:
+    __slots__ = ('changed', 'event_seq')
+
+    def __init__(self):
+        self.changed = asyncio.Event()
+        self.event_seq = 0  # последнее отданное событие
+
+
+class _Topic:
+    def __init__(self, backlog: int):
+        self.task: Optional[dict] = None       # строка TaskStore
+        self.progress: Optional[dict] = None   # последний прогресс от воркера
+        self.events: "deque[tuple]" = deque(maxlen=backlog)  # (seq, событие) — для подключившихся позже
+        self.event_seq = 0
+        self.subscribers: Set[_Subscriber] = set()
+        self.watcher: Optional[asyncio.Task] = None
+
+
+class TaskHub:
+    """
+    publish(task_id, msg) — из любого потока: {"type": "progress", ...}, {"type": "event", ...}
+    или {"type": "task", "task": <строка TaskStore>}.
+    subscribe(task_id) — асинхронный итератор сообщений для клиента: строка задачи (как раньше отдавал
+    /ws/tasks) + "progress" + "events" (новые с прошлого сообщения).
+    Пока у задачи есть подписчики и она не завершена, хаб раз в refresh_sec перечитывает строку через
+    loader — так видны изменения, сделанные другими процессами API (позиция в очереди, статус).
+    """
+
+    def __init__(self, loader: Callable[[str], Optional[dict]], min_interval_s: float = WS_MIN_INTERVAL_SEC,
+                 refresh_sec: float = WS_REFRESH_SEC, backlog: int = WS_EVENT_BACKLOG):
+        self.loader = loader
+        self.min_interval_s = min_interval_s
+        self.refresh_sec = refresh_sec
+        self.backlog = backlog
+        self._topics: Dict[str, _Topic] = {}
+        self._finished: "deque[str]" = deque(maxlen=1024)  # запоздавший прогресс завершённых задач не нужен
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def publish(self, task_id: str, msg: dict):
+        kind = msg.get("type")
+        with self._lock:
+            topic = self._topics.get(task_id)
+            if topic is None:
+                if kind not in ("progress", "event") or task_id in self._finished:
+                    return
+                topic = self._topics[task_id] = _Topic(self.backlog)
+            if kind == "progress":
+                topic.progress = {k: v for k, v in msg.items() if k != "type"}
+            elif kind == "event":
+                topic.event_seq += 1
+                topic.events.append((topic.event_seq, {k: v for k, v in msg.items() if k != "type"}))
+            elif kind == "task":
+                if msg.get("task") == topic.task:
+                    return
+                topic.task = msg.get("task")
+                if (topic.task or {}).get("status") in FINAL_STATUSES:
+                    self._finished.append(task_id)
+                    if not topic.subscribers:
+                        del self._topics[task_id]
+                        return
+            subscribers = list(topic.subscribers)
+        self._notify(subscribers)
+
+    def _notify(self, subscribers):
+        loop = self._loop
+        if loop is None or not subscribers:
+            return
+        try:
+            same_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            same_loop = False
+        for sub in subscribers:
+            if same_loop:
+                sub.changed.set()
+            else:
+                loop.call_soon_threadsafe(sub.changed.set)
+
+    def _message(self, topic: _Topic, sub: _Subscriber) -> dict:
+        with self._lock:
+            events = [ev for seq, ev in topic.events if seq > sub.event_seq]
+            sub.event_seq = topic.event_seq
+            return {**(topic.task or {"status": "not_found"}), "progress": topic.progress, "events": events}
+
+    async def subscribe(self, task_id: str) -> AsyncIterator[dict]:
+        self._loop = asyncio.get_running_loop()
+        sub = _Subscriber()
+        with self._lock:
+            topic = self._topics.setdefault(task_id, _Topic(self.backlog))
+            topic.subscribers.add(sub)
+            if topic.watcher is None:
+                topic.watcher = asyncio.create_task(self._watch(task_id, topic))
+        try:
+            task = await asyncio.to_thread(self.loader, task_id)
+            with self._lock:
+                topic.task = task
+            # новый клиент сразу получает текущее состояние и недавние события (до backlog штук)
+            yield self._message(topic, sub)
+            while True:
+                await sub.changed.wait()
+                sub.changed.clear()
+                yield self._message(topic, sub)
+                # всё, что придёт за это время, уйдёт одним сообщением
+                await asyncio.sleep(self.min_interval_s)
+        finally:
+            with self._lock:
+                topic.subscribers.discard(sub)
+                if not topic.subscribers:
+                    if topic.watcher is not None:
+                        topic.watcher.cancel()
+                        topic.watcher = None
+                    if (topic.task or {}).get("status") in FINAL_STATUSES and self._topics.get(task_id) is topic:
+                        del self._topics[task_id]
+
+    async def _watch(self, task_id: str, topic: _Topic):
+        while (topic.task or {}).get("status") not in FINAL_STATUSES:
+            await asyncio.sleep(self.refresh_sec)
+            self.publish(task_id, {"type": "task", "task": await asyncio.to_thread(self.loader, task_id)})
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"topics": len(self._topics), "subscribers": sum(len(t.subscribers) for t in self._topics.values())}
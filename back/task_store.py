@@ -0,0 +1,224 @@
+# task_store.py
+# Долговременное хранилище задач обработки в SQLite (WAL): его видят все процессы uvicorn (--workers N),
+# а перезапуск не теряет ни очередь, ни задачи, прерванные посреди обработки.
+# Переходы состояний атомарны: queued -> running -> done|error, running -> queued (повтор после сбоя).
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import List, Optional
+
+from config import TASK_STORE_PATH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,  -- порядок постановки (FIFO внутри приоритета)
+    task_id TEXT NOT NULL UNIQUE,
+    status TEXT NOT NULL,                   -- queued | running | done | error
+    priority INTEGER NOT NULL DEFAULT 0,
+    video TEXT,
+    out_dir TEXT,
+    params TEXT,                            -- JSON запроса
+    job TEXT,                               -- JSON аргументов задачи воркера
+    video_s REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    message TEXT,
+    owner TEXT,                             -- host:pid процесса API, который выполняет задачу
+    heartbeat REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cache_key TEXT                          -- ключ кэша результатов (result_cache), если задача кэшируется
+);
+CREATE INDEX IF NOT EXISTS tasks_queue ON tasks (status, priority DESC, seq);
+"""
+
+PUBLIC_FIELDS = ('task_id', 'status', 'priority', 'video', 'out_dir', 'params', 'video_s', 'created_at', 'started_at',
+                 'finished_at', 'message', 'attempts', 'cache_key')
+
+
+class QueueFullError(RuntimeError):
+    """В очереди уже максимум задач — новая не принята."""
+
+
+def owner_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def owner_host(owner: str) -> str:
+    """Хост из owner_id ("host:pid")."""
+    return owner.rsplit(':', 1)[0]
+
+
+class TaskStore:
+    """
+    Все изменения состояния — одним UPDATE с условием на текущий статус (или в транзакции BEGIN IMMEDIATE,
+    если нужно сначала посчитать очередь), поэтому два процесса API не возьмут одну задачу дважды.
+    """
+
+    def __init__(self, path: str = TASK_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        # хранилища, созданные до появления колонки cache_key
+        if 'cache_key' not in {r['name'] for r in conn.execute("PRAGMA table_info(tasks)")}:
+            conn.execute("ALTER TABLE tasks ADD COLUMN cache_key TEXT")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: транзакции открываем явно (BEGIN IMMEDIATE берёт блокировку записи сразу)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _write(self):
+        return _Immediate(self._conn())
+
+    def create(self, task_id: str, video: str, out_dir: str, params: dict, job: dict, priority: int = 0,
+               video_s: float = 0.0, max_queue: Optional[int] = None, cache_key: Optional[str] = None) -> int:
+        """Ставит задачу в очередь (QueueFullError, если очередь полна). Возвращает её позицию."""
+        with self._write() as conn:
+            if max_queue is not None:
+                queued = conn.execute("SELECT COUNT(*) FROM tasks WHERE status = 'queued'").fetchone()[0]
+                if queued >= max_queue:
+                    raise QueueFullError(f"queue is full ({max_queue} tasks)")
+            conn.execute("INSERT INTO tasks (task_id, status, priority, video, out_dir, params, job, video_s, created_at,"
+                         " cache_key) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (task_id, int(priority), video, out_dir, json.dumps(params), json.dumps(job), video_s,
+                          time.time(), cache_key))
+        return self.position(task_id)
+
+    def create_done(self, task_id: str, video: str, out_dir: str, params: dict, message: str,
+                    cache_key: Optional[str] = None):
+        """Задача, результат которой уже есть (попадание в кэш): сразу в статусе done."""
+        now = time.time()
+        self._conn().execute("INSERT INTO tasks (task_id, status, video, out_dir, params, created_at, started_at,"
+                             " finished_at, message, cache_key) VALUES (?, 'done', ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (task_id, video, out_dir, json.dumps(params), now, now, now, message, cache_key))
+
+    def get(self, task_id: str) -> Optional[dict]:
+        row = self._conn().execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return _public(row) if row else None
+
+    def claim(self, owner: str, max_running: int) -> Optional[dict]:
+        """Берёт следующую задачу очереди (queued -> running), если на хосте owner (все его процессы API)
+        запущено меньше max_running. Возвращает задачу с полем job (аргументы воркера) или None."""
+        now = time.time()
+        host = owner_host(owner)
+        with self._write() as conn:
+            running = conn.execute("SELECT COUNT(*) FROM tasks WHERE status = 'running'"
+                                   " AND (owner = ? OR substr(owner, 1, ?) = ?)",
+                                   (host, len(host) + 1, host + ':')).fetchone()[0]
+            if running >= max_running:
+                return None
+            row = conn.execute("SELECT * FROM tasks WHERE status = 'queued' ORDER BY priority DESC, seq LIMIT 1"
+                               ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE tasks SET status = 'running', owner = ?, started_at = ?, heartbeat = ?,"
+                         " attempts = attempts + 1, message = NULL WHERE seq = ?", (owner, now, now, row['seq']))
+        task = _public(row)
+        task.update(status='running', started_at=now, attempts=row['attempts'] + 1, message=None,
+                    job=json.loads(row['job'] or '{}'))
+        return task
+
+    def finish(self, task_id: str, owner: str, error: Optional[str] = None) -> bool:
+        """running -> done|error. False — если задача уже не наша (например, её перезапустили после таймаута)."""
+        cur = self._conn().execute(
+            "UPDATE tasks SET status = ?, finished_at = ?, message = ?, heartbeat = NULL"
+            " WHERE task_id = ? AND status = 'running' AND owner = ?",
+            ('error' if error is not None else 'done', time.time(), error if error is not None else 'processed',
+             task_id, owner))
+        return cur.rowcount == 1
+
+    def release(self, task_id: str, owner: str) -> bool:
+        """running -> queued для задачи, которую владелец взял, но так и не запустил (попытка не считается)."""
+        cur = self._conn().execute(
+            "UPDATE tasks SET status = 'queued', owner = NULL, started_at = NULL, heartbeat = NULL,"
+            " attempts = MAX(attempts - 1, 0) WHERE task_id = ? AND status = 'running' AND owner = ?",
+            (task_id, owner))
+        return cur.rowcount == 1
+
+    def heartbeat(self, owner: str):
+        self._conn().execute("UPDATE tasks SET heartbeat = ? WHERE status = 'running' AND owner = ?",
+                             (time.time(), owner))
+
+    def requeue_stale(self, stale_sec: float, max_attempts: int) -> List[str]:
+        """Задачи running без heartbeat дольше stale_sec (процесс API упал/перезапущен) возвращаются в очередь;
+        после max_attempts попыток — в error. Возвращает id перезапущенных задач."""
+        limit = time.time() - stale_sec
+        with self._write() as conn:
+            rows = conn.execute("SELECT task_id, attempts FROM tasks WHERE status = 'running' AND heartbeat < ?",
+                                (limit,)).fetchall()
+            requeued = []
+            for r in rows:
+                if r['attempts'] >= max_attempts:
+                    conn.execute("UPDATE tasks SET status = 'error', finished_at = ?, owner = NULL,"
+                                 " message = 'interrupted too many times' WHERE task_id = ?",
+                                 (time.time(), r['task_id']))
+                else:
+                    conn.execute("UPDATE tasks SET status = 'queued', owner = NULL, started_at = NULL,"
+                                 " heartbeat = NULL, message = 'requeued after interruption' WHERE task_id = ?",
+                                 (r['task_id'],))
+                    requeued.append(r['task_id'])
+        return requeued
+
+    def position(self, task_id: str) -> Optional[int]:
+        """Позиция задачи в очереди (0 — следующая) или None, если она не в очереди."""
+        conn = self._conn()
+        row = conn.execute("SELECT priority, seq FROM tasks WHERE task_id = ? AND status = 'queued'",
+                           (task_id,)).fetchone()
+        if row is None:
+            return None
+        return conn.execute("SELECT COUNT(*) FROM tasks WHERE status = 'queued' AND"
+                            " (priority > ? OR (priority = ? AND seq < ?))",
+                            (row['priority'], row['priority'], row['seq'])).fetchone()[0]
+
+    def queue_ahead(self, task_id: str) -> List[dict]:
+        """Задачи очереди до task_id включительно, в порядке запуска (для оценки ETA)."""
+        pos = self.position(task_id)
+        if pos is None:
+            return []
+        rows = self._conn().execute("SELECT * FROM tasks WHERE status = 'queued' ORDER BY priority DESC, seq"
+                                    " LIMIT ?", (pos + 1,)).fetchall()
+        return [_public(r) for r in rows]
+
+    def running(self) -> List[dict]:
+        return [_public(r) for r in self._conn().execute("SELECT * FROM tasks WHERE status = 'running'")]
+
+    def recent_done(self, limit: int = 20) -> List[dict]:
+        return [_public(r) for r in self._conn().execute(
+            "SELECT * FROM tasks WHERE status = 'done' ORDER BY finished_at DESC LIMIT ?", (limit,))]
+
+    def counts(self) -> dict:
+        return {r[0]: r[1] for r in self._conn().execute("SELECT status, COUNT(*) FROM tasks GROUP BY status")}
+
+
+class _Immediate:
+    """Транзакция BEGIN IMMEDIATE: блокировка записи берётся сразу, проверка и изменение атомарны."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+def _public(row: sqlite3.Row) -> dict:
+    d = {k: row[k] for k in PUBLIC_FIELDS}
+    d['params'] = json.loads(d['params'] or '{}')
+    return d
@@ -0,0 +1,37 @@
+import pytest
+
+
+@pytest.fixture
+def write_result():
+    """Пишет в task_dir отчёт задачи с n событиями (как ReportSink в конце обработки)."""
+    from detector import DetectionStore, ViolationEvent
+    from reports import ReportSink
+
+    def write(task_dir, n, formats=("csv",)):
+        events = [ViolationEvent(id=i + 1, class_names=["no_glove"] if i % 2 else ["no_head", "floor"], confs=[0.9],
+                                 bbox=(i, i, i + 10, i + 10), frame_idx=i * 10, time_s=i * 2.0,
+                                 clip_path=f"{task_dir}/clips/e{i + 1}.mp4", saved=True) for i in range(n)]
+        ReportSink(str(task_dir), formats=formats).close(DetectionStore(), events)
+    return write
+
+
+@pytest.fixture
+def api_stores(tmp_path, monkeypatch):
+    """API с хранилищами задач, кэшем результатов и индексом событий в tmp_path.
+    Планировщик не запущен: задачи остаются в очереди, процессы воркеров не создаются."""
+    import api
+    from event_index import EventIndex
+    from result_cache import ResultCache
+    from scheduler import Scheduler
+    from task_store import TaskStore
+
+    out = tmp_path / "results"
+    out.mkdir()
+    store = TaskStore(str(out / "tasks.sqlite"))
+    index = EventIndex(str(out / "events_index.sqlite"))
+    monkeypatch.setattr(api, "OUTPUT_DIR", str(out))
+    monkeypatch.setattr(api, "task_store", store)
+    monkeypatch.setattr(api, "event_index", index)
+    monkeypatch.setattr(api, "result_cache", ResultCache(str(out / "result_cache.sqlite"), on_evict=index.remove_task))
+    monkeypatch.setattr(api, "scheduler", Scheduler(store, api.run_job))
+    return api
@@ -1,94 +1,227 @@
-# tests/test_api.py
-import os
-import tempfile
-import uuid
-from pathlib import Path
-from fastapi.testclient import TestClient
-import pytest
-
-# Импортируем ваше приложение
-from api import app, UPLOAD_DIR, OUTPUT_DIR
-
-client = TestClient(app)
-
-# Убедимся, что директории существуют
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-
-def create_dummy_video():
-    """Создаём минимальный MP4-файл (заглушку) для тестов."""
-    # Это не настоящий видеофайл, но для проверки загрузки подойдёт
-    return b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom\x00\x00\x02\x00"
-
-@pytest.fixture
-def dummy_video():
-    return create_dummy_video()
-
-
-def test_upload_video(dummy_video):
-    """Тест: загрузка видео"""
-    files = {"file": ("test.mp4", dummy_video, "video/mp4")}
-    response = client.post("/videos/upload", files=files)
-    assert response.status_code == 200
-    data = response.json()
-    assert "video_id" in data
-    assert "path" in data
-    assert os.path.exists(data["path"])
-
-
-def test_start_process_without_video():
-    """Тест: запуск обработки без указания видео → ошибка"""
-    response = client.post("/process/start", json={})
-    assert response.status_code == 400
-    assert "detail" in response.json()
-
-
-def test_full_workflow(dummy_video):
-    """Тест: полный цикл — загрузка → запуск → статус → клипы"""
-    # 1. Загрузка
-    files = {"file": ("test.mp4", dummy_video, "video/mp4")}
-    upload_resp = client.post("/videos/upload", files=files)
-    assert upload_resp.status_code == 200
-    video_id = upload_resp.json()["video_id"]
-
-    # 2. Запуск обработки
-    start_resp = client.post("/process/start", json={"video_id": video_id})
-    assert start_resp.status_code == 200
-    task_data = start_resp.json()
-    task_id = task_data["task_id"]
-    assert task_data["status"] == "queued"
-
-    # 3. Проверка статуса
-    status_resp = client.get(f"/process/{task_id}")
-    assert status_resp.status_code == 200
-    assert status_resp.json()["task_id"] == task_id
-
-    # 4. Попытка получить клипы (даже если папка пуста — не ошибка)
-    clips_resp = client.get(f"/process/{task_id}/clips")
-    assert clips_resp.status_code == 200
-    assert isinstance(clips_resp.json(), list)
-
-
-def test_list_events():
-    """Тест: получение списка событий (даже если их нет)"""
-    response = client.get("/events")
-    assert response.status_code == 200
-    assert isinstance(response.json(), list)
-
-
-def test_health_check():
-    """Тест: эндпоинт здоровья"""
-    response = client.get("/health")
-    assert response.status_code == 200
-    assert "status" in response.json()
-    assert response.json()["status"] == "ok"
-
-
-def test_static_files_mount():
-    """Тест: проверка, что /static смонтирован (без реального файла)"""
-    # Просто убедимся, что маршрут существует
-    response = client.get("/static/nonexistent.txt")
-    # Должен вернуть 404, но не 404 от FastAPI (а от StaticFiles)
-    # Важно: не должно быть 404 от маршрутизации (т.е. маршрут найден)
-    assert response.status_code in (404, 200)  # 200 если файл есть, 404 если нет — но не 404 "Not Found" от маршрутов
\ No newline at end of file
+# tests/test_api.py
+import os
+import tempfile
+import uuid
+from pathlib import Path
+from fastapi.testclient import TestClient
+import pytest
+
+# Импортируем ваше приложение
+from api import app, UPLOAD_DIR, OUTPUT_DIR
+
+client = TestClient(app)
+
+# Убедимся, что директории существуют
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+
+def create_dummy_video():
+    """Создаём минимальный MP4-файл (заглушку) для тестов."""
+    # Это не настоящий видеофайл, но для проверки загрузки подойдёт
+    return b"\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom\x00\x00\x02\x00"
+
+@pytest.fixture
+def dummy_video():
+    return create_dummy_video()
+
+
+def test_upload_video(dummy_video):
+    """Тест: загрузка видео"""
+    files = {"file": ("test.mp4", dummy_video, "video/mp4")}
+    response = client.post("/videos/upload", files=files)
+    assert response.status_code == 200
+    data = response.json()
+    assert "video_id" in data
+    assert "path" in data
+    assert os.path.exists(data["path"])
+
+
+def test_start_process_without_video():
+    """Тест: запуск обработки без указания видео → ошибка"""
+    response = client.post("/process/start", json={})
+    assert response.status_code == 400
+    assert "detail" in response.json()
+
+
+def test_full_workflow(dummy_video, api_stores):
+    """Тест: полный цикл — загрузка → запуск → статус → клипы"""
+    # 1. Загрузка
+    files = {"file": ("test.mp4", dummy_video, "video/mp4")}
+    upload_resp = client.post("/videos/upload", files=files)
+    assert upload_resp.status_code == 200
+    video_id = upload_resp.json()["video_id"]
+
+    # 2. Запуск обработки
+    start_resp = client.post("/process/start", json={"video_id": video_id})
+    assert start_resp.status_code == 200
+    task_data = start_resp.json()
+    task_id = task_data["task_id"]
+    assert task_data["status"] == "queued"
+
+    # 3. Проверка статуса
+    status_resp = client.get(f"/process/{task_id}")
+    assert status_resp.status_code == 200
+    assert status_resp.json()["task_id"] == task_id
+
+    # 4. Попытка получить клипы (даже если папка пуста — не ошибка)
+    clips_resp = client.get(f"/process/{task_id}/clips")
+    assert clips_resp.status_code == 200
+    assert isinstance(clips_resp.json(), list)
+
+
+def test_list_events():
+    """Тест: получение списка событий (даже если их нет)"""
+    response = client.get("/events")
+    assert response.status_code == 200
+    assert isinstance(response.json(), list)
+
+
+def test_health_check():
+    """Тест: эндпоинт здоровья"""
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert "status" in response.json()
+    assert response.json()["status"] == "ok"
+
+
+def test_static_files_mount():
+    """Тест: проверка, что /static смонтирован (без реального файла)"""
+    # Просто убедимся, что маршрут существует
+    response = client.get("/static/nonexistent.txt")
+    # Должен вернуть 404, но не 404 от FastAPI (а от StaticFiles)
+    # Важно: не должно быть 404 от маршрутизации (т.е. маршрут найден)
+    assert response.status_code in (404, 200)  # 200 если файл есть, 404 если нет — но не 404 "Not Found" от маршрутов
+
+
+def test_events_from_index(tmp_path, monkeypatch, write_result):
+    """Тест: /events читает индекс — фильтры, пагинация по after, событие и его клип по глобальному id"""
+    import api
+    from event_index import EventIndex
+
+    write_result(tmp_path / "task_x", 3)
+    index = EventIndex(str(tmp_path / "index.sqlite"))
+    index.index_task("task_x", str(tmp_path / "task_x"))
+    monkeypatch.setattr(api, "event_index", index)
+
+    first = client.get("/events", params={"limit": 2}).json()
+    assert [e["event_id"] for e in first] == [1, 2]
+    rest = client.get("/events", params={"after": first[-1]["id"]}).json()
+    assert [e["event_id"] for e in rest] == [3]
+    assert [e["event_id"] for e in client.get("/events", params={"class_name": "no_glove"}).json()] == [2]
+
+    ev = client.get(f"/events/{rest[0]['id']}")
+    assert ev.status_code == 200 and ev.json()["task"] == "task_x"
+    assert client.get(f"/events/{rest[0]['id']}/clip").status_code == 404  # клипа на диске нет
+    assert client.get("/events/999999").status_code == 404
+
+
+def test_upload_dedup_by_hash():
+    """Тест: одинаковое содержимое хранится один раз, video_id — по SHA-256"""
+    import hashlib
+    data = os.urandom(3000)
+    first = client.post("/videos/upload", files={"file": ("a.mp4", data, "video/mp4")}).json()
+    second = client.post("/videos/upload", files={"file": ("b.mp4", data, "video/mp4")}).json()
+    assert first["sha256"] == hashlib.sha256(data).hexdigest() and first["size"] == 3000
+    assert second["deduplicated"] and second["video_id"] == first["video_id"]
+    assert Path(first["path"]).read_bytes() == data
+
+
+def test_upload_dedup_across_processes(tmp_path):
+    """Тест: пока другой процесс API переносит файл с тем же содержимым, загрузка ждёт и дедуплицируется"""
+    import asyncio
+    import hashlib
+    from upload_store import DEDUP_LOCK, UploadStore, _file_lock
+    data = os.urandom(2000)
+    digest = hashlib.sha256(data).hexdigest()
+    store = UploadStore(str(tmp_path))
+
+    async def chunks():
+        yield data
+
+    async def main():
+        async with _file_lock(os.path.join(store.incoming, DEDUP_LOCK)):  # блокировку держит «другой процесс»
+            task = asyncio.create_task(store.save(chunks(), "b.avi"))
+            await asyncio.sleep(0.2)
+            assert not task.done()
+            (tmp_path / f"{digest}.mp4").write_bytes(data)  # его результат
+        return await asyncio.wait_for(task, timeout=5)
+
+    res = asyncio.run(main())
+    assert res["deduplicated"] and res["video_id"] == f"{digest}.mp4"
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_file()) == [f"{digest}.mp4"]
+
+
+def test_resumable_upload():
+    """Тест: докачка по смещению, 409 при неверном offset, хэш после «перезапуска» досчитывается"""
+    import api
+    import hashlib
+    data = os.urandom(10_000)
+    up = client.post("/videos/uploads", json={"filename": "shift.avi", "size": len(data)}).json()
+    url = f"/videos/uploads/{up['upload_id']}"
+    assert client.patch(url, params={"offset": 0}, content=data[:4000]).json()["offset"] == 4000
+    bad = client.patch(url, params={"offset": 0}, content=data[:10])
+    assert bad.status_code == 409 and bad.json()["detail"]["offset"] == 4000
+    incomplete = client.post(url + "/complete")  # ещё не всё докачано: продолжать с принятого смещения
+    assert incomplete.status_code == 409 and incomplete.json()["detail"]["offset"] == 4000
+    assert incomplete.json()["detail"]["size"] == len(data)
+
+    api.upload_store._hashers.clear()  # как будто продолжаем в другом процессе API
+    assert client.get(url).json()["offset"] == 4000
+    client.patch(url, params={"offset": 4000}, content=data[4000:])
+    done = client.post(url + "/complete").json()
+    assert done["sha256"] == hashlib.sha256(data).hexdigest() and done["video_id"].endswith(".avi")
+    assert Path(done["path"]).read_bytes() == data
+    assert client.get(url).status_code == 404
+
+
+def test_resumable_upload_overshoot():
+    """Тест: данные сверх заявленного size не пишутся — 413, принятое до size остаётся и загрузка завершается"""
+    import hashlib
+    data = os.urandom(5000)
+    up = client.post("/videos/uploads", json={"filename": "over.mp4", "size": 3000}).json()
+    url = f"/videos/uploads/{up['upload_id']}"
+    assert client.patch(url, params={"offset": 0}, content=data[:2000]).json()["offset"] == 2000
+    over = client.patch(url, params={"offset": 2000}, content=data[2000:])
+    assert over.status_code == 413
+    assert over.json()["detail"]["offset"] == 3000 and over.json()["detail"]["size"] == 3000
+    assert client.get(url).json()["offset"] == 3000
+    done = client.post(url + "/complete").json()
+    assert done["size"] == 3000 and done["sha256"] == hashlib.sha256(data[:3000]).hexdigest()
+
+
+def test_start_process_cache_hit(tmp_path, api_stores):
+    """Тест: то же видео с теми же настройками сразу получает готовый результат из кэша"""
+    api = api_stores
+    data = os.urandom(2000)
+    video_id = client.post("/videos/upload", files={"file": ("c.mp4", data, "video/mp4")}).json()["video_id"]
+    req = {"video_id": video_id, "conf": 0.6}
+    key = api.result_cache.key(os.path.join(UPLOAD_DIR, video_id), api.MODEL_PATH,
+                               api.StartProcessRequest(**req).model_dump())
+    out_dir = tmp_path / "task_cached"
+    out_dir.mkdir()
+    api.result_cache.put(key, "earlier", str(out_dir))
+
+    resp = client.post("/process/start", json={**req, "batch_size": 4})  # batch_size на результат не влияет
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["status"] == "done" and body["out_dir"] == str(out_dir) and "earlier" in body["message"]
+    assert client.get(f"/process/{body['task_id']}").json()["status"] == "done"
+    miss = client.post("/process/start", json={**req, "use_cache": False}).json()
+    assert miss["status"] == "queued"  # в очереди tmp-хранилища; планировщик не запущен
+    assert api.task_store.get(miss["task_id"])["out_dir"].startswith(api.OUTPUT_DIR)
+
+
+def test_replay_requires_raw_cache():
+    """Тест: replay без сохранённых сырых детекций для видео отклоняется"""
+    video_id = client.post("/videos/upload", files={"file": ("r.mp4", os.urandom(1500), "video/mp4")}).json()["video_id"]
+    resp = client.post("/process/start", json={"video_id": video_id, "replay": True, "use_cache": False})
+    assert resp.status_code == 400
+    assert "raw detections" in resp.json()["detail"]
+
+
+def test_stream_source_must_be_allowed():
+    """Тест: поток из локального файла или с неразрешённого хоста через API не запускается"""
+    for source in ("/etc/passwd", "rtsp://169.254.169.254/latest"):
+        resp = client.post("/streams/start", json={"source": source})
+        assert resp.status_code == 400
\ No newline at end of file
@@ -0,0 +1,132 @@
+import random
+
+import numpy as np
+
+from detector import Detection, DetectionStore, ViolationDetector, iou_matrix
+from utils import iou, union_bbox
+
+
+class ReferenceDetector:
+    """Исходный алгоритм: полный перебор всех событий от новых к старым."""
+
+    def __init__(self, merge_window_sec):
+        self.events = []
+        self.merge_window = merge_window_sec
+
+    def register_detection(self, det, current_s):
+        for ev in self.events[::-1]:
+            time_close = abs(ev["time_s"] - det.time_s) <= self.merge_window
+            same_frame = ev["frame_idx"] == det.frame_idx
+            if same_frame or (time_close and iou(ev["bbox"], det.bbox) > 0.1):
+                if det.class_name not in ev["class_names"]:
+                    ev["class_names"].append(det.class_name)
+                ev["confs"].append(det.conf)
+                ev["bbox"] = union_bbox(ev["bbox"], det.bbox)
+                if det.time_s < ev["time_s"]:
+                    ev["time_s"], ev["frame_idx"] = det.time_s, det.frame_idx
+                return False, ev
+        ev = {"id": len(self.events) + 1, "class_names": [det.class_name], "confs": [det.conf],
+              "bbox": det.bbox, "frame_idx": det.frame_idx, "time_s": det.time_s}
+        self.events.append(ev)
+        return True, ev
+
+
+def synthetic_frames(n_frames, seed=0, fps=5.0):
+    """Кадры с 0..3 детекциями: несколько «рабочих мест» с дрожанием bbox и случайные выбросы."""
+    rnd = random.Random(seed)
+    spots = [(rnd.randint(0, 1500), rnd.randint(0, 800)) for _ in range(6)]
+    for f in range(n_frames):
+        dets = []
+        for _ in range(rnd.choice([0, 0, 1, 1, 2, 3])):
+            x, y = rnd.choice(spots) if rnd.random() < 0.8 else (rnd.randint(0, 1800), rnd.randint(0, 1000))
+            x += rnd.randint(-20, 20)
+            y += rnd.randint(-20, 20)
+            w, h = rnd.randint(30, 200), rnd.randint(30, 200)
+            dets.append(Detection(class_name=rnd.choice(["no_glove", "no_head", "floor"]), conf=0.9,
+                                  bbox=(x, y, x + w, y + h), frame_idx=f, time_s=f / fps, wall_time=""))
+        yield dets
+
+
+def snapshot(events):
+    return [(e["id"], e["class_names"], e["confs"], e["bbox"], e["frame_idx"], e["time_s"]) if isinstance(e, dict)
+            else (e.id, e.class_names, e.confs, e.bbox, e.frame_idx, e.time_s) for e in events]
+
+
+def test_indexed_detector_matches_full_scan():
+    """Тест: индекс активных событий даёт те же события, что и полный перебор"""
+    ref, fast, batched = ReferenceDetector(10), ViolationDetector(10, grid_cell=64), ViolationDetector(10)
+    batched.FRAME_BATCH_MIN = 1
+    for dets in synthetic_frames(3000):
+        for d in dets:
+            a, b = ref.register_detection(d, d.time_s), fast.register_detection(d, d.time_s)
+            assert a[0] == b[0] and a[1]["id"] == b[1].id
+        res = batched.register_frame(dets, dets[0].time_s if dets else 0.0)
+        assert len(res) == len(dets)
+    assert snapshot(fast.events) == snapshot(ref.events)
+    assert snapshot(batched.events) == snapshot(ref.events)
+    assert len(fast._active) < len(fast.events)
+
+
+def test_out_of_order_detection_falls_back_to_full_scan():
+    """Тест: детекция из прошлого сливается с уже выбывшим из окна событием, как раньше"""
+    det = ViolationDetector(merge_window_sec=2)
+    det.register_detection(Detection("no_glove", 0.9, (0, 0, 10, 10), 0, 0.0, ""), 0.0)
+    det.register_detection(Detection("no_head", 0.9, (500, 500, 600, 600), 100, 20.0, ""), 20.0)
+    is_new, ev = det.register_detection(Detection("no_glove", 0.8, (1, 1, 11, 11), 5, 1.0, ""), 20.0)
+    assert not is_new and ev.id == 1
+
+
+def test_iou_matrix_matches_scalar_iou():
+    """Тест: векторная IoU совпадает с utils.iou"""
+    rnd = np.random.default_rng(0)
+    a = rnd.integers(0, 100, size=(7, 2))
+    a = np.hstack([a, a + rnd.integers(0, 50, size=(7, 2))])
+    b = rnd.integers(0, 100, size=(5, 2))
+    b = np.hstack([b, b + rnd.integers(0, 50, size=(5, 2))])
+    m = iou_matrix(a, b)
+    for i in range(7):
+        for j in range(5):
+            assert abs(m[i, j] - iou(tuple(a[i]), tuple(b[j]))) < 1e-9
+
+
+def test_pop_due_matches_full_scan():
+    """Тест: куча дедлайнов отдаёт те же события и на тех же кадрах, что и просмотр всех событий"""
+    heap_det, scan_det = ViolationDetector(10), ViolationDetector(10)
+    heap_log, scan_log = [], []
+    for f, dets in enumerate(synthetic_frames(2000, seed=1)):
+        now = f / 5.0
+        for ev in heap_det.pop_due(now, 3.0):
+            if ev.id % 7 == 0 and f % 2:
+                heap_det.reschedule(ev)  # «очередь писателя переполнена» — повтор на следующем кадре
+                continue
+            ev.enqueued = True
+            heap_log.append((f, ev.id))
+        for ev in list(scan_det.events):
+            if ev.pending and not ev.saved and not ev.enqueued and now - ev.last_update_s >= 3.0:
+                if ev.id % 7 == 0 and f % 2:
+                    continue
+                ev.enqueued = True
+                scan_log.append((f, ev.id))
+        for d in dets:
+            heap_det.register_detection(d, now)
+            scan_det.register_detection(d, now)
+    assert heap_log == scan_log
+    assert len(heap_log) > 100
+
+
+def test_detection_store_range_and_export():
+    """Тест: колоночное хранилище отдаёт окно кадров и выгружается в DataFrame как список Detection"""
+    store, plain = DetectionStore(capacity=16), []
+    for dets in synthetic_frames(500, seed=2):
+        for d in dets:
+            store.append(d)
+            plain.append(d)
+    assert len(store) == len(plain)
+    for lo, hi in [(0, 10), (100, 250), (490, 10_000), (-5, -1)]:
+        want = [d for d in plain if lo <= d.frame_idx <= hi]
+        assert store.range(lo, hi) == want
+    df = store.to_dataframe()
+    assert list(df.columns) == ['wall_time', 'time_s', 'frame_idx', 'class_name', 'conf', 'bbox']
+    assert df['bbox'].tolist() == [d.bbox for d in plain]
+    assert df['class_name'].tolist() == [d.class_name for d in plain]
+    assert store.nbytes < 64 * len(plain)
@@ -0,0 +1,45 @@
+from event_index import EventIndex
+
+
+def test_index_filters_and_keyset_pagination(tmp_path, write_result):
+    """Тест: выборки по задаче/классу/времени и постраничный обход по id"""
+    out = tmp_path / "results"
+    write_result(out / "task_a", 5)
+    write_result(out / "task_b", 4)
+    index = EventIndex(str(tmp_path / "index.sqlite"))
+    assert index.backfill(str(out)) == 9
+
+    pages, after = [], None
+    while True:
+        page = index.list(limit=4, after=after)
+        if not page:
+            break
+        pages.append(page)
+        after = page[-1]["id"]
+    assert [len(p) for p in pages] == [4, 4, 1]
+    all_ids = [r["id"] for p in pages for r in p]
+    assert all_ids == sorted(set(all_ids))
+
+    assert [r["event_id"] for r in index.list(task="task_b")] == [1, 2, 3, 4]
+    assert {r["event_id"] for r in index.list(task="task_a", class_name="floor")} == {1, 3, 5}
+    assert [r["time_s"] for r in index.list(task="task_a", time_from=2.0, time_to=6.0)] == [2.0, 4.0, 6.0]
+
+    r = index.get(all_ids[0])
+    assert r["task"] == "task_a" and r["class_names"] == ["no_head", "floor"] and r["bbox"] == (0, 0, 10, 10)
+    assert index.get(10_000) is None
+
+
+def test_reindex_keeps_global_ids(tmp_path, write_result):
+    """Тест: переиндексация задачи сохраняет глобальные id и убирает исчезнувшие события"""
+    out = tmp_path / "results"
+    write_result(out / "task_a", 5)
+    index = EventIndex(str(tmp_path / "index.sqlite"))
+    index.backfill(str(out))
+    before = {r["event_id"]: r["id"] for r in index.list()}
+    assert index.backfill(str(out)) == 0  # отчёт не менялся — пропуск
+
+    write_result(out / "task_a", 3)
+    index.index_task("task_a", str(out / "task_a"))
+    after = {r["event_id"]: r["id"] for r in index.list()}
+    assert after == {k: before[k] for k in (1, 2, 3)}
+    assert index.list(class_name="no_glove") == [r for r in index.list() if r["event_id"] == 2]
@@ -0,0 +1,49 @@
+import json
+
+import cv2
+import numpy as np
+
+from flight_recorder import FlightRecorder, TRACE_FILE
+from main import process_video
+
+
+class BoxModel:
+    """Заглушка модели: нарушение на кадрах 10..29."""
+
+    def predict_batch(self, frames, conf=0.5):
+        return [[("no_glove", 0.9, (4, 4, 20, 20))] if 10 <= int(f[0, 0, 0]) // 4 < 30 else [] for f in frames]
+
+
+def test_ring_buffer_and_sampling():
+    """Тест: в буфере последние capacity записей, пишутся только выбранные окна кадров"""
+    rec = FlightRecorder(capacity=5, sample_every=2, window_frames=10)
+    assert [i for i in range(40) if rec.sampled(i)] == list(range(10)) + list(range(20, 30))
+    for i in range(8):
+        rec.span('decode', rec.begin(), args={'frame': i})
+    rec.counter('writer_queue', 3)
+    trace = rec.to_chrome()
+    spans = [e for e in trace["traceEvents"] if e["ph"] == 'X']
+    assert [e["args"]["frame"] for e in spans] == [4, 5, 6, 7]
+    assert trace["otherData"]["dropped"] == 4
+    assert any(e["ph"] == 'M' and e["name"] == 'thread_name' for e in trace["traceEvents"])
+    assert all(e["dur"] >= 0 for e in spans)
+
+
+def test_process_video_writes_chrome_trace(tmp_path):
+    """Тест: process_video(trace=True) пишет в out_dir таймлайн стадий кадров и задачи клипа"""
+    src = tmp_path / "src.mp4"
+    vw = cv2.VideoWriter(str(src), cv2.VideoWriter_fourcc(*"mp4v"), 10.0, (64, 48))
+    for i in range(60):
+        vw.write(np.full((48, 64, 3), i * 4, dtype=np.uint8))
+    vw.release()
+
+    out = tmp_path / "out"
+    process_video("unused.pt", str(src), str(out), detect_every_n=2, finalize_delay=1.0, report_formats=["csv"],
+                  model=BoxModel(), trace=True)
+    with open(out / TRACE_FILE) as f:
+        events = json.load(f)["traceEvents"]
+    names = {e["name"] for e in events if e["ph"] == 'X'}
+    assert {'decode', 'inference', 'events', 'clip_enqueue', 'clip_write', 'process_video'} <= names
+    assert sum(1 for e in events if e["name"] == 'decode') == 60
+    write = next(e for e in events if e["name"] == 'clip_write')
+    assert write["cat"] == 'clip' and write["args"]["queue_wait_ms"] >= 0
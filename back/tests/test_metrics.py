@@ -0,0 +1,85 @@
+import json
+import os
+
+from fastapi.testclient import TestClient
+
+import metrics
+from detector import DetectionStore
+from writer import ClipWriter
+
+
+def sample(text, line_prefix):
+    for line in text.splitlines():
+        if line.startswith(line_prefix + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+def test_render_merges_worker_snapshots(tmp_path):
+    """Тест: счётчики и гистограммы складываются по процессам, gauge завершившегося процесса не учитывается"""
+    reg = metrics.Registry()
+    c = metrics.Counter('t_frames_total', 'frames', ('source',), registry=reg)
+    g = metrics.Gauge('t_queue', 'queue', registry=reg)
+    h = metrics.Histogram('t_seconds', 'latency', buckets=(0.1, 1.0), registry=reg)
+    c.labels('video').inc(3)
+    g.set(2)
+    for v in (0.05, 0.5, 5.0):
+        h.observe(v)
+
+    # снимок «мёртвого» воркера (pid, которого нет) и снимок прежнего процесса с тем же pid, что у живого
+    dead = reg.snapshot()
+    for name, pid in (("proc-999999999-1.json", 999999999), (f"proc-{os.getpid()}-1.json", os.getpid())):
+        with open(tmp_path / name, 'w') as f:
+            json.dump({"pid": pid, "metrics": dead}, f)
+    with open(tmp_path / f"proc-{os.getpid()}-{10 ** 13}.json", 'w') as f:
+        json.dump({"pid": os.getpid(), "metrics": {}}, f)
+
+    text = reg.render(str(tmp_path))
+    assert '# TYPE t_frames_total counter' in text
+    assert sample(text, 't_frames_total{source="video"}') == 9
+    assert sample(text, 't_queue') == 2
+    # снимки завершившихся процессов свёрнуты в архив: сумма та же, файлов больше нет
+    assert not (tmp_path / "proc-999999999-1.json").exists() and (tmp_path / metrics.ARCHIVE_FILE).exists()
+    assert reg.render(str(tmp_path)) == text
+    assert sample(text, 't_seconds_bucket{le="0.1"}') == 3
+    assert sample(text, 't_seconds_bucket{le="1"}') == 6
+    assert sample(text, 't_seconds_bucket{le="+Inf"}') == 9
+    assert sample(text, 't_seconds_count') == 9
+    assert abs(sample(text, 't_seconds_sum') - 16.65) < 1e-9
+
+
+def clip_counts():
+    return {k[0]: v for k, v in metrics.REGISTRY.snapshot()['leanvision_clips_total']['values']}
+
+
+class JpegFrames:
+    """Заглушка сжатого буфера кадров: по 100 байт на кадр."""
+    encoded = True
+    last_idx = 99
+
+    def get_range(self, start_idx, end_idx):
+        return [(i, b"x" * 100) for i in range(max(0, start_idx), end_idx + 1)]
+
+
+def test_writer_counts_dropped_clips():
+    """Тест: задача сверх бюджета очереди при выключенном спуле считается в leanvision_clips_total{result="dropped"}"""
+    before = clip_counts()
+    writer = ClipWriter(workers=0, max_bytes=1, spool_max_bytes=0)  # без воркеров очередь не разбирается
+    frames = JpegFrames()
+    assert writer.enqueue(frames, 10, 10.0, "a.mp4", DetectionStore(), None, pre_sec=1, post_sec=1)
+    assert not writer.enqueue(frames, 50, 10.0, "b.mp4", DetectionStore(), None, pre_sec=1, post_sec=1)
+    after = clip_counts()
+    assert after['enqueued'] - before.get('enqueued', 0) == 1
+    assert after['dropped'] - before.get('dropped', 0) == 1
+    assert writer.stats == {'spilled': 0, 'reloaded': 0, 'dropped': 1}
+    assert writer.mem_bytes == 21 * 100
+
+
+def test_metrics_endpoint():
+    """Тест: /metrics отдаёт текстовый формат Prometheus"""
+    from api import app
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE leanvision_frames_decoded_total counter" in response.text
+    assert 'leanvision_tasks{status="queued"}' in response.text
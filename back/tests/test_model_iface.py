@@ -0,0 +1,106 @@
+import threading
+import time
+
+import numpy as np
+
+import model_iface
+from model_iface import OnnxModel, decode_yolo, ensure_onnx, letterbox, parity_check, resolve_backend
+
+
+def yolo_output(boxes, nc=3, anchors=20):
+    """Выход YOLO (4 + nc, anchors): boxes — (cx, cy, w, h, class_id, score) во входе модели."""
+    out = np.zeros((4 + nc, anchors), dtype=np.float32)
+    for i, (cx, cy, w, h, c, s) in enumerate(boxes):
+        out[:4, i] = (cx, cy, w, h)
+        out[4 + c, i] = s
+    return out
+
+
+def test_letterbox_keeps_aspect_and_centers():
+    """Тест: кадр 1280x720 -> 640x640, масштаб 0.5, поля сверху/снизу по 140"""
+    img, r, pad = letterbox(np.full((720, 1280, 3), 200, dtype=np.uint8), 640)
+    assert img.shape == (640, 640, 3) and r == 0.5 and pad == (0, 140)
+    assert img[139, 0, 0] == 114 and img[140, 0, 0] == 200 and img[500, 0, 0] == 114
+
+
+def test_decode_thresholds_and_per_class_nms():
+    """Тест: порог conf, NMS подавляет перекрывающиеся боксы только внутри класса"""
+    pred = yolo_output([(100, 100, 50, 50, 0, 0.875), (102, 101, 50, 50, 0, 0.75), (102, 101, 50, 50, 1, 0.625),
+                        (300, 300, 40, 40, 2, 0.125)])
+    xyxy, scores, cls = decode_yolo(pred, conf=0.25)
+    assert sorted(zip(cls.tolist(), scores.tolist())) == [(0, 0.875), (1, 0.625)]
+    assert xyxy[list(cls).index(0)].tolist() == [75, 75, 125, 125]
+
+
+class FakeSession:
+    """Заглушка onnxruntime.InferenceSession с динамическим батчем."""
+
+    class Input:
+        name = "images"
+        shape = ["batch", 3, 640, 640]
+
+    class Meta:
+        custom_metadata_map = {"names": "{0: 'glove', 1: 'no_glove', 2: 'head'}"}
+
+    def __init__(self):
+        self.inputs = []
+
+    def get_inputs(self):
+        return [self.Input()]
+
+    def get_modelmeta(self):
+        return self.Meta()
+
+    def run(self, outputs, feeds):
+        x = feeds["images"]
+        self.inputs.append(x.shape)
+        return [np.stack([yolo_output([(320, 320, 64, 32, 1, 0.875)]) for _ in range(len(x))])]
+
+
+def test_onnx_model_maps_boxes_to_frame():
+    """Тест: вход NCHW float в [0, 1], боксы из координат letterbox переводятся в координаты кадра"""
+    session = FakeSession()
+    model = OnnxModel("unused.onnx", session=session)
+    frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+    dets = model.predict_batch([frame, frame], conf=0.5)
+    assert session.inputs == [(2, 3, 640, 640)]
+    # центр (320, 320) во входе -> (640, 360) в кадре, размер 64x32 -> 128x64
+    assert dets == [[("no_glove", 0.875, (576, 328, 704, 392))]] * 2
+    assert model.predict_frame(frame, conf=0.9) == []
+    assert parity_check(model, model, [frame] * 3)["recall"] == 1.0
+
+
+def test_backend_resolution_and_single_export(tmp_path, monkeypatch):
+    """Тест: auto разрешается по расширению; одновременные загрузки экспортируют .onnx один раз"""
+    assert resolve_backend("m.pt", "auto") == "torch" and resolve_backend("m.onnx", None) == "onnx"
+    assert resolve_backend("m.pt", "openvino") == "openvino"
+    for bad in (("m.pt", "tensorrt"), ("m.onnx", "torch")):
+        try:
+            resolve_backend(*bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad} accepted")
+
+    pt = tmp_path / "best.pt"
+    pt.write_bytes(b"weights")
+    exports = []
+
+    def fake_export(pt_path, imgsz=640, int8=False):
+        exports.append(pt_path)
+        time.sleep(0.2)
+        out = pt_path[:-3] + ".onnx"
+        with open(out, "wb") as f:
+            f.write(b"onnx")
+        return out
+
+    monkeypatch.setattr(model_iface, "export_onnx", fake_export)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(ensure_onnx(str(pt)))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(exports) == 1 and not exports[0].startswith(str(pt)[:-3])  # экспорт во временной директории
+    assert results == [str(tmp_path / "best.onnx")] * 4
+    assert (tmp_path / "best.onnx").read_bytes() == b"onnx"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["best.onnx", "best.onnx.lock", "best.pt"]
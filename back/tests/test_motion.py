@@ -0,0 +1,51 @@
+import numpy as np
+
+from motion import MotionGate
+from pipeline import FrameItem, InferenceBatcher
+
+
+def frame_with_box(x=None):
+    frame = np.full((240, 320, 3), 60, dtype=np.uint8)
+    if x is not None:
+        frame[100:160, x:x + 40] = 220
+    return frame
+
+
+def test_gate_skips_static_and_wakes_on_motion():
+    """Тест: статичная сцена — инференс пропускается (кроме контрольного), движение — полная частота"""
+    gate = MotionGate(hold_sec=1.0, idle_sec=5.0)
+    decisions = [gate.should_infer(frame_with_box(), t * 0.2) for t in range(20)]  # 4 с пустой сцены
+    assert decisions[0] and not any(decisions[1:])
+    assert gate.skipped == 19
+
+    # движение: инференс на каждом кадре, затем hold_sec после остановки
+    moving = [gate.should_infer(frame_with_box(20 + 15 * i), 4.0 + i * 0.2) for i in range(5)]
+    assert all(moving)
+    still = [gate.should_infer(frame_with_box(80), 5.0 + i * 0.2) for i in range(1, 15)]
+    assert still[:4] == [True] * 4 and not any(still[6:])
+
+    # контрольный инференс без движения раз в idle_sec
+    assert gate.should_infer(frame_with_box(80), 13.0)
+    assert gate.checked == 20 + 5 + 14 + 1
+
+
+def test_batcher_with_gate_keeps_detections_active():
+    """Тест: гейт в батчере снимает инференс с пустых кадров, детекции держат полную частоту без движения"""
+
+    class Model:
+        calls = 0
+
+        def predict_batch(self, frames, conf=0.5):
+            Model.calls += len(frames)
+            return [[("no_glove", 0.9, (0, 0, 1, 1))] for _ in frames]
+
+    gate = MotionGate(hold_sec=1.0, idle_sec=100.0)
+    batcher = InferenceBatcher(Model(), conf=0.5, gate=gate)
+    frame = frame_with_box(50)
+    out = []
+    for i in range(20):
+        out += batcher.push(FrameItem(idx=i, frame=frame, current_s=i * 0.2, wall_time="", infer=True))
+    out += batcher.flush()
+    # человек замер в кадре, но модель его видит — гейт не выключает инференс
+    assert Model.calls == 20 and gate.skipped == 0
+    assert [it.idx for it in out] == list(range(20))
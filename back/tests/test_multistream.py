@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+
+from multistream import SharedInferenceEngine, parse_sources, process_streams
+from stream import SyntheticSource
+
+
+class CountingModel:
+    """Заглушка модели: запоминает размеры батчей, детекция с conf 0.7 на каждом кадре."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+
+    def predict_batch(self, frames, conf=0.5):
+        self.batches.append(len(frames))
+        time.sleep(self.delay)
+        return [[("no_glove", 0.7, (0, 0, 4, 4))] if 0.7 >= conf else [] for _ in frames]
+
+
+def test_round_robin_is_fair_and_filters_conf():
+    """Тест: камера с длинной очередью не вытесняет остальных, ответ фильтруется по conf камеры"""
+    model = CountingModel(delay=0.2)
+    engine = SharedInferenceEngine(model, batch_size=2, max_wait_s=0.0)
+    try:
+        busy = engine.client("busy")
+        quiet = engine.client("quiet")
+        first = engine.submit("busy", [0], 0.5)  # занимает модель, пока ставятся остальные запросы
+        time.sleep(0.05)
+        flood = [engine.submit("busy", [i], 0.5) for i in range(6)]
+        late = engine.submit("quiet", [0], 0.9)
+        assert late.result(timeout=5) == [[]]  # 0.7 < conf камеры
+        assert not all(f.done() for f in flood)  # тихая камера обслужена раньше хвоста очереди
+        assert first.result(timeout=5) == [[("no_glove", 0.7, (0, 0, 4, 4))]]
+        assert busy.predict_frame(0) and quiet.predict_batch([]) == []
+        assert max(model.batches) == 2
+    finally:
+        engine.shutdown()
+
+
+def test_process_streams_shares_batches(tmp_path):
+    """Тест: несколько камер — одна модель, кадры разных камер в общих батчах, статистика по камерам"""
+    model = CountingModel(delay=0.01)
+    sources = {f"cam{i}": SyntheticSource(32, 32, fps=50, frames=50) for i in range(3)}
+    sources["broken"] = {"source": SyntheticSource(32, 32), "no_such_option": 1}
+    stats = process_streams(sources, str(tmp_path), model=model, batch_size=8, max_wait_s=0.05,
+                            detect_every_n=1, finalize_delay=0.2, report_sec=0.3, report_formats=["csv"])
+    assert set(stats) == {"cam0", "cam1", "cam2", "broken"}
+    assert "no_such_option" in stats.pop("broken")["error"]
+    assert all(st["done"] and st["frames"] > 0 for st in stats.values())
+    assert max(model.batches) > 1
+    saved = json.loads((tmp_path / "streams.json").read_text())
+    assert "no_such_option" in saved["streams"].pop("broken")["error"]  # упавшая камера видна в streams.json
+    assert set(saved["streams"]) == set(stats) and saved["engine"]["mean_batch"] > 1
+    assert {"fps", "lag_s", "dropped"} <= set(saved["streams"]["cam0"])
+    assert all((tmp_path / name / "detections_all.csv").exists() for name in stats)
+    assert threading.active_count() < 20
+
+
+def test_parse_sources():
+    assert parse_sources(["rtsp://a/1", "door=synthetic://", "0"]) == {
+        "cam0": "rtsp://a/1", "door": "synthetic://", "cam2": "0"}
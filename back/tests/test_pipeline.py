@@ -0,0 +1,229 @@
+import cv2
+import numpy as np
+
+from buffers import FrameRingBuffer, CompressedFrameBuffer
+from detector import ViolationDetector
+from pipeline import FrameItem, InferenceBatcher, EventStage, run_pipelined
+
+
+class FakeModel:
+    """Детерминированная заглушка YoloModel: одна детекция на кадр, bbox зависит от значения пикселя."""
+
+    def __init__(self):
+        self.calls = []
+
+    def predict_batch(self, frames, conf=0.5):
+        self.calls.append(len(frames))
+        out = []
+        for f in frames:
+            v = int(f[0, 0, 0])
+            out.append([("no_glove", 0.9, (v, v, v + 10, v + 10))] if (v // 40) % 2 == 0 else [])
+        return out
+
+
+class FakeCap:
+    """Заглушка cv2.VideoCapture: отдаёт n синтетических кадров."""
+
+    def __init__(self, n):
+        self.n = n
+        self.i = 0
+
+    def read(self, image=None):
+        if self.i >= self.n:
+            return False, None
+        if image is None:
+            image = np.empty((4, 4, 3), dtype=np.uint8)
+        image[...] = self.i % 256
+        self.i += 1
+        return True, image
+
+
+class FakeWriter:
+    """Заглушка ClipWriter: запоминает, какие события и когда ушли на запись."""
+
+    def __init__(self):
+        self.enqueued = []
+
+    def enqueue(self, frames_buffer, event_frame_idx, fps, out_path, all_detections, event, pre_sec=3, post_sec=5):
+        self.enqueued.append((event.id, out_path))
+        event.enqueued = True
+        return True
+
+
+def make_stage():
+    return EventStage(ViolationDetector(merge_window_sec=2), FakeWriter(), FrameRingBuffer(300), 25.0, "clips",
+                      conf_thresh=0.5, finalize_delay=1.0)
+
+
+def make_item(idx, every=1):
+    frame = np.full((4, 4, 3), idx, dtype=np.uint8)
+    return FrameItem(idx=idx, frame=frame, current_s=idx / 25.0, wall_time="", infer=(idx % every == 0))
+
+
+def test_batcher_groups_frames_and_keeps_order():
+    """Тест: кадры собираются в батчи нужного размера и выходят по порядку"""
+    model = FakeModel()
+    batcher = InferenceBatcher(model, conf=0.5, batch_size=3, max_latency_s=1e9)
+    out = []
+    for i in range(20):
+        out.extend(batcher.push(make_item(i, every=2)))
+    out.extend(batcher.flush())
+
+    assert [it.idx for it in out] == list(range(20))
+    assert model.calls == [3, 3, 3, 1]
+    for it in out:
+        if it.infer:
+            assert it.dets[0][2][0] == it.idx
+        else:
+            assert it.dets is None
+
+
+def test_batcher_holds_frames_behind_pending_batch():
+    """Тест: кадры без инференса не обгоняют кадр, ожидающий батча"""
+    batcher = InferenceBatcher(FakeModel(), conf=0.5, batch_size=4, max_latency_s=1e9)
+    assert batcher.push(make_item(0, every=2)) == []
+    assert batcher.push(make_item(1, every=2)) == []
+    assert [it.idx for it in batcher.flush()] == [0, 1]
+
+
+def test_batcher_latency_flush():
+    """Тест: неполный батч сбрасывается по таймауту"""
+    model = FakeModel()
+    batcher = InferenceBatcher(model, conf=0.5, batch_size=8, max_latency_s=0.0)
+    ready = batcher.push(make_item(0))
+    assert [it.idx for it in ready] == [0]
+    assert model.calls == [1]
+
+
+def test_pipelined_matches_serial():
+    """Тест: конвейерный режим даёт те же детекции, события и моменты постановки клипов, что и последовательный"""
+    n, every = 600, 3
+
+    serial = make_stage()
+    batcher = InferenceBatcher(FakeModel(), conf=0.5, batch_size=4, max_latency_s=1e9)
+    cap = FakeCap(n)
+    idx = 0
+    while True:
+        ret, frame = serial.frames_buffer.read(cap)
+        if not ret:
+            break
+        for ready in batcher.push(FrameItem(idx=idx, frame=frame, current_s=idx / 25.0, wall_time="",
+                                            infer=(idx % every == 0))):
+            serial.on_frame(ready)
+        idx += 1
+    for ready in batcher.flush():
+        serial.on_frame(ready)
+
+    piped = make_stage()
+    stats = run_pipelined(FakeCap(n), 25.0, every, InferenceBatcher(FakeModel(), conf=0.5, batch_size=4),
+                          piped, piped.frames_buffer, queue_size=8, log_every_s=0)
+
+    key = lambda d: (d.frame_idx, d.class_name, d.bbox)
+    assert [key(d) for d in piped.detections] == [key(d) for d in serial.detections]
+    assert [(e.id, e.frame_idx, e.bbox, e.confs) for e in piped.detector.events] == \
+           [(e.id, e.frame_idx, e.bbox, e.confs) for e in serial.detector.events]
+    assert piped.writer.enqueued == serial.writer.enqueued
+    assert all(st.items == n for st in stats)
+
+
+def test_ring_buffer_reads_in_place_and_slices_by_index():
+    """Тест: кадры декодируются в предвыделенный массив, срез по индексам отдаёт только живые кадры"""
+    ring = FrameRingBuffer(8)
+    cap = FakeCap(20)
+    views = []
+    while True:
+        ret, frame = ring.read(cap)
+        if not ret:
+            break
+        views.append(frame)
+    assert ring.last_idx == 19
+    assert all(np.shares_memory(v, ring.data) for v in views)
+    # слот последнего+1 кадра считается занятым декодером, поэтому живых кадров capacity-1
+    got = ring.get_range(0, 100)
+    assert [i for i, _ in got] == list(range(13, 20))
+    assert all(int(f[0, 0, 0]) == i for i, f in got)
+    assert [i for i, _ in ring.get_range(15, 17)] == [15, 16, 17]
+    assert ring.get(12) is None and ring.get(20) is None
+
+
+def test_compressed_buffer_encodes_each_frame_once():
+    """Тест: сжатый буфер кодирует кадр один раз, пересекающиеся клипы получают одни и те же bytes"""
+    buf = CompressedFrameBuffer(16, lag_frames=2, workers=2, quality=90)
+    cap = FakeCap(40)
+    try:
+        while buf.read(cap)[0]:
+            pass
+    finally:
+        buf.close()
+    assert buf.last_idx == 39
+    assert buf.raw.capacity < buf.capacity
+    a = dict(buf.get_range(30, 36))
+    b = dict(buf.get_range(33, 39))
+    assert sorted(a) == list(range(30, 37)) and sorted(b) == list(range(33, 40))
+    assert all(a[i] is b[i] for i in range(33, 37))
+    img = cv2.imdecode(np.frombuffer(a[30], np.uint8), cv2.IMREAD_COLOR)
+    assert abs(int(img[0, 0, 0]) - 30) <= 2
+
+
+def test_save_immediately_counts_event_finalized_once():
+    """Тест: ранний клип (save_immediately) не считается финализацией — событие финализируется один раз"""
+    import metrics
+    finalized = lambda: dict((k[0], v) for k, v in metrics.EVENTS.snapshot()["values"]).get("finalized", 0)
+    before = finalized()
+    messages = []
+    stage = EventStage(ViolationDetector(merge_window_sec=2), FakeWriter(), FrameRingBuffer(300), 25.0, "clips",
+                       conf_thresh=0.5, finalize_delay=1.0, save_immediately=True, on_event=messages.append)
+    for idx in range(100):
+        item = make_item(idx)
+        item.dets = [("no_glove", 0.9, (0, 0, 10, 10))] if idx < 5 else []
+        stage.on_frame(item)
+    stage.finalize_all()
+    assert len(stage.writer.enqueued) == 2  # ранний клип и клип при финализации
+    assert finalized() - before == 1 and len(messages) == 1
+
+
+class RangeWriter(FakeWriter):
+    """Заглушка ClipWriter: запоминает диапазон кадров, который реально вырезан из буфера (как ClipWriter.enqueue)."""
+
+    def enqueue(self, frames_buffer, event_frame_idx, fps, out_path, all_detections, event, pre_sec=3, post_sec=5):
+        end = min(event_frame_idx + int(round(post_sec * fps)), frames_buffer.last_idx)
+        frames = frames_buffer.get_range(event_frame_idx - int(round(pre_sec * fps)), end)
+        self.enqueued.append((event.id, frames[0][0], frames[-1][0]))
+        event.enqueued = True
+        return True
+
+
+def test_pipelined_clip_waits_for_post_frames():
+    """Тест: клип режется, когда декодер прошёл кадр события + CLIP_POST_SEC (или конец видео), а не по текущему
+    last_idx буфера — в конвейерном режиме клипы те же, что и в последовательном"""
+    from config import CLIP_POST_SEC
+    n = 600
+    post = int(round(CLIP_POST_SEC * 25.0))
+
+    def stage():
+        return EventStage(ViolationDetector(merge_window_sec=2), RangeWriter(), FrameRingBuffer(400), 25.0, "clips",
+                          conf_thresh=0.5, finalize_delay=1.0)
+
+    serial = stage()
+    cap = FakeCap(n)
+    idx = 0
+    while True:
+        ret, frame = serial.frames_buffer.read(cap)
+        if not ret:
+            break
+        item = FrameItem(idx=idx, frame=frame, current_s=idx / 25.0, wall_time="", infer=True)
+        item.dets = FakeModel().predict_batch([frame])[0]
+        serial.on_frame(item)
+        idx += 1
+    serial.finalize_all()
+
+    piped = stage()
+    run_pipelined(FakeCap(n), 25.0, 1, InferenceBatcher(FakeModel(), conf=0.5, batch_size=4), piped,
+                  piped.frames_buffer, queue_size=8, log_every_s=0)
+    piped.finalize_all()
+
+    assert piped.writer.enqueued == serial.writer.enqueued
+    frame_of = {e.id: e.frame_idx for e in serial.detector.events}
+    assert len(serial.writer.enqueued) > 2
+    for ev_id, first, last in serial.writer.enqueued:
+        assert last == min(frame_of[ev_id] + post, n - 1)
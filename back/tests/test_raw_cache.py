@@ -0,0 +1,103 @@
+import os
+
+import cv2
+import numpy as np
+
+from main import process_video, replay_video
+from raw_cache import RawDetectionRecorder, RawDetections
+from reports import load_detections, load_events
+
+
+class ThresholdModel:
+    """Заглушка YoloModel: детекции разной уверенности (точные во float32, как conf из тензора модели),
+    фильтр по conf — как у настоящей модели."""
+
+    def __init__(self):
+        self.confs = []
+
+    def predict_batch(self, frames, conf=0.5):
+        self.confs.append(conf)
+        out = []
+        for f in frames:
+            v = int(f[0, 0, 0])
+            dets = [("no_glove", 0.875, (v, 0, v + 10, 10)), ("no_head", 0.375, (0, v, 10, v + 10)),
+                    ("person", 0.125, (1, 1, 5, 5))] if (v // 50) % 2 == 0 else []
+            out.append([d for d in dets if d[1] >= conf])
+        return out
+
+
+def make_video(path, n=90):
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 25.0, (32, 32))
+    for i in range(n):
+        out.write(np.full((32, 32, 3), (i * 2) % 256, dtype=np.uint8))
+    out.release()
+
+
+def comparable(task_dir):
+    dets = load_detections(task_dir).drop(columns=['wall_time'])
+    events = [{k: v for k, v in e.items() if k not in ('wall_time_first', 'clip_path')}
+              for e in load_events(task_dir)]
+    return dets.to_dict('records'), events
+
+
+def test_recorder_round_trip(tmp_path):
+    """Тест: кэш сохраняет кадры без детекций, классы и conf без потерь"""
+    path = str(tmp_path / "raw.lvraw.npz")
+    rec = RawDetectionRecorder(path, fps=25.0, total=10, every=2, conf=0.05, meta={"video": "v.mp4"})
+    rec.add(0, [("a", 0.75, (1, 2, 3, 4)), ("b", 0.125, (5, 6, 7, 8))])
+    rec.add(2, [])
+    rec.add(4, [("b", 0.5, (0, 0, 1, 1))])
+    rec.save()
+    raw = RawDetections(path)
+    assert (raw.fps, raw.total, raw.every, raw.min_conf, raw.header["video"]) == (25.0, 10, 2, 0.05, "v.mp4")
+    assert list(raw) == [(0, [("a", 0.75, (1, 2, 3, 4)), ("b", 0.125, (5, 6, 7, 8))]), (2, []),
+                         (4, [("b", 0.5, (0, 0, 1, 1))])]
+
+
+def test_replay_matches_full_run(tmp_path):
+    """Тест: replay из кэша даёт те же детекции и события, что полный прогон с теми же/другими настройками"""
+    video = str(tmp_path / "v.mp4")
+    make_video(video)
+    raw_path = str(tmp_path / "raw" / "v.lvraw.npz")
+    common = dict(video_path=video, detect_every_n=2, finalize_delay=0.5, report_formats=["csv"])
+
+    model = ThresholdModel()
+    process_video("unused.pt", out_dir=str(tmp_path / "full"), conf_thresh=0.5, model=model,
+                  raw_cache_path=raw_path, **common)
+    assert set(model.confs) == {0.05}  # модель работает с минимальным conf кэша
+    assert RawDetections(raw_path).total == 90
+
+    replay_video(raw_path, out_dir=str(tmp_path / "replay"), conf_thresh=0.5, **common)
+    assert comparable(str(tmp_path / "full")) == comparable(str(tmp_path / "replay"))
+    assert len(os.listdir(tmp_path / "replay" / "clips")) == len(os.listdir(tmp_path / "full" / "clips")) > 0
+
+    # другой порог, шаг и классы — без повторного инференса
+    params = dict(conf_thresh=0.25, violation_classes={"no_head"}, **dict(common, detect_every_n=4))
+    process_video("unused.pt", out_dir=str(tmp_path / "full2"), model=ThresholdModel(), **params)
+    replay_video(raw_path, out_dir=str(tmp_path / "replay2"), **params)
+    dets, events = comparable(str(tmp_path / "replay2"))
+    assert (dets, events) == comparable(str(tmp_path / "full2"))
+    assert events and all(e["class_names"] == ["no_head"] for e in events)
+
+
+def test_motion_gated_run_is_not_cached(tmp_path):
+    """Тест: прогон с гейтом движения не пишет кэш — пропущенные кадры replay принял бы за пустые"""
+    video = str(tmp_path / "v.mp4")
+    make_video(video)
+    raw_path = tmp_path / "raw" / "v.lvraw.npz"
+    process_video("unused.pt", video, str(tmp_path / "gated"), detect_every_n=2, finalize_delay=0.5,
+                  report_formats=["csv"], model=ThresholdModel(), raw_cache_path=str(raw_path), motion_gate=True)
+    assert not raw_path.exists()
+
+
+def test_save_uses_unique_temp_file(tmp_path):
+    """Тест: кэш пишется через уникальный временный файл — чужой .tmp рядом не затирается, после записи мусора нет"""
+    path = str(tmp_path / "v_m.raw.npz")
+    stale = tmp_path / "v_m.raw.npz.tmp"
+    stale.write_bytes(b"another writer")
+    rec = RawDetectionRecorder(path, fps=25.0, total=1, every=1, conf=0.25)
+    rec.add(0, [("no_glove", 0.875, (0, 0, 10, 10))])
+    rec.save()
+    assert stale.read_bytes() == b"another writer"
+    assert sorted(os.listdir(tmp_path)) == ["v_m.raw.npz", "v_m.raw.npz.tmp"]
+    assert RawDetections(path).header["fps"] == 25.0
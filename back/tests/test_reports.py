@@ -0,0 +1,56 @@
+import os
+
+import pandas as pd
+import pytest
+
+from detector import DetectionStore, ViolationEvent
+from reports import ReportSink, load_detections, load_events, DETECTIONS_PARQUET, EVENTS_CSV
+
+pytest.importorskip("pyarrow")
+
+
+def fill_store(n):
+    store = DetectionStore()
+    for i in range(n):
+        store.add("no_glove" if i % 3 else "glove", 0.5 + (i % 5) / 10, (i, i + 1, i + 20, i + 30), i // 2,
+                  i / 50.0, f"wall-{i // 2}")
+    return store
+
+
+def make_events():
+    return [ViolationEvent(id=1, class_names=["no_glove", "no_head"], confs=[0.7, 0.9], bbox=(1, 2, 3, 4),
+                           frame_idx=10, time_s=0.4, wall_time_first="w", clip_path="clips/e1.mp4", saved=True),
+            ViolationEvent(id=2, class_names=["floor"], confs=[0.6], bbox=(5, 6, 7, 8), frame_idx=20, time_s=0.8)]
+
+
+def test_sink_flushes_row_groups_during_processing(tmp_path):
+    """Тест: детекции уходят на диск группами строк ещё до close()"""
+    sink = ReportSink(str(tmp_path), formats=("parquet", "csv"), row_group=100, flush_sec=0)
+    store = fill_store(250)
+    sink.update(store, [])
+    parts = sorted(os.listdir(tmp_path / DETECTIONS_PARQUET))
+    assert parts == ["part-00000.parquet", "part-00001.parquet"]
+    assert len(pd.read_csv(tmp_path / "detections_all.csv")) == 200
+
+    sink.close(store, make_events())
+    df = load_detections(str(tmp_path))
+    want = store.to_dataframe()
+    assert len(df) == 250
+    assert [tuple(b) for b in df["bbox"]] == want["bbox"].tolist()
+    assert df["class_name"].astype(str).tolist() == want["class_name"].tolist()
+    assert df["wall_time"].astype(str).tolist() == want["wall_time"].tolist()
+    assert pd.read_csv(tmp_path / "detections_all.csv")["frame_idx"].tolist() == want["frame_idx"].tolist()
+
+
+def test_events_roundtrip_parquet_and_csv(tmp_path):
+    """Тест: события читаются типизированно из Parquet и так же из CSV старого формата"""
+    ReportSink(str(tmp_path / "pq"), formats=("parquet",)).close(DetectionStore(), make_events())
+    ReportSink(str(tmp_path / "csv"), formats=("csv",)).close(DetectionStore(), make_events())
+    assert os.path.exists(tmp_path / "csv" / EVENTS_CSV)
+    from_pq = load_events(str(tmp_path / "pq"))
+    from_csv = load_events(str(tmp_path / "csv"))
+    assert from_pq == from_csv
+    assert from_pq[0]["class_names"] == ["no_glove", "no_head"]
+    assert from_pq[0]["bbox"] == (1, 2, 3, 4)
+    assert from_pq[1]["clip_path"] is None and from_pq[1]["saved"] is False
+    assert load_events(str(tmp_path / "missing")) is None
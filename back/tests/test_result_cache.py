@@ -0,0 +1,45 @@
+import os
+
+from result_cache import ResultCache, normalize_params
+
+
+def make_result(path, size):
+    os.makedirs(path / "clips", exist_ok=True)
+    (path / "clips" / "e1.mp4").write_bytes(b"\0" * size)
+    return str(path)
+
+
+def test_key_depends_only_on_content_model_and_result_params(tmp_path):
+    """Тест: ключ — по содержимому и значимым параметрам; None равен значению по умолчанию"""
+    cache = ResultCache(str(tmp_path / "cache.sqlite"))
+    video, copy, model = tmp_path / "a.mp4", tmp_path / "b.mp4", tmp_path / "best.pt"
+    video.write_bytes(b"shift")
+    copy.write_bytes(b"shift")
+    model.write_bytes(b"weights")
+    base = cache.key(str(video), str(model), {"conf": None, "every": None})
+    assert base == cache.key(str(copy), str(model), normalize_params({}))
+    assert base == cache.key(str(video), str(model), {"batch_size": 8, "pipelined": True, "workers": 4})
+    assert base != cache.key(str(video), str(model), {"conf": 0.7})
+    # auto для .pt — это torch; другой бэкенд даёт другой результат
+    assert base == cache.key(str(video), str(model), {"backend": "torch"})
+    assert base != cache.key(str(video), str(model), {"backend": "onnx"})
+    model.write_bytes(b"weights v2")
+    assert base != cache.key(str(video), str(model), {})
+
+    # известный при загрузке хэш не пересчитывается
+    cache.remember_hash(str(video), "f" * 64)
+    assert cache.file_hash(str(video)) == "f" * 64
+
+
+def test_lru_eviction_by_size(tmp_path):
+    """Тест: при превышении лимита удаляются давно не запрошенные результаты"""
+    evicted = []
+    cache = ResultCache(str(tmp_path / "cache.sqlite"), max_bytes=2500, on_evict=evicted.append)
+    out = tmp_path / "results"
+    cache.put("k1", "t1", make_result(out / "task_1", 1000))
+    cache.put("k2", "t2", make_result(out / "task_2", 1000))
+    assert cache.get("k1")["task_id"] == "t1"  # k1 становится «свежее» k2
+    cache.put("k3", "t3", make_result(out / "task_3", 1000))
+    assert evicted == ["task_2"] and not (out / "task_2").exists()
+    assert cache.get("k2") is None and cache.get("k1") and cache.get("k3")
+    assert cache.total_bytes() == 2000
@@ -0,0 +1,51 @@
+import numpy as np
+
+from roi import RoiModel, build_regions
+
+
+class CenterModel:
+    """Заглушка модели: один бокс 10x10 в центре каждой вырезки (координаты вырезки)."""
+
+    def __init__(self):
+        self.shapes = []
+
+    def predict_batch(self, frames, conf=0.5):
+        self.shapes += [f.shape[:2] for f in frames]
+        out = []
+        for f in frames:
+            h, w = f.shape[:2]
+            cx, cy = w // 2, h // 2
+            out.append([("no_glove", float(f[cy, cx, 0]) / 255, (cx - 5, cy - 5, cx + 5, cy + 5))])
+        return out
+
+
+def test_regions_crop_and_map_boxes_back():
+    """Тест: вырезки областей идут в модель одним батчем, боксы возвращаются в координатах кадра"""
+    spec = {"pad": 0, "regions": [{"name": "table", "rect": [100, 50, 200, 150]},
+                                  {"name": "sink", "rect": [0.5, 0.5, 1.0, 1.0]}]}
+    model = CenterModel()
+    frame = np.full((400, 600, 3), 200, dtype=np.uint8)
+    dets = RoiModel(model, spec).predict_batch([frame, frame])
+    assert model.shapes == [(100, 100), (200, 300)] * 2
+    assert dets[0] == dets[1]
+    assert sorted(d[2] for d in dets[0]) == [(145, 95, 155, 105), (445, 295, 455, 305)]
+
+
+def test_polygon_mask_and_overlap_dedupe():
+    """Тест: пиксели вне полигона закрашены (кадр не меняется), дубль на пересечении областей убирается"""
+    frame = np.full((100, 100, 3), 255, dtype=np.uint8)
+    triangle = {"pad": 0, "regions": [{"polygon": [[0, 0], [99, 0], [0, 99]]}]}
+    regions = build_regions(triangle, frame.shape)
+    assert regions[0].mask[5, 5] and not regions[0].mask[95, 95]
+    crops = []
+
+    class Spy(CenterModel):
+        def predict_batch(self, frames, conf=0.5):
+            crops.extend(f.copy() for f in frames)
+            return [[("no_glove", 0.9, (80, 80, 90, 90))]]  # центр вне полигона
+
+    assert RoiModel(Spy(), triangle).predict_frame(frame) == []
+    assert crops[0][95, 95, 0] == 114 and crops[0][5, 5, 0] == 255 and frame[95, 95, 0] == 255
+
+    same = {"pad": 0, "regions": [{"rect": [0, 0, 100, 100]}, {"rect": [0, 0, 100, 100]}]}
+    assert len(RoiModel(CenterModel(), same).predict_frame(frame)) == 1
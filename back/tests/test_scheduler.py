@@ -0,0 +1,99 @@
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from scheduler import Scheduler
+from task_store import TaskStore
+
+
+def sleep_job(job):
+    time.sleep(job["s"])
+
+
+def fail_job(job):
+    raise ValueError("boom")
+
+
+def crash_job(job):
+    if job.get("crash"):
+        os._exit(1)  # воркер умирает — пул становится broken
+
+
+def wait_status(store, task_id, statuses, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        task = store.get(task_id)
+        if task["status"] in statuses:
+            return task
+        time.sleep(0.02)
+    raise AssertionError(f"{task_id} is still {store.get(task_id)['status']}")
+
+
+def test_priority_order_position_and_eta(tmp_path):
+    """Тест: один воркер, задачи берутся из хранилища по приоритету, у ожидающих есть позиция и ETA"""
+    store = TaskStore(str(tmp_path / "tasks.sqlite"))
+    done = []
+    sched = Scheduler(store, sleep_job, workers=1, on_done=done.append, poll_sec=0.05)
+    try:
+        store.create("warm", "v", "o", {}, {"s": 0.0})
+        sched.start()
+        wait_status(store, "warm", ("done",))
+
+        store.create("a", "v", "o", {}, {"s": 2.0})
+        sched.wake()
+        wait_status(store, "a", ("running",))
+        assert store.create("low", "v", "o", {}, {"s": 0.1}) == 0
+        assert store.create("high", "v", "o", {}, {"s": 0.1}, priority=5) == 0
+        assert store.create("mid", "v", "o", {}, {"s": 0.1}, priority=1) == 1
+        assert [sched.position(j) for j in ("high", "mid", "low")] == [0, 1, 2]
+        assert sched.position("a") is None
+        eta = [sched.eta(j) for j in ("a", "high", "mid", "low")]
+        assert all(e is not None for e in eta) and eta == sorted(eta)
+
+        wait_status(store, "low", ("done",))
+        assert done == ["warm", "a", "high", "mid", "low"]
+        assert [store.get(j)["attempts"] for j in done] == [1] * 5
+    finally:
+        sched.shutdown()
+
+
+def test_job_error_is_stored(tmp_path):
+    """Тест: исключение задачи в воркере переводит её в error с текстом ошибки"""
+    store = TaskStore(str(tmp_path / "tasks.sqlite"))
+    sched = Scheduler(store, fail_job, workers=1, poll_sec=0.05)
+    try:
+        store.create("bad", "v", "o", {}, {})
+        sched.start()
+        task = wait_status(store, "bad", ("done", "error"))
+        assert task["status"] == "error" and "boom" in task["message"]
+    finally:
+        sched.shutdown()
+
+
+def test_broken_pool_is_restarted(tmp_path):
+    """Тест: после падения процесса воркера пул пересоздаётся, задача не отданная в пул возвращается в очередь"""
+    store = TaskStore(str(tmp_path / "tasks.sqlite"))
+    sched = Scheduler(store, crash_job, workers=1, poll_sec=0.05)
+    try:
+        store.create("crash", "v", "o", {}, {"crash": True})
+        sched.start()
+        assert wait_status(store, "crash", ("done", "error"))["status"] == "error"
+        store.create("next", "v", "o", {}, {})
+        sched.wake()
+        assert wait_status(store, "next", ("done", "error"))["status"] == "done"
+    finally:
+        sched.shutdown()
+
+    # submit в сломанный пул: задача возвращается в очередь, а не висит running
+    sched = Scheduler(store, crash_job, workers=1)
+    pool = sched._get_pool()
+
+    def broken_submit(*args, **kwargs):
+        raise BrokenProcessPool("worker died")
+    pool.submit = broken_submit
+    store.create("retry", "v", "o", {}, {})
+    task = store.claim(sched.owner, 1)
+    assert not sched._launch(task)
+    assert store.get("retry")["status"] == "queued" and store.get("retry")["attempts"] == 0
+    assert sched._pool is None and sched._running == {}
+    sched.shutdown()
@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from event_index import EventIndex
+from main import process_stream
+from reports import load_detections, load_events
+from stream import LiveCapture, SyntheticSource, resolve_client_source
+
+
+class SlowModel:
+    """Заглушка YoloModel медленнее камеры: детекция на каждом кадре, ~20 кадров/с."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.frames = 0
+
+    def predict_batch(self, frames, conf=0.5):
+        time.sleep(self.delay * len(frames))
+        self.frames += len(frames)
+        return [[("no_glove", 0.9, (0, 0, 10, 10))] for _ in frames]
+
+
+def test_live_capture_drops_stale_frames():
+    """Тест: медленный потребитель получает свежие кадры по порядку, отставшие выбрасываются и считаются"""
+    cap = LiveCapture(SyntheticSource(16, 16, fps=200, frames=200), max_queue=8, max_lag_sec=0.05)
+    got = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        got.append(int(frame[0, 0, 0]))
+        time.sleep(0.02)
+    cap.release()
+    assert cap.captured == 200
+    assert cap.dropped > 0 and len(got) + cap.dropped == 200
+    assert got == sorted(got)
+
+
+def test_process_stream_keeps_up_with_source(tmp_path):
+    """Тест: поток 50 кадр/с при инференсе 20 кадр/с — кадры теряются, задержка не копится, отчёты и индекс пишутся"""
+    out_dir = tmp_path / "task_live"
+    model = SlowModel()
+    t0 = time.monotonic()
+    process_stream("unused.pt", SyntheticSource(32, 32, fps=50, frames=100), str(out_dir), detect_every_n=1,
+                   finalize_delay=0.2, model=model, max_lag_sec=0.2, report_sec=0.5, report_formats=["csv"],
+                   event_index_path=str(tmp_path / "index.sqlite"))
+    elapsed = time.monotonic() - t0
+    assert elapsed < 4.0  # 2 с потока, а не 100 * 0.05 = 5 с инференса с растущей задержкой
+    assert 0 < model.frames < 100
+    assert len(load_detections(str(out_dir))) == model.frames
+    events = load_events(str(out_dir))
+    assert events
+    assert len(EventIndex(str(tmp_path / "index.sqlite")).list(task="task_live")) == len(events)
+
+
+def test_client_source_allowlist():
+    """Тест: из API открываются только камеры из конфига, synthetic:// и URL разрешённых хостов"""
+    cameras, schemes, hosts = {"line1": "rtsp://10.0.0.5/stream"}, ("rtsp", "http"), ("cam.local",)
+    assert resolve_client_source("line1", cameras, schemes, hosts) == "rtsp://10.0.0.5/stream"
+    assert resolve_client_source("synthetic://64x48@10", cameras, schemes, hosts) == "synthetic://64x48@10"
+    assert resolve_client_source("rtsp://CAM.local:554/a", cameras, schemes, hosts) == "rtsp://CAM.local:554/a"
+    for bad in ("/etc/passwd", "file:///etc/passwd", "0", "rtsp://10.0.0.9/a", "concat:a|b", "ftp://cam.local/x"):
+        with pytest.raises(ValueError):
+            resolve_client_source(bad, cameras, schemes, hosts)
+
+
+class DeadSource:
+    """Источник, который сразу обрывается."""
+
+    def read(self):
+        return False, None
+
+    def get(self, prop):
+        return 25.0
+
+    def release(self):
+        pass
+
+
+def test_release_during_reconnect_does_not_reopen():
+    """Тест: release() во время ожидания переподключения останавливает поток без повторного открытия источника"""
+    opened = []
+
+    def open_fn(source):
+        opened.append(source)
+        return DeadSource()
+
+    cap = LiveCapture("rtsp://cam/a", reconnect_tries=5, reconnect_sec=30.0, open_fn=open_fn)
+    time.sleep(0.1)
+    t0 = time.monotonic()
+    cap.release()
+    assert time.monotonic() - t0 < 2.0
+    assert not cap._thread.is_alive() and opened == ["rtsp://cam/a"]
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+from fastapi.testclient import TestClient
+
+from pipeline import ProgressReporter
+from task_hub import TaskHub
+
+
+def test_hub_coalesces_and_fans_out():
+    """Тест: частый прогресс сливается в одно сообщение, события доходят все и до каждого подписчика"""
+    tasks = {"t1": {"task_id": "t1", "status": "running"}}
+    hub = TaskHub(tasks.get, min_interval_s=0.2, refresh_sec=60)
+
+    async def client(got):
+        async for msg in hub.subscribe("t1"):
+            got.append(msg)
+            if msg["status"] == "done":
+                return
+
+    async def main():
+        a, b = [], []
+        clients = [asyncio.create_task(client(a)), asyncio.create_task(client(b))]
+        await asyncio.sleep(0.05)
+
+        def worker():
+            for i in range(1, 51):
+                hub.publish("t1", {"type": "progress", "frames": i, "total": 50})
+            hub.publish("t1", {"type": "event", "id": 1})
+            hub.publish("t1", {"type": "event", "id": 2})
+
+        threading.Thread(target=worker).start()
+        await asyncio.sleep(0.1)
+        tasks["t1"] = {"task_id": "t1", "status": "done"}
+        hub.publish("t1", {"type": "task", "task": tasks["t1"]})
+        await asyncio.wait_for(asyncio.gather(*clients), timeout=5)
+        return a, b
+
+    a, b = asyncio.run(main())
+    for got in (a, b):
+        assert got[0]["status"] == "running" and got[0]["progress"] is None
+        # 50 обновлений прогресса и 2 события ушли несколькими сообщениями, а не 52
+        assert len(got) <= 4
+        assert got[-1]["progress"]["frames"] == 50
+        assert [e["id"] for m in got for e in m["events"]] == [1, 2]
+    assert hub.stats() == {"topics": 0, "subscribers": 0}
+
+
+def test_progress_reporter_rate_and_eta():
+    """Тест: прогресс не чаще every_s, финальный вызов с done и без ETA"""
+    calls = []
+    rep = ProgressReporter(total=100, callback=calls.append, every_s=3600)
+    for _ in range(40):
+        rep.frame_done(events=2)
+    assert calls == []
+    rep.every_s = 0.0
+    rep.frame_done(events=2)
+    assert calls[-1]["frames"] == 41 and calls[-1]["total"] == 100 and calls[-1]["eta_s"] is not None
+    rep.finish(events=3)
+    assert calls[-1]["done"] and calls[-1]["eta_s"] is None and calls[-1]["events"] == 3
+
+
+def test_ws_pushes_progress(api_stores):
+    """Тест: /ws/tasks/{id} присылает состояние при подключении и прогресс по публикации"""
+    api = api_stores
+    with TestClient(api.app) as client, client.websocket_connect("/ws/tasks/nope") as ws:
+        assert ws.receive_json()["status"] == "not_found"
+        api.task_hub.publish("nope", {"type": "progress", "frames": 5, "total": 10})
+        msg = ws.receive_json()
+        assert msg["progress"]["frames"] == 5 and msg["events"] == []
@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+from task_store import TaskStore, QueueFullError
+
+
+def test_claim_is_atomic_across_connections(tmp_path):
+    """Тест: параллельные claim из разных потоков (соединений) не берут одну задачу дважды"""
+    path = str(tmp_path / "tasks.sqlite")
+    store = TaskStore(path)
+    for i in range(40):
+        store.create(f"t{i}", "v", "o", {"i": i}, {"i": i}, priority=i % 3)
+    claimed, lock = [], threading.Lock()
+
+    def worker(owner):
+        own = TaskStore(path)
+        while True:
+            task = own.claim(owner, max_running=1000)
+            if task is None:
+                return
+            with lock:
+                claimed.append(task["task_id"])
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(claimed) == sorted(f"t{i}" for i in range(40))
+
+
+def test_priority_limits_and_admission(tmp_path):
+    """Тест: порядок по приоритету, лимит запущенных на хосте и отказ при полной очереди"""
+    store = TaskStore(str(tmp_path / "tasks.sqlite"))
+    store.create("a", "v", "o", {}, {"x": 1})
+    store.create("b", "v", "o", {}, {}, priority=2)
+    assert store.create("c", "v", "o", {}, {}, max_queue=3) == 2
+    with pytest.raises(QueueFullError):
+        store.create("d", "v", "o", {}, {}, max_queue=3)
+
+    assert store.claim("me", max_running=1)["task_id"] == "b"
+    assert store.claim("me", max_running=1) is None
+    task = store.claim("me", max_running=2)
+    assert task["task_id"] == "a" and task["job"] == {"x": 1}
+    assert store.position("c") == 0
+    assert store.finish("a", "me") and store.get("a")["status"] == "done"
+    assert not store.finish("a", "me")  # повторный переход запрещён
+    assert store.finish("b", "me", error="boom") and store.get("b")["message"] == "boom"
+
+
+def test_interrupted_task_is_requeued(tmp_path):
+    """Тест: задача без heartbeat возвращается в очередь, чужой результат не принимается, попытки ограничены"""
+    store = TaskStore(str(tmp_path / "tasks.sqlite"))
+    store.create("t", "v", "o", {}, {})
+    store.claim("dead", max_running=1)
+    assert store.requeue_stale(stale_sec=3600, max_attempts=2) == []
+    assert store.requeue_stale(stale_sec=-1, max_attempts=2) == ["t"]
+    assert store.get("t")["status"] == "queued"
+
+    assert store.claim("alive", max_running=1)["attempts"] == 2
+    assert not store.finish("t", "dead")
+    assert store.requeue_stale(stale_sec=-1, max_attempts=2) == []
+    assert store.get("t")["status"] == "error"
+
+
+def test_running_limit_is_per_host(tmp_path):
+    """Тест: лимит запущенных задач считается по хосту — по всем его процессам API, но не по другим хостам"""
+    store = TaskStore(str(tmp_path / "tasks.sqlite"))
+    for name in ("a", "b", "c"):
+        store.create(name, "v", "o", {}, {})
+    assert store.claim("node1:100", max_running=1)["task_id"] == "a"
+    assert store.claim("node1:200", max_running=1) is None  # другой процесс того же хоста
+    assert store.claim("node10:100", max_running=1)["task_id"] == "b"  # хост с похожим именем — отдельный
+    assert store.claim("node2:100", max_running=1)["task_id"] == "c"
@@ -0,0 +1,98 @@
+import threading
+
+import cv2
+import numpy as np
+
+from buffers import FrameRingBuffer, SourceSeekFrames
+from detector import DetectionStore, ViolationEvent
+from writer import ClipWriter
+
+
+def make_video(path, n=60, fps=10.0, size=(64, 48)):
+    """Создаём короткое синтетическое видео: номер кадра зашит в яркость."""
+    vw = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    for i in range(n):
+        vw.write(np.full((size[1], size[0], 3), i * 4, dtype=np.uint8))
+    vw.release()
+
+
+def count_frames(path):
+    cap = cv2.VideoCapture(str(path))
+    n = 0
+    while cap.grab():
+        n += 1
+    cap.release()
+    return n
+
+
+def test_clip_from_ring_buffer(tmp_path):
+    """Тест: клип вырезается из кольцевого буфера по окну события"""
+    src = tmp_path / "src.mp4"
+    make_video(src)
+    ring = FrameRingBuffer(100)
+    cap = cv2.VideoCapture(str(src))
+    while ring.read(cap)[0]:
+        pass
+    writer = ClipWriter(workers=1)
+    ev = ViolationEvent(id=1, frame_idx=30)
+    out = tmp_path / "ring.mp4"
+    assert writer.enqueue(ring, 30, 10.0, str(out), DetectionStore(), ev, pre_sec=1, post_sec=2)
+    writer.shutdown()
+    assert ev.saved
+    assert count_frames(out) == 31
+
+
+def test_clip_from_source_seek(tmp_path):
+    """Тест: в режиме seek клип читается из исходного файла, кадры в задаче не хранятся"""
+    src = tmp_path / "src.mp4"
+    make_video(src)
+    frames = SourceSeekFrames(str(src), total=60)
+    cap = cv2.VideoCapture(str(src))
+    idx = 0
+    while True:
+        ret, frame = frames.read(cap, need=(idx % 5 == 0))
+        if not ret:
+            break
+        assert (frame is None) == (idx % 5 != 0)
+        idx += 1
+    assert frames.last_idx == 59 and frames.nbytes < 64 * 48 * 3 * 4
+
+    writer = ClipWriter(workers=1)
+    ev = ViolationEvent(id=1, frame_idx=50)
+    out = tmp_path / "seek.mp4"
+    assert writer.enqueue(frames, 50, 10.0, str(out), DetectionStore(), ev, pre_sec=1, post_sec=2)
+    writer.shutdown()
+    assert ev.saved
+    # окно обрезается по концу файла: кадры 40..59
+    assert count_frames(out) == 20
+    first = cv2.VideoCapture(str(out)).read()[1]
+    assert abs(int(first[30, 5, 0]) - 160) <= 8
+
+
+def test_clip_spilled_to_disk_and_reloaded(tmp_path):
+    """Тест: задача сверх бюджета памяти очереди не выбрасывается, а уходит в спул и записывается из него"""
+    src = tmp_path / "src.mp4"
+    make_video(src)
+    ring = FrameRingBuffer(100)
+    cap = cv2.VideoCapture(str(src))
+    while ring.read(cap)[0]:
+        pass
+    spool = tmp_path / "spool"
+    writer = ClipWriter(workers=0, max_bytes=1, spool_dir=str(spool))
+    events = [ViolationEvent(id=i, frame_idx=f) for i, f in ((1, 20), (2, 40))]
+    for ev in events:
+        assert writer.enqueue(ring, ev.frame_idx, 10.0, str(tmp_path / f"{ev.id}.mp4"), DetectionStore(), ev,
+                              pre_sec=1, post_sec=1)
+    # первая задача в памяти, кадры второй — в файле спула
+    assert writer.stats["spilled"] == 1 and writer.spool_bytes > 0
+    assert len(list(spool.glob("*/*.jpgs"))) == 1
+
+    worker = threading.Thread(target=writer._worker, daemon=True)
+    worker.start()
+    writer.workers.append(worker)
+    writer.shutdown()
+    assert all(ev.saved for ev in events)
+    assert count_frames(tmp_path / "2.mp4") == 21
+    assert writer.stats == {"spilled": 1, "reloaded": 1, "dropped": 0}
+    assert writer.mem_bytes == 0 and writer.spool_bytes == 0
+    assert list(spool.iterdir()) == []
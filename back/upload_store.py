@@ -0,0 +1,230 @@
+# upload_store.py
+# Загрузка видео на диск потоком: фиксированные чанки через async-файлы (aiofiles), SHA-256 на лету,
+# дедупликация по хэшу содержимого (одна запись смены хранится один раз) и докачка по смещению.
+#
+# Файл хранится как uploads/<sha256><ext>; незавершённые загрузки — в uploads/.incoming/<upload_id>.part
+# (смещение докачки = текущий размер .part, поэтому его знает любой процесс API и после перезапуска).
+# Процессы uvicorn (--workers N) делят uploads/: перенос в хранилище и докачка одной загрузки идут под
+# межпроцессной блокировкой (flock) — одно содержимое не сохранится дважды под разными расширениями,
+# а два запроса не допишут в один .part одновременно.
+
+import asyncio
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import re
+import uuid
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import aiofiles
+import aiofiles.os
+
+from config import UPLOAD_CHUNK_SIZE
+from utils import ensure_dir
+
+try:
+    import fcntl
+except ImportError:  # Windows: только блокировка внутри процесса
+    fcntl = None
+
+DEDUP_LOCK = '.dedup.lock'
+
+
+class UploadOffsetError(ValueError):
+    """Чанк пришёл не с того смещения: клиент должен продолжить с expected."""
+
+    def __init__(self, expected: int, got: int):
+        super().__init__(f"upload offset mismatch: expected {expected}, got {got}")
+        self.expected = expected
+
+
+class UploadIncompleteError(ValueError):
+    """complete до того, как принят весь заявленный размер: клиент должен продолжить с offset."""
+
+    def __init__(self, offset: int, size: int):
+        super().__init__(f"upload is incomplete: received {offset} of {size} bytes")
+        self.offset = offset
+        self.size = size
+
+
+class UploadSizeError(ValueError):
+    """Чанк выходит за заявленный размер: принято ровно size байт, остаток отброшен."""
+
+    def __init__(self, offset: int, size: int):
+        super().__init__(f"upload exceeds declared size {size} bytes")
+        self.offset = offset
+        self.size = size
+
+
+def _ext(filename: Optional[str]) -> str:
+    ext = os.path.splitext(filename or '')[1].lower()
+    return ext if re.fullmatch(r'\.[a-z0-9]{1,8}', ext) else '.mp4'
+
+
+@contextlib.asynccontextmanager
+async def _file_lock(path: str, poll_s: float = 0.02):
+    """Межпроцессная блокировка flock на path, не блокирующая цикл событий: LOCK_NB + asyncio.sleep.
+    Снимается и при падении процесса-владельца."""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            while True:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(poll_s)
+        yield
+
+
+def file_sha256(path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class UploadStore:
+    def __init__(self, root: str, chunk_size: int = UPLOAD_CHUNK_SIZE):
+        self.root = root
+        self.incoming = os.path.join(root, '.incoming')
+        self.chunk_size = chunk_size
+        ensure_dir(self.incoming)
+        # хэш докачиваемых загрузок считается по мере прихода чанков: upload_id -> (смещение, sha256)
+        self._hashers: Dict[str, Tuple[int, "hashlib._Hash"]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def find(self, digest: str) -> Optional[str]:
+        """Уже загруженный файл с таким содержимым (по SHA-256) или None."""
+        found = glob.glob(os.path.join(self.root, glob.escape(digest) + '.*'))
+        return found[0] if found else None
+
+    async def _write_chunks(self, path: str, chunks: AsyncIterator[bytes], h, mode: str,
+                            limit: Optional[int] = None) -> Tuple[int, bool]:
+        """Пишет чанки, не больше limit байт. Возвращает (записано, был ли отброшен лишний остаток)."""
+        written = 0
+        async with aiofiles.open(path, mode) as f:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                overflow = limit is not None and written + len(chunk) > limit
+                if overflow:
+                    chunk = chunk[:limit - written]
+                h.update(chunk)
+                await f.write(chunk)
+                written += len(chunk)
+                if overflow:
+                    return written, True
+        return written, False
+
+    async def save(self, chunks: AsyncIterator[bytes], filename: Optional[str]) -> dict:
+        """Загрузка одним запросом: чанки пишутся во временный файл, потом дедупликация по хэшу."""
+        tmp = os.path.join(self.incoming, f"{uuid.uuid4()}.part")
+        h = hashlib.sha256()
+        try:
+            size, _ = await self._write_chunks(tmp, chunks, h, 'wb')
+        except BaseException:
+            if os.path.exists(tmp):
+                await aiofiles.os.remove(tmp)
+            raise
+        return await self._finalize(tmp, h.hexdigest(), size, filename)
+
+    async def _finalize(self, tmp: str, digest: str, size: int, filename: Optional[str]) -> dict:
+        # проверка «уже есть» и перенос — под блокировкой: иначе два процесса с одним содержимым
+        # оба не найдут файл и сохранят его дважды (например, .mp4 и .avi)
+        async with self._lock('dedup'), _file_lock(os.path.join(self.incoming, DEDUP_LOCK)):
+            existing = self.find(digest)
+            if existing:
+                await aiofiles.os.remove(tmp)
+                dest, dedup = existing, True
+            else:
+                dest, dedup = os.path.join(self.root, digest + _ext(filename)), False
+                await aiofiles.os.replace(tmp, dest)
+        return {"video_id": os.path.basename(dest), "path": dest, "sha256": digest, "size": size,
+                "filename": filename, "deduplicated": dedup}
+
+    def _lock(self, name: str) -> asyncio.Lock:
+        # flock разных open() одного процесса тоже исключают друг друга, но без fcntl нужна блокировка процесса
+        return self._locks.setdefault(name, asyncio.Lock())
+
+    # ---- докачка ----
+
+    def _paths(self, upload_id: str) -> Tuple[str, str]:
+        if not re.fullmatch(r'[0-9a-f-]{36}', upload_id):
+            raise KeyError(upload_id)
+        base = os.path.join(self.incoming, upload_id)
+        return base + '.part', base + '.json'
+
+    def _upload_lock(self, upload_id: str):
+        return _file_lock(os.path.join(self.incoming, upload_id + '.lock'))
+
+    def begin(self, filename: Optional[str], size: Optional[int] = None) -> dict:
+        upload_id = str(uuid.uuid4())
+        part, meta = self._paths(upload_id)
+        with open(meta, 'w') as f:
+            json.dump({"filename": filename, "size": size}, f)
+        open(part, 'wb').close()
+        self._hashers[upload_id] = (0, hashlib.sha256())
+        return {"upload_id": upload_id, "offset": 0}
+
+    def status(self, upload_id: str) -> dict:
+        part, meta = self._paths(upload_id)
+        if not os.path.exists(meta):
+            raise KeyError(upload_id)
+        with open(meta) as f:
+            info = json.load(f)
+        return {"upload_id": upload_id, "offset": os.path.getsize(part), **info}
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> int:
+        """Дописывает чанки с смещения offset (должно совпадать с уже принятым размером). Возвращает новое смещение.
+        Сверх заявленного size не пишется ничего: UploadSizeError, принятое до size остаётся."""
+        part, _ = self._paths(upload_id)
+        self.status(upload_id)
+        async with self._lock(upload_id), self._upload_lock(upload_id):
+            info = self.status(upload_id)
+            current, size = info["offset"], info.get("size")
+            if offset != current:
+                raise UploadOffsetError(current, offset)
+            pos, h = self._hashers.get(upload_id, (None, None))
+            if pos != current:
+                # загрузку начинал другой процесс / был перезапуск: хэш досчитаем целиком при завершении
+                h = None
+            try:
+                written, overflow = await self._write_chunks(part, chunks, h or hashlib.sha256(), 'ab',
+                                                             limit=None if size is None else max(size - current, 0))
+            except BaseException:
+                # обрыв посреди чанка: что успело записаться — неизвестно хэшу, досчитаем при завершении
+                self._hashers.pop(upload_id, None)
+                raise
+            if h is not None:
+                self._hashers[upload_id] = (current + written, h)
+            else:
+                self._hashers.pop(upload_id, None)
+            if overflow:
+                raise UploadSizeError(current + written, size)
+            return current + written
+
+    async def complete(self, upload_id: str) -> dict:
+        part, meta = self._paths(upload_id)
+        self.status(upload_id)  # KeyError до создания файла блокировки
+        # под блокировкой загрузки: параллельная докачка (в том числе из другого процесса) не допишет
+        # в .part, пока считается хэш, а повторный complete увидит, что загрузка уже завершена
+        async with self._lock(upload_id), self._upload_lock(upload_id):
+            info = self.status(upload_id)
+            if info.get("size") is not None and info["offset"] > info["size"]:
+                raise UploadSizeError(info["offset"], info["size"])
+            if info.get("size") is not None and info["offset"] < info["size"]:
+                raise UploadIncompleteError(info["offset"], info["size"])
+            pos, h = self._hashers.pop(upload_id, (None, None))
+            if pos == info["offset"]:
+                digest = h.hexdigest()
+            else:
+                digest = await asyncio.to_thread(file_sha256, part, self.chunk_size)
+            result = await self._finalize(part, digest, info["offset"], info.get("filename"))
+            await aiofiles.os.remove(meta)
+        self._locks.pop(upload_id, None)
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(self.incoming, upload_id + '.lock'))
+        return result
@@ -1,206 +1,383 @@
-# writer.py
-# Асинхронный писатель клипов — оптимизирован: в очереди храним JPEG-байты, а не сырые BGR-массивы.
-# Это существенно снижает потребление оперативной памяти.
-
-import threading
-import queue
-import traceback
-import cv2
-import numpy as np
-from typing import List, Tuple, Optional
-from collections import deque
-
-from detector import ViolationEvent, Detection
-
-# Параметры сжатия JPEG (качество 1..100). 80 — хорошее соотношение.
-JPEG_QUALITY = 80
-
-class ClipWriter:
-    """
-    Асинхронный писатель клипов (пул воркеров).
-    Экономит память: в задаче храним (frame_idx, jpg_bytes) вместо (frame_idx, ndarray).
-    Воркер декодирует jpeg -> ndarray только при записи.
-    """
-
-    def __init__(self, workers: int = 2, queue_max: int = 200, webhook: Optional[str] = None):
-        self.queue: "queue.Queue" = queue.Queue(maxsize=queue_max)
-        self.stop_event = threading.Event()
-        self.workers = []
-        self.webhook = webhook
-        for _ in range(workers):
-            t = threading.Thread(target=self._worker, daemon=True)
-            t.start()
-            self.workers.append(t)
-
-    def _worker(self):
-        while not self.stop_event.is_set():
-            try:
-                task = self.queue.get(timeout=0.5)
-            except queue.Empty:
-                continue
-            if task is None:
-                self.queue.task_done()
-                break
-            try:
-                self._process_task(task)
-            except Exception as e:
-                print("[WRITER] Exception:", e)
-                traceback.print_exc()
-            finally:
-                self.queue.task_done()
-
-    def _process_task(self, task: dict):
-        # task содержит: frames (list of (frame_idx, jpg_bytes)), fps, out_path, event, clip_detections
-        frames: List[Tuple[int, bytes]] = task.get('frames', [])
-        fps: float = task.get('fps', 25.0)
-        out_path: str = task.get('out_path')
-        ev: Optional[ViolationEvent] = task.get('event')
-        clip_detections: List[Detection] = task.get('clip_detections', [])
-
-        if not frames:
-            print("[WRITER] empty frames for", out_path)
-            return
-
-        # Декодируем первый кадр для получения размера
-        # frames[0] = (frame_idx, jpg_bytes)
-        first = frames[0]
-        if isinstance(first, tuple) and len(first) == 2:
-            _, jpg0 = first
-            arr = np.frombuffer(jpg0, dtype=np.uint8)
-            first_img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-            if first_img is None:
-                print("[WRITER] cannot decode first frame for", out_path, "- skipping")
-                return
-            h, w = first_img.shape[:2]
-        else:
-            print("[WRITER] unexpected frames format - skipping", out_path)
-            return
-
-        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-        writer = cv2.VideoWriter(out_path, fourcc, fps, (w, h))
-        if not writer.isOpened():
-            print("[WRITER] Failed to open VideoWriter for", out_path)
-            return
-
-        # подготовим детекции по кадру
-        dets_by_frame = {}
-        for d in clip_detections:
-            dets_by_frame.setdefault(d.frame_idx, []).append(d)
-
-        # iterate and write (decode each JPEG when needed)
-        for item in frames:
-            if not (isinstance(item, tuple) and len(item) == 2):
-                continue
-            f_idx, jpg_bytes = item
-            try:
-                arr = np.frombuffer(jpg_bytes, dtype=np.uint8)
-                f_img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-                if f_img is None:
-                    # если не удалось декодировать — пропускаем этот кадр
-                    print(f"[WRITER] failed to decode frame {f_idx} in {out_path}")
-                    continue
-            except Exception as e:
-                print(f"[WRITER] exception decoding frame {f_idx}: {e}")
-                continue
-
-            frame_copy = f_img  # уже отдельный массив после imdecode
-            # рисуем детекции для этого кадра (если есть)
-            for d in dets_by_frame.get(f_idx, []):
-                x1, y1, x2, y2 = d.bbox
-                color = (0,0,255) if d.class_name in ("no_glove","no_head","no_uniform","floor","table") else (0,200,0)
-                thickness = max(1, int(min(w,h) / 400))
-                cv2.rectangle(frame_copy, (x1,y1),(x2,y2), color, thickness=thickness)
-                label = f"{d.class_name} {d.conf:.2f}"
-                cv2.putText(frame_copy, label, (x1, max(0,y1-6)), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255,255,255), 1, cv2.LINE_AA)
-            # добавим таймстамп/индекс кадра
-            ts_text = f"{f_idx}  {f_idx/fps:.1f}s"
-            cv2.putText(frame_copy, ts_text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,0), 1, cv2.LINE_AA)
-
-            writer.write(frame_copy)
-
-        writer.release()
-
-        # обновляем событие
-        if ev is not None:
-            ev.clip_path = out_path
-            ev.saved = True
-            ev.pending = False
-            ev.enqueued = False
-
-        # webhook
-        if self.webhook and ev is not None:
-            try:
-                import requests
-                payload = {
-                    'event_id': ev.id,
-                    'class_names': ev.class_names,
-                    'avg_conf': sum(ev.confs)/len(ev.confs) if ev.confs else None,
-                    'time_s': ev.time_s,
-                    'wall_time_first': ev.wall_time_first,
-                    'clip_path': out_path
-                }
-                resp = requests.post(self.webhook, json=payload, timeout=5.0)
-                if 200 <= resp.status_code < 300:
-                    print(f"[WEBHOOK] sent for event {ev.id} -> {resp.status_code}")
-                else:
-                    print(f"[WEBHOOK] non-2xx for event {ev.id} -> {resp.status_code} {resp.text[:200]}")
-            except Exception as e:
-                print(f"[WRITER] webhook failed: {e}")
-
-        print(f"[WRITER] finished writing {out_path}")
-
-    def enqueue(self, frames_buffer: deque, event_frame_idx: int, fps: float, out_path: str,
-                all_detections: List[Detection], event: Optional[ViolationEvent],
-                pre_sec: int=3, post_sec: int=5) -> bool:
-        """
-        Собирает срез кадров из buffer и помещает задачу в очередь.
-        Теперь в frames_to_write кладём (frame_idx, jpeg_bytes) — экономия памяти.
-        """
-        pre_frames = int(round(pre_sec * fps))
-        post_frames = int(round(post_sec * fps))
-        start_idx = event_frame_idx - pre_frames
-        end_idx = event_frame_idx + post_frames
-        frames_to_write = []
-        available = [i for i,_ in frames_buffer]
-        if not available:
-            return False
-        max_idx = max(available)
-        end_idx_adj = min(end_idx, max_idx)
-        # собираем кадры: кодируем в JPEG bytes сразу (сжатые копии)
-        encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
-        for idx, f in frames_buffer:
-            if start_idx <= idx <= end_idx_adj:
-                try:
-                    # кодируем фрейм в JPEG
-                    success, jpg = cv2.imencode('.jpg', f, encode_params)
-                    if not success:
-                        print(f"[ENQUEUE] jpeg encode failed for frame {idx} (skipping)")
-                        continue
-                    jpg_bytes = jpg.tobytes()
-                    frames_to_write.append((idx, jpg_bytes))
-                except Exception as e:
-                    print(f"[ENQUEUE] exception encoding frame {idx}: {e}")
-                    continue
-
-        clip_dets = [d for d in all_detections if start_idx <= d.frame_idx <= end_idx_adj]
-        task = {'frames': frames_to_write, 'fps': fps, 'out_path': out_path, 'event': event, 'clip_detections': clip_dets}
-        try:
-            self.queue.put(task, block=False)
-            if event is not None:
-                event.enqueued = True
-            return True
-        except queue.Full:
-            print('[ENQUEUE] task queue full, dropping clip', out_path)
-            return False
-
-    def shutdown(self):
-        # дождаться всех задач и корректно остановить воркеры
-        self.queue.join()
-        self.stop_event.set()
-        for _ in self.workers:
-            try:
-                self.queue.put(None)
-            except Exception:
-                pass
-        for t in self.workers:
-            t.join(timeout=1.0)
+# writer.py
+# Асинхронный писатель клипов — оптимизирован: в очереди храним JPEG-байты, а не сырые BGR-массивы.
+# Это существенно снижает потребление оперативной памяти.
+# Очередь ограничена суммарным объёмом JPEG-кадров задач (max_bytes), а не числом задач: задача сверх бюджета
+# не выбрасывается, а её кадры сбрасываются в файл спула на диске (spool_dir) и читаются обратно воркером
+# при записи клипа. Выбрасываются только задачи, которые не помещаются и в спул (spool_max_bytes).
+
+import os
+import shutil
+import tempfile
+import threading
+import queue
+import time
+import traceback
+import cv2
+import numpy as np
+from typing import List, Tuple, Optional, Union
+
+from detector import ViolationEvent, Detection, DetectionStore
+from buffers import FrameRingBuffer, CompressedFrameBuffer, SourceSeekFrames
+import metrics
+from config import CLIP_QUEUE_MAX_BYTES, CLIP_SPOOL_DIR, CLIP_SPOOL_MAX_BYTES
+
+# Параметры сжатия JPEG (качество 1..100). 80 — хорошее соотношение.
+JPEG_QUALITY = 80
+
+class ClipWriter:
+    """
+    Асинхронный писатель клипов (пул воркеров).
+    Экономит память: в задаче храним (frame_idx, jpg_bytes) вместо (frame_idx, ndarray).
+    Воркер декодирует jpeg -> ndarray только при записи.
+    tracer (FlightRecorder) получает интервалы постановки клипа в очередь, записи и webhook
+    (с временем ожидания задачи в очереди).
+    max_bytes — бюджет JPEG-байт задач в памяти (0 — без ограничения); задачи сверх него уходят в спул:
+    каталог во временной директории (или в spool_dir), не больше spool_max_bytes (0 — спул выключен).
+    stats — сколько задач сброшено в спул (spilled), прочитано обратно (reloaded) и выброшено (dropped).
+    """
+
+    def __init__(self, workers: int = 2, max_bytes: int = CLIP_QUEUE_MAX_BYTES, webhook: Optional[str] = None,
+                 tracer=None, spool_dir: Optional[str] = CLIP_SPOOL_DIR, spool_max_bytes: int = CLIP_SPOOL_MAX_BYTES):
+        self.queue: "queue.Queue" = queue.Queue()
+        self.stop_event = threading.Event()
+        self.workers = []
+        self.webhook = webhook
+        self.tracer = tracer
+        self.max_bytes = max_bytes
+        self.spool_root = spool_dir
+        self.spool_max_bytes = spool_max_bytes
+        self.spool_dir: Optional[str] = None  # создаётся при первом сбросе
+        self.mem_bytes = 0     # JPEG-байты задач в очереди, хранящихся в памяти
+        self.spool_bytes = 0   # байты файлов спула
+        self.stats = {'spilled': 0, 'reloaded': 0, 'dropped': 0}
+        self._seq = 0
+        self._lock = threading.Lock()
+        for _ in range(workers):
+            t = threading.Thread(target=self._worker, daemon=True)
+            t.start()
+            self.workers.append(t)
+
+    def _worker(self):
+        while not self.stop_event.is_set():
+            try:
+                task = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if task is None:
+                self.queue.task_done()
+                break
+            metrics.WRITER_QUEUE.dec()
+            t0 = time.perf_counter()
+            t_span = self.tracer.begin() if self.tracer is not None else 0
+            try:
+                if 'spool' in task:
+                    self._reload(task)
+                self._process_task(task)
+            except Exception as e:
+                metrics.CLIPS.labels('failed').inc()
+                print("[WRITER] Exception:", e)
+                traceback.print_exc()
+            finally:
+                metrics.CLIP_WRITE_SECONDS.observe(time.perf_counter() - t0)
+                if self.tracer is not None:
+                    self.tracer.span('clip_write', t_span, cat='clip',
+                                     args={'clip': os.path.basename(task.get('out_path') or ''),
+                                           'queue_wait_ms': round((t_span - task.get('enqueued_ns', t_span)) / 1e6, 2)})
+                self._release(task)
+                self.queue.task_done()
+
+    def _process_task(self, task: dict):
+        # task содержит: fps, out_path, event, clip_detections и источник кадров:
+        # либо frames (list of (frame_idx, jpg_bytes)), либо source + start_idx/end_idx (чтение из исходного видео)
+        fps: float = task.get('fps', 25.0)
+        out_path: str = task.get('out_path')
+        ev: Optional[ViolationEvent] = task.get('event')
+        clip_detections: List[Detection] = task.get('clip_detections', [])
+
+        if task.get('source'):
+            frames = self._read_source(task['source'], task['start_idx'], task['end_idx'], out_path)
+        else:
+            jpg_frames: List[Tuple[int, bytes]] = task.get('frames', [])
+            if not jpg_frames:
+                print("[WRITER] empty frames for", out_path)
+                return
+            frames = self._decode_jpegs(jpg_frames, out_path)
+
+        # подготовим детекции по кадру
+        dets_by_frame = {}
+        for d in clip_detections:
+            dets_by_frame.setdefault(d.frame_idx, []).append(d)
+
+        # VideoWriter открываем по размеру первого полученного кадра
+        writer = None
+        for f_idx, frame_copy in frames:
+            if writer is None:
+                h, w = frame_copy.shape[:2]
+                fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+                writer = cv2.VideoWriter(out_path, fourcc, fps, (w, h))
+                if not writer.isOpened():
+                    print("[WRITER] Failed to open VideoWriter for", out_path)
+                    return
+            # рисуем детекции для этого кадра (если есть)
+            for d in dets_by_frame.get(f_idx, []):
+                x1, y1, x2, y2 = d.bbox
+                color = (0,0,255) if d.class_name in ("no_glove","no_head","no_uniform","floor","table") else (0,200,0)
+                thickness = max(1, int(min(w,h) / 400))
+                cv2.rectangle(frame_copy, (x1,y1),(x2,y2), color, thickness=thickness)
+                label = f"{d.class_name} {d.conf:.2f}"
+                cv2.putText(frame_copy, label, (x1, max(0,y1-6)), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255,255,255), 1, cv2.LINE_AA)
+            # добавим таймстамп/индекс кадра
+            ts_text = f"{f_idx}  {f_idx/fps:.1f}s"
+            cv2.putText(frame_copy, ts_text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,0), 1, cv2.LINE_AA)
+
+            writer.write(frame_copy)
+
+        if writer is None:
+            print("[WRITER] no decodable frames for", out_path, "- skipping")
+            return
+        writer.release()
+
+        # обновляем событие
+        if ev is not None:
+            ev.clip_path = out_path
+            ev.saved = True
+            ev.pending = False
+            ev.enqueued = False
+
+        # webhook
+        if self.webhook and ev is not None:
+            t0 = time.perf_counter()
+            t_span = self.tracer.begin() if self.tracer is not None else 0
+            try:
+                import requests
+                payload = {
+                    'event_id': ev.id,
+                    'class_names': ev.class_names,
+                    'avg_conf': sum(ev.confs)/len(ev.confs) if ev.confs else None,
+                    'time_s': ev.time_s,
+                    'wall_time_first': ev.wall_time_first,
+                    'clip_path': out_path
+                }
+                resp = requests.post(self.webhook, json=payload, timeout=5.0)
+                if 200 <= resp.status_code < 300:
+                    metrics.WEBHOOK.labels('ok').inc()
+                    print(f"[WEBHOOK] sent for event {ev.id} -> {resp.status_code}")
+                else:
+                    metrics.WEBHOOK.labels('non_2xx').inc()
+                    print(f"[WEBHOOK] non-2xx for event {ev.id} -> {resp.status_code} {resp.text[:200]}")
+            except Exception as e:
+                metrics.WEBHOOK.labels('error').inc()
+                print(f"[WRITER] webhook failed: {e}")
+            metrics.WEBHOOK_SECONDS.observe(time.perf_counter() - t0)
+            if self.tracer is not None:
+                self.tracer.span('webhook', t_span, cat='clip', args={'event': ev.id})
+
+        metrics.CLIPS.labels('written').inc()
+        print(f"[WRITER] finished writing {out_path}")
+
+    def _decode_jpegs(self, frames: List[Tuple[int, bytes]], out_path: str):
+        """Декодирует JPEG-кадры задачи по одному (только при записи)."""
+        for item in frames:
+            if not (isinstance(item, tuple) and len(item) == 2):
+                continue
+            f_idx, jpg_bytes = item
+            try:
+                arr = np.frombuffer(jpg_bytes, dtype=np.uint8)
+                f_img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+                if f_img is None:
+                    # если не удалось декодировать — пропускаем этот кадр
+                    print(f"[WRITER] failed to decode frame {f_idx} in {out_path}")
+                    continue
+            except Exception as e:
+                print(f"[WRITER] exception decoding frame {f_idx}: {e}")
+                continue
+            yield f_idx, f_img  # уже отдельный массив после imdecode
+
+    def _read_source(self, source: str, start_idx: int, end_idx: int, out_path: str):
+        """Читает кадры [start_idx, end_idx] прямо из исходного видео (своим reader'ом с seek)."""
+        cap = cv2.VideoCapture(source)
+        try:
+            if not cap.isOpened():
+                print("[WRITER] cannot open source", source, "for", out_path)
+                return
+            if start_idx > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start_idx)
+            for f_idx in range(start_idx, end_idx + 1):
+                ret, f_img = cap.read()
+                if not ret:
+                    break
+                yield f_idx, f_img
+        finally:
+            cap.release()
+
+    def enqueue(self, frames_buffer: Union[FrameRingBuffer, CompressedFrameBuffer, SourceSeekFrames],
+                event_frame_idx: int, fps: float, out_path: str,
+                all_detections: DetectionStore, event: Optional[ViolationEvent],
+                pre_sec: int=3, post_sec: int=5) -> bool:
+        """
+        Собирает срез кадров из buffer и помещает задачу в очередь.
+        Теперь в frames_to_write кладём (frame_idx, jpeg_bytes) — экономия памяти.
+        Кадры берутся из кольцевого буфера по диапазону индексов, без обхода всего буфера.
+        Если буфер уже хранит JPEG (CompressedFrameBuffer), задача просто ссылается на его байты.
+        Для SourceSeekFrames кадры не копируются вовсе: воркер сам прочитает окно из исходного файла.
+        """
+        t_span = self.tracer.begin() if self.tracer is not None else 0
+        pre_frames = int(round(pre_sec * fps))
+        post_frames = int(round(post_sec * fps))
+        start_idx = event_frame_idx - pre_frames
+        end_idx = event_frame_idx + post_frames
+        if isinstance(frames_buffer, SourceSeekFrames):
+            if frames_buffer.total > 0:
+                end_idx = min(end_idx, frames_buffer.total - 1)
+            start_idx = max(0, start_idx)
+            clip_dets = all_detections.range(start_idx, end_idx)
+            task = {'source': frames_buffer.source_path, 'start_idx': start_idx, 'end_idx': end_idx,
+                    'fps': fps, 'out_path': out_path, 'event': event, 'clip_detections': clip_dets}
+            return self._put(task, event, out_path, t_span)
+
+        frames_to_write = []
+        if frames_buffer.last_idx < 0:
+            return False
+        end_idx_adj = min(end_idx, frames_buffer.last_idx)
+        if frames_buffer.encoded:
+            frames_to_write = frames_buffer.get_range(start_idx, end_idx_adj)
+        else:
+            # собираем кадры: кодируем в JPEG bytes сразу (сжатые копии)
+            t0 = time.perf_counter()
+            encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
+            for idx, f in frames_buffer.get_range(start_idx, end_idx_adj):
+                try:
+                    # кодируем фрейм в JPEG
+                    success, jpg = cv2.imencode('.jpg', f, encode_params)
+                    if not success:
+                        print(f"[ENQUEUE] jpeg encode failed for frame {idx} (skipping)")
+                        continue
+                    jpg_bytes = jpg.tobytes()
+                    frames_to_write.append((idx, jpg_bytes))
+                except Exception as e:
+                    print(f"[ENQUEUE] exception encoding frame {idx}: {e}")
+                    continue
+            metrics.CLIP_ENCODE_SECONDS.observe(time.perf_counter() - t0)
+
+        clip_dets = all_detections.range(start_idx, end_idx_adj)
+        task = {'frames': frames_to_write, 'fps': fps, 'out_path': out_path, 'event': event, 'clip_detections': clip_dets}
+        return self._put(task, event, out_path, t_span)
+
+    def _put(self, task: dict, event: Optional[ViolationEvent], out_path: str, t_span: int = 0) -> bool:
+        if self.tracer is not None:
+            task['enqueued_ns'] = self.tracer.begin()
+        n_frames = len(task.get('frames', ()))
+        nbytes = sum(len(jpg) for _, jpg in task.get('frames', ()))
+        with self._lock:
+            # одна задача проходит в память всегда — иначе клип длиннее бюджета никогда бы не миновал диск
+            in_memory = self.max_bytes <= 0 or self.mem_bytes == 0 or self.mem_bytes + nbytes <= self.max_bytes
+            if in_memory:
+                self.mem_bytes += nbytes
+                task['nbytes'] = nbytes
+        ok = in_memory or self._spill(task, nbytes, out_path)
+        if ok:
+            # до put: воркер может взять задачу раньше, чем мы вернёмся
+            metrics.WRITER_QUEUE.inc()
+            metrics.WRITER_QUEUE_BYTES.labels('spool' if 'spool' in task else 'memory').inc(nbytes)
+            self.queue.put(task)
+            metrics.CLIPS.labels('enqueued').inc()
+            if event is not None:
+                event.enqueued = True
+        else:
+            with self._lock:
+                self.stats['dropped'] += 1
+            metrics.CLIPS.labels('dropped').inc()
+            print('[ENQUEUE] writer queue and spool are full, dropping clip', out_path)
+        if self.tracer is not None:
+            self.tracer.span('clip_enqueue' if ok else 'clip_dropped', t_span, cat='clip',
+                             args={'clip': os.path.basename(out_path), 'frames': n_frames,
+                                   'spilled': 'spool' in task})
+            self.tracer.counter('writer_queue', self.queue.qsize())
+            self.tracer.counter('writer_queue_mb', round(self.mem_bytes / 1e6, 2))
+        return ok
+
+    def _spill(self, task: dict, nbytes: int, out_path: str) -> bool:
+        """Сбрасывает JPEG-кадры задачи в файл спула; в задаче остаются путь и (frame_idx, длина) кадров."""
+        with self._lock:
+            if self.spool_bytes + nbytes > self.spool_max_bytes:
+                return False
+            self.spool_bytes += nbytes  # резервируем место, пока пишем файл
+            self._seq += 1
+            seq = self._seq
+        t_span = self.tracer.begin() if self.tracer is not None else 0
+        try:
+            with self._lock:
+                if self.spool_dir is None:
+                    if self.spool_root:
+                        os.makedirs(self.spool_root, exist_ok=True)
+                    self.spool_dir = tempfile.mkdtemp(prefix='clip_spool_', dir=self.spool_root)
+            path = os.path.join(self.spool_dir, f'{seq:06d}.jpgs')
+            with open(path, 'wb') as f:
+                for _, jpg in task['frames']:
+                    f.write(jpg)
+        except OSError as e:
+            print(f"[ENQUEUE] spool write failed for {out_path}: {e}")
+            with self._lock:
+                self.spool_bytes -= nbytes
+            return False
+        task['spool'] = (path, [(idx, len(jpg)) for idx, jpg in task['frames']])
+        task['frames'] = []
+        task['nbytes'] = nbytes
+        with self._lock:
+            self.stats['spilled'] += 1
+        metrics.CLIPS.labels('spilled').inc()
+        print(f"[ENQUEUE] writer queue over {self.max_bytes} bytes, spilled clip {out_path} ({nbytes} bytes) to disk")
+        if self.tracer is not None:
+            self.tracer.span('clip_spill', t_span, cat='clip', args={'clip': os.path.basename(out_path), 'bytes': nbytes})
+        return True
+
+    def _reload(self, task: dict):
+        """Читает кадры сброшенной задачи обратно: один read файла, кадры — срезы без копирования."""
+        t_span = self.tracer.begin() if self.tracer is not None else 0
+        path, index = task['spool']
+        with open(path, 'rb') as f:
+            data = memoryview(f.read())
+        frames, pos = [], 0
+        for idx, length in index:
+            frames.append((idx, data[pos:pos + length]))
+            pos += length
+        task['frames'] = frames
+        with self._lock:
+            self.stats['reloaded'] += 1
+        metrics.CLIPS.labels('reloaded').inc()
+        if self.tracer is not None:
+            self.tracer.span('clip_reload', t_span, cat='clip',
+                             args={'clip': os.path.basename(task.get('out_path') or ''), 'bytes': pos})
+
+    def _release(self, task: dict):
+        """Задача записана (или упала): освобождаем её место в бюджете памяти или спула."""
+        nbytes = task.get('nbytes', 0)
+        metrics.WRITER_QUEUE_BYTES.labels('spool' if 'spool' in task else 'memory').dec(nbytes)
+        if 'spool' in task:
+            try:
+                os.remove(task['spool'][0])
+            except OSError:
+                pass
+            with self._lock:
+                self.spool_bytes -= nbytes
+        else:
+            with self._lock:
+                self.mem_bytes -= nbytes
+        task['frames'] = []
+
+    def shutdown(self):
+        # дождаться всех задач и корректно остановить воркеры
+        self.queue.join()
+        self.stop_event.set()
+        for _ in self.workers:
+            try:
+                self.queue.put(None)
+            except Exception:
+                pass
+        for t in self.workers:
+            t.join(timeout=1.0)
+        if any(self.stats.values()):
+            print("[WRITER] clips spilled to disk: {spilled}, reloaded: {reloaded}, dropped: {dropped}".format(**self.stats))
+        if self.spool_dir is not None:
+            shutil.rmtree(self.spool_dir, ignore_errors=True)
+            self.spool_dir = None